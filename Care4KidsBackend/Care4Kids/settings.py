@@ -15,9 +15,57 @@ load_dotenv()
 # Gemini API configuration
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# Optional: Add validation
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable is not set")
+# Validated when the chatbot first builds its model (utils.gemini) so that
+# migrations, admin and other processes don't need the key
+
+# Model used by the chatbot; the factory is a dotted path so benchmarks can
+# swap in utils.fakes.FakeGenerativeModel
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash")
+GEMINI_MODEL_FACTORY = os.getenv(
+    "GEMINI_MODEL_FACTORY", "utils.gemini.build_gemini_model"
+)
+
+# Identical in-flight prompts share one upstream call; calls get a deadline
+# and a circuit breaker. At most max_concurrency calls run and max_queue
+# wait; further calls get the fallback reply at once. Set hedge_percentile
+# (e.g. 95) to send a second request once the first is slower than that
+# latency percentile.
+GEMINI_RESILIENCE = {
+    "enabled": True,
+    "timeout": float(os.getenv("GEMINI_TIMEOUT", "10")),
+    "max_concurrency": 16,
+    "max_queue": 32,
+    "failure_threshold": 5,
+    "reset_timeout": 30.0,
+    "hedge_percentile": None,
+    "hedge_min_samples": 50,
+}
+# Curated parenting passages injected into chatbot prompts; the BM25 index
+# is built on first use (or with `manage.py build_retrieval_index`) into a
+# subdirectory of RETRIEVAL_INDEX_DIR named after the corpus hash, and
+# memory-mapped from there. A failed load is retried after
+# RETRIEVAL_RETRY_INTERVAL seconds
+RETRIEVAL_CORPUS = BASE_DIR / "api" / "data" / "parenting_corpus.jsonl"
+RETRIEVAL_INDEX_DIR = Path(
+    os.getenv("RETRIEVAL_INDEX_DIR", BASE_DIR / "var" / "retrieval_index")
+)
+RETRIEVAL_TOP_K = 3
+RETRIEVAL_RETRY_INTERVAL = 60
+
+# Daily chatbot quotas (0 = unlimited), checked in memory before each
+# Gemini call; usage is flushed to MongoDB in batches every interval
+LLM_QUOTAS = {
+    "user_daily_tokens": int(os.getenv("LLM_USER_DAILY_TOKENS", "50000")),
+    "user_daily_requests": int(os.getenv("LLM_USER_DAILY_REQUESTS", "200")),
+    "family_daily_tokens": int(os.getenv("LLM_FAMILY_DAILY_TOKENS", "150000")),
+    "family_daily_requests": int(os.getenv("LLM_FAMILY_DAILY_REQUESTS", "500")),
+}
+LLM_USAGE_FLUSH_INTERVAL = 10
+
+GEMINI_FALLBACK_REPLY = (
+    "Ahora mismo tengo muchas consultas y no puedo responder. "
+    "Por favor, inténtalo de nuevo en unos minutos."
+)
 
 
 # Quick-start development settings - unsuitable for production
@@ -48,6 +96,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.middleware.RequestMetricsMiddleware",
+    "api.middleware.RequestIdMiddleware",
+    "api.middleware.ProfilingMiddleware",
+    "api.middleware.CompressionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -58,6 +110,43 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Response compression negotiated from Accept-Encoding. Brotli is used
+# when the optional `brotli` package is installed, gzip otherwise
+COMPRESSION = {
+    "ENABLED": os.getenv("COMPRESSION_ENABLED", "true").lower() == "true",
+    "MIN_SIZE": 1024,
+    "GZIP_LEVEL": 6,
+    "BROTLI_QUALITY": 4,
+}
+
+# On-demand profiling: requests carrying an X-Profile token from
+# /api/profiling/token/ (staff only), and SAMPLE_RATE of all requests, are
+# run under cProfile (and tracemalloc on request); the newest MAX_PROFILES
+# are kept in DIR for download. Disabled, the middleware is not installed
+PROFILING = {
+    "ENABLED": os.getenv("PROFILING_ENABLED", "false").lower() == "true",
+    "SAMPLE_RATE": float(os.getenv("PROFILING_SAMPLE_RATE", "0")),
+    "DIR": Path(os.getenv("PROFILING_DIR", BASE_DIR / "var" / "profiles")),
+    "MAX_PROFILES": 200,
+    "TOKEN_MAX_AGE": 3600,
+    "TRACEMALLOC_FRAMES": 10,
+    "TRACE_TTL": 600,
+    "TOP": 50,
+}
+
+# SQL query budgets declared on API views with @query_budget: "raise"
+# fails the request (development), "log" logs and counts overruns and
+# queries repeated N_PLUS_ONE_THRESHOLD times (N+1), "off" skips the check
+QUERY_BUDGETS = {
+    "MODE": os.getenv("QUERY_BUDGET_MODE", "raise" if DEBUG else "log"),
+    "N_PLUS_ONE_THRESHOLD": 3,
+}
+
+# Request metrics (latency, SQL, MongoDB and Gemini timings) exported in
+# Prometheus text format at /api/metrics/ for local scrapers only
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
+
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -78,6 +167,7 @@ CORS_ALLOW_HEADERS = [
     "user-agent",
     "x-csrftoken",
     "x-requested-with",
+    "x-request-id",
 ]
 
 ROOT_URLCONF = "Care4Kids.urls"
@@ -102,6 +192,8 @@ MONGODB_SETTINGS = {
     "host": "127.0.0.1",
     "port": 27017,
     "database": "Care4Kids",
+    # Optional dotted path to a MongoClient-compatible class
+    "client_class": os.getenv("MONGODB_CLIENT_CLASS", ""),
 }
 
 WSGI_APPLICATION = "Care4Kids.wsgi.application"
@@ -117,19 +209,154 @@ DATABASES = {
     }
 }
 
+# LocMemCache is per process: set REDIS_URL (requires the `redis` package)
+# when running several workers so cache invalidation reaches all of them
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        }
+    }
+
+# Location pings: a ping is stored only if the device moved MIN_DISTANCE_M
+# or MAX_INTERVAL_S passed since the last stored one; geofences are
+# bucketed into GEOFENCE_CELL_DEG grid cells for lookup
+LOCATION_INGEST = {
+    "MAX_BATCH": 500,
+    "MIN_DISTANCE_M": 25,
+    "MAX_INTERVAL_S": 300,
+    "GEOFENCE_CELL_DEG": 0.01,
+}
+
+# Device heartbeats are kept in memory and flushed to MongoDB every
+# FLUSH_INTERVAL seconds; devices silent for OFFLINE_AFTER seconds read as
+# offline and are marked so by a sweep every SWEEP_INTERVAL seconds
+PRESENCE = {
+    "HEARTBEAT_INTERVAL": 60,
+    "OFFLINE_AFTER": 180,
+    "FLUSH_INTERVAL": 5,
+    "SWEEP_INTERVAL": 30,
+}
+
+# Family exports stream CHUNK_SIZE rows per chunk; NDJSON resume cursors
+# stay valid for CURSOR_MAX_AGE seconds
+FAMILY_EXPORT = {
+    "CHUNK_SIZE": 500,
+    "CURSOR_MAX_AGE": 7 * 24 * 3600,
+    "ZIP_FLUSH_BYTES": 64 * 1024,
+}
+
+# Onboarding CSV imports commit and checkpoint BATCH_SIZE rows at a time;
+# child codes they create stay valid for CHILD_CODE_TTL_HOURS
+BULK_IMPORT = {
+    "BATCH_SIZE": 500,
+    "CHILD_CODE_TTL_HOURS": 7 * 24,
+    "MAX_REPORTED_ERRORS": 1000,
+}
+
+# Outgoing mail (invitation codes, welcome emails) is queued in the
+# database and sent by `manage.py run_email_worker`
+EMAIL_BACKEND = os.getenv(
+    "EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend"
+)
+EMAIL_HOST = os.getenv("EMAIL_HOST", "localhost")
+EMAIL_PORT = int(os.getenv("EMAIL_PORT", "25"))
+EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER", "")
+EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD", "")
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "false").lower() == "true"
+EMAIL_TIMEOUT = int(os.getenv("EMAIL_TIMEOUT", "30"))
+DEFAULT_FROM_EMAIL = os.getenv(
+    "DEFAULT_FROM_EMAIL", "Care4Kids <no-reply@care4kids.app>"
+)
+
+# Each worker thread claims BATCH_SIZE due emails at a time and sends them
+# over one reused connection; failures retry after BACKOFF_BASE * 2^n
+# seconds (jittered, at most BACKOFF_MAX) until MAX_ATTEMPTS. A claim is
+# renewed before each message and released CLAIM_TIMEOUT seconds after its
+# last renewal (a crashed worker); it must exceed twice EMAIL_TIMEOUT
+EMAIL_QUEUE = {
+    "THREADS": 2,
+    "BATCH_SIZE": 50,
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF_BASE": 30,
+    "BACKOFF_MAX": 3600,
+    "POLL_INTERVAL": 2,
+    "CLAIM_TIMEOUT": 300,
+}
+
+# Push notifications to every parent of a family: events are queued in
+# memory, coalesced per parent for COALESCE_WINDOW seconds and sent in
+# batches of BATCH_SIZE from WORKERS threads. PROVIDER is a PushProvider
+# class path: set PUSH_PROVIDER=api.notifications.FcmPushProvider in
+# production; the default one only logs and delivers nothing
+NOTIFICATIONS = {
+    "PROVIDER": os.getenv("PUSH_PROVIDER", "api.notifications.LoggingPushProvider"),
+    "FCM_PROJECT_ID": os.getenv("FCM_PROJECT_ID", ""),
+    "FCM_CREDENTIALS_FILE": os.getenv("FCM_CREDENTIALS_FILE", ""),
+    "WORKERS": 4,
+    "BATCH_SIZE": 100,
+    "COALESCE_WINDOW": 2,
+    "DEDUP_TTL": 600,
+    "ROSTER_TTL": 60,
+    "MAX_PER_RECIPIENT": 3,
+}
+
+# Linked device lookups (device_id -> family/child) cached per process
+DEVICE_CACHE = {"MAXSIZE": 50000, "TTL": 300}
+
+# Compiled per-child app policies are cached per process; rule changes
+# reach other workers within this many seconds
+APP_POLICY_CACHE_TTL = 30
+
+# Cached profile responses are keyed by a per-user version bumped on save.
+# Needs a shared cache (REDIS_URL): with LocMemCache it is bypassed
+PROFILE_CACHE_TIMEOUT = 24 * 3600
+
+# Stateless auth: login also returns short-lived signed access tokens
+# (plus refresh tokens) that authenticate without a database lookup.
+# Revoked token ids are synced into memory every REVOCATION_SYNC_INTERVAL
+# seconds, so a revocation takes effect in other workers within that delay
+SIGNED_TOKENS = {
+    "ENABLED": os.getenv("SIGNED_TOKENS_ENABLED", "false").lower() == "true",
+    "SIGNING_KEY": os.getenv("SIGNED_TOKENS_SIGNING_KEY") or None,  # SECRET_KEY
+    "ACCESS_TTL": int(os.getenv("SIGNED_TOKENS_ACCESS_TTL", "900")),
+    "REFRESH_TTL": int(os.getenv("SIGNED_TOKENS_REFRESH_TTL", str(14 * 24 * 3600))),
+    "REVOCATION_SYNC_INTERVAL": 30,
+}
+
+# Parents created without a password (bulk import) get a signed link to
+# URL?token=... in their welcome email; the app posts the token and the new
+# password to /api/auth/set-password/. Tokens expire after TOKEN_TTL seconds
+PASSWORD_SETUP = {
+    "URL": os.getenv("PASSWORD_SETUP_URL", "https://care4kids.app/set-password"),
+    "TOKEN_TTL": 7 * 24 * 3600,
+}
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
+        "api.authentication.SignedTokenAuthentication",
         "rest_framework.authentication.TokenAuthentication",
         #'rest_framework.authentication.SessionAuthentication',
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.AllowAny",
     ],
+    # JSON stays the default; MessagePack is picked via Accept/Content-Type
     "DEFAULT_RENDERER_CLASSES": [
         "rest_framework.renderers.JSONRenderer",
+        "api.renderers.MessagePackRenderer",
     ],
     "DEFAULT_PARSER_CLASSES": [
         "rest_framework.parsers.JSONParser",
+        "api.parsers.MessagePackParser",
     ],
 }
 
@@ -153,6 +380,42 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Login looks users up by email once (instead of email then username);
+# ModelBackend stays for username logins such as the admin
+AUTHENTICATION_BACKENDS = [
+    "api.backends.EmailBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+
+# Password hashing profile: "pbkdf2" (default), "argon2" (needs argon2-cffi)
+# or "bcrypt" (needs bcrypt). Hashes made with another profile or other
+# parameters keep verifying and are rehashed on the next successful login.
+PASSWORD_HASHER_PROFILE = os.getenv("PASSWORD_HASHER_PROFILE", "pbkdf2")
+PASSWORD_HASHER_PARAMS = {
+    "argon2": {"time_cost": 2, "memory_cost": 19456, "parallelism": 1},
+    "bcrypt": {"rounds": 12},
+    "pbkdf2": {},  # Django's default iteration count
+}
+_PASSWORD_HASHER_CLASSES = {
+    "argon2": "api.hashers.TunedArgon2PasswordHasher",
+    "bcrypt": "api.hashers.TunedBCryptSHA256PasswordHasher",
+    "pbkdf2": "api.hashers.TunedPBKDF2PasswordHasher",
+}
+PASSWORD_HASHERS = [_PASSWORD_HASHER_CLASSES[PASSWORD_HASHER_PROFILE]] + [
+    path
+    for profile, path in _PASSWORD_HASHER_CLASSES.items()
+    if profile != PASSWORD_HASHER_PROFILE
+]
+
+# Login password checks run on this many threads (0 = on the request thread);
+# beyond workers + max_pending queued checks, logins get a 503 after wait_timeout
+PASSWORD_HASHING_POOL = {
+    "workers": int(os.getenv("PASSWORD_HASHING_WORKERS", "0")),
+    "max_pending": int(os.getenv("PASSWORD_HASHING_MAX_PENDING", "16")),
+    "wait_timeout": 2.0,
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -175,23 +438,45 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Records are stamped with the request ID, queued without blocking and
+# written as JSON lines by a background thread (see utils.log)
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "formatters": {
+        "json": {
+            "()": "utils.log.JsonFormatter",
+        },
+    },
+    "filters": {
+        "request_id": {
+            "()": "utils.log.RequestIdFilter",
+        },
+    },
     "handlers": {
         "console": {
-            "class": "logging.StreamHandler",
+            "class": "utils.log.BoundedQueueHandler",
+            "formatter": "json",
+            "filters": ["request_id"],
+            "maxsize": 10000,
         },
     },
+    # Anything not configured below still goes through the queued handler
+    "root": {
+        "handlers": ["console"],
+        "level": "WARNING",
+    },
     "loggers": {
-        "utils.mongodb": {
+        "utils": {
             "handlers": ["console"],
             "level": "INFO",
             "propagate": False,
         },
+        # Debug calls return before formatting or queueing at INFO; set
+        # API_LOG_LEVEL=DEBUG to see them
         "api": {
             "handlers": ["console"],
-            "level": "DEBUG",
+            "level": os.getenv("API_LOG_LEVEL", "INFO"),
             "propagate": False,
         },
     },
@@ -0,0 +1,224 @@
+import bisect
+import hashlib
+import json
+import threading
+import uuid
+from dataclasses import dataclass, field, replace
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.utils import timezone
+
+from .bedtime import get_zone
+from .families import DEFAULT_FAMILY_SETTINGS, get_families_collection
+
+ALLOW = "allow"
+DENY = "deny"
+SCHEDULE = "schedule"
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def _minutes(value):
+    hours, minutes = value.split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+@dataclass(frozen=True)
+class AppPolicy:
+    """
+    Compiled app rules of one child.
+
+    ``allowed``/``denied`` are hash sets of app ids; ``windows`` maps an app
+    id to seven (Monday first) sorted, non-overlapping lists of minute
+    intervals during which a scheduled app may run. may_run() does two set
+    lookups and one bisect over a handful of intervals.
+    """
+
+    enabled: bool
+    timezone: str
+    default_allow: bool
+    allowed: frozenset
+    denied: frozenset
+    windows: dict
+    # Flattened interval starts, kept alongside windows for bisect
+    _starts: dict = field(default_factory=dict, repr=False, compare=False)
+    etag: str = ""
+
+    def may_run(self, app_id, at=None):
+        if not self.enabled or app_id in self.allowed:
+            return True
+        if app_id in self.denied:
+            return False
+        days = self.windows.get(app_id)
+        if days is None:
+            return self.default_allow
+        local = (at or timezone.now()).astimezone(get_zone(self.timezone))
+        weekday = local.weekday()
+        minute = local.hour * 60 + local.minute
+        intervals = days[weekday]
+        index = bisect.bisect_right(self._starts[app_id][weekday], minute) - 1
+        return index >= 0 and minute < intervals[index][1]
+
+    def as_dict(self):
+        """Snapshot devices can evaluate locally"""
+        return {
+            "enabled": self.enabled,
+            "timezone": self.timezone,
+            "default": ALLOW if self.default_allow else DENY,
+            "allowed": sorted(self.allowed),
+            "denied": sorted(self.denied),
+            "windows": {
+                app_id: [[list(interval) for interval in day] for day in days]
+                for app_id, days in sorted(self.windows.items())
+            },
+        }
+
+
+def compile_policy(child, family_settings):
+    """Compile a family document's child entry into an AppPolicy"""
+    allowed, denied, windows = set(), set(), {}
+    for rule in child.get("app_rules") or []:
+        app_id = rule["app_id"]
+        if rule["action"] == ALLOW:
+            allowed.add(app_id)
+        elif rule["action"] == DENY:
+            denied.add(app_id)
+        else:
+            days = windows.setdefault(app_id, [[] for _ in range(7)])
+            for window in rule.get("windows") or []:
+                start, end = _minutes(window["start"]), _minutes(window["end"])
+                for day in window.get("days") or range(7):
+                    if start < end:
+                        days[day].append((start, end))
+                    else:
+                        # Crosses midnight: split across the two days
+                        days[day].append((start, MINUTES_PER_DAY))
+                        days[(day + 1) % 7].append((0, end))
+    # An app listed under several actions: deny wins, then allow
+    allowed -= denied
+    windows = {
+        app_id: tuple(tuple(_merge(day)) for day in days)
+        for app_id, days in windows.items()
+        if app_id not in allowed and app_id not in denied
+    }
+    policy = AppPolicy(
+        enabled=bool(
+            (child.get("monitoring_settings") or {}).get("app_restrictions_enabled")
+        ),
+        timezone=(family_settings or {}).get("timezone")
+        or DEFAULT_FAMILY_SETTINGS["timezone"],
+        default_allow=child.get("app_policy_default", ALLOW) == ALLOW,
+        allowed=frozenset(allowed),
+        denied=frozenset(denied),
+        windows=windows,
+        _starts={
+            app_id: tuple(tuple(start for start, _ in day) for day in days)
+            for app_id, days in windows.items()
+        },
+    )
+    digest = hashlib.sha1(
+        json.dumps(policy.as_dict(), sort_keys=True).encode()
+    ).hexdigest()[:16]
+    return replace(policy, etag=digest)
+
+
+_lock = threading.Lock()
+_cache = TTLCache(maxsize=50000, ttl=getattr(settings, "APP_POLICY_CACHE_TTL", 30))
+
+
+def get_policy(family_id, child_id):
+    """
+    Compiled policy for a child, cached per process.
+
+    Rule changes made through this module drop the local entry at once;
+    other processes pick them up within APP_POLICY_CACHE_TTL seconds.
+    Returns None if the child doesn't exist.
+    """
+    key = (family_id, child_id)
+    with _lock:
+        policy = _cache.get(key)
+    if policy is not None:
+        return policy
+
+    family = get_families_collection().find_one(
+        {"family_id": family_id},
+        projection={
+            "family_settings.timezone": 1,
+            "children.child_id": 1,
+            "children.app_rules": 1,
+            "children.app_policy_default": 1,
+            "children.monitoring_settings.app_restrictions_enabled": 1,
+        },
+    )
+    for child in (family or {}).get("children") or []:
+        if child.get("child_id") == child_id:
+            policy = compile_policy(child, family.get("family_settings"))
+            with _lock:
+                _cache[key] = policy
+            return policy
+    return None
+
+
+def invalidate_policy(family_id, child_id):
+    with _lock:
+        _cache.pop((family_id, child_id), None)
+
+
+def _update_child(family_id, child_id, update, match=None):
+    result = get_families_collection().update_one(
+        {"family_id": family_id, "children.child_id": child_id, **(match or {})},
+        {**update, "$set": {**update.get("$set", {}), "updated_at": timezone.now()}},
+        array_filters=[{"child.child_id": child_id}],
+    )
+    invalidate_policy(family_id, child_id)
+    return result.matched_count > 0
+
+
+def put_rule(family_id, child_id, app_id, action, windows=()):
+    """Create or replace the child's rule for an app; None if no such child"""
+    rule = {
+        "rule_id": uuid.uuid4().hex,
+        "app_id": app_id,
+        "action": action,
+        "windows": list(windows),
+        "created_at": timezone.now(),
+    }
+    # $pull and $push can't target the same array in one update
+    if not _update_child(
+        family_id,
+        child_id,
+        {"$pull": {"children.$[child].app_rules": {"app_id": app_id}}},
+    ):
+        return None
+    _update_child(
+        family_id, child_id, {"$push": {"children.$[child].app_rules": rule}}
+    )
+    return rule
+
+
+def delete_rule(family_id, child_id, rule_id):
+    return _update_child(
+        family_id,
+        child_id,
+        {"$pull": {"children.$[child].app_rules": {"rule_id": rule_id}}},
+        match={"children.app_rules.rule_id": rule_id},
+    )
+
+
+def set_default(family_id, child_id, action):
+    return _update_child(
+        family_id,
+        child_id,
+        {"$set": {"children.$[child].app_policy_default": action}},
+    )
@@ -0,0 +1,92 @@
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import BasePermission
+
+from .devices import DeviceInfo, authenticate_device
+from .tokens import ACCESS, TokenError, decode_token, signed_tokens_enabled
+
+
+class TokenUser:
+    """
+    Authenticated parent rebuilt from signed token claims.
+
+    Carries what request handlers need (id, family, role, names) without a
+    database query; use ``get_parent()`` where the full model is required.
+    """
+
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+    is_staff = False
+    is_superuser = False
+
+    def __init__(self, claims):
+        self.id = self.pk = claims["uid"]
+        self.family_id = claims.get("fid", "")
+        self.role = claims.get("role", "")
+        self.username = claims.get("usr", "")
+        self.full_name = claims.get("name", "")
+
+    def get_parent(self):
+        from .models import Parent
+
+        return Parent.objects.get(pk=self.id)
+
+    def __str__(self):
+        return self.username
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """Authorization: Bearer <signed access token>, verified without queries"""
+
+    keyword = "Bearer"
+
+    def authenticate(self, request):
+        if not signed_tokens_enabled():
+            return None
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed("Invalid bearer header")
+        try:
+            claims = decode_token(auth[1].decode("latin-1"), ACCESS)
+        except TokenError as e:
+            raise AuthenticationFailed(str(e))
+        return TokenUser(claims), claims
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class DeviceAuthentication(BaseAuthentication):
+    """
+    Authorization: Device <device_id>:<secret>, with the secret returned
+    when the device was linked. The device is ``request.auth``; there is
+    no user.
+    """
+
+    keyword = "Device"
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed("Invalid device header")
+        device_id, _, secret = auth[1].decode("latin-1").partition(":")
+        device = authenticate_device(device_id, secret)
+        if device is None:
+            raise AuthenticationFailed("Unknown device or wrong secret")
+        return AnonymousUser(), device
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class IsLinkedDevice(BasePermission):
+    """Allows requests authenticated by DeviceAuthentication"""
+
+    def has_permission(self, request, view):
+        return isinstance(request.auth, DeviceInfo)
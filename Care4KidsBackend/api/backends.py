@@ -0,0 +1,23 @@
+from django.contrib.auth.backends import ModelBackend
+
+from .hashing import verify_password
+from .models import Parent
+
+
+class EmailBackend(ModelBackend):
+    """Authenticate with email and password using a single user lookup"""
+
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if email is None or password is None:
+            return None
+        try:
+            user = Parent._default_manager.get(email=email)
+        except (Parent.DoesNotExist, Parent.MultipleObjectsReturned):
+            # Run the default hasher once to reduce the timing difference
+            # between an existing and a nonexistent user
+            Parent().set_password(password)
+            return None
+
+        if verify_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,241 @@
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from datetime import timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from .families import DEFAULT_FAMILY_SETTINGS, get_families_collection
+
+logger = logging.getLogger(__name__)
+
+DEVICE_STATES_COLLECTION = "device_states"
+
+BEDTIME = "bedtime"
+AWAKE = "awake"
+
+
+@dataclass(frozen=True)
+class DeviceSchedule:
+    """Bedtime window of one monitored device, in its family's timezone"""
+
+    device_id: str
+    family_id: str
+    child_id: str
+    timezone: str
+    bedtime: time
+    wake_time: time
+
+
+def _parse_time(value, default):
+    try:
+        hours, minutes = str(value).split(":")[:2]
+        return time(int(hours), int(minutes))
+    except (TypeError, ValueError):
+        return _parse_time(default, "00:00") if default else time(0, 0)
+
+
+def get_zone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_FAMILY_SETTINGS["timezone"])
+
+
+def _local_to_utc(day, wall_time, zone):
+    """
+    UTC instant of a wall-clock time on a local date.
+
+    Times skipped by a DST jump resolve to the same offset as before the
+    jump (e.g. 02:30 on a spring-forward night fires at 03:30), and
+    repeated times resolve to their first occurrence (fold=0).
+    """
+    local = datetime.combine(day, wall_time, tzinfo=zone)
+    return local.astimezone(dt_timezone.utc)
+
+
+def state_at(schedule, now):
+    """BEDTIME or AWAKE for a device at the UTC instant ``now``"""
+    zone = get_zone(schedule.timezone)
+    today = now.astimezone(zone).date()
+    # The window that may contain now started today or yesterday
+    for day in (today, today - timedelta(days=1)):
+        start = _local_to_utc(day, schedule.bedtime, zone)
+        end_day = day if schedule.wake_time > schedule.bedtime else day + timedelta(1)
+        end = _local_to_utc(end_day, schedule.wake_time, zone)
+        if start <= now < end:
+            return BEDTIME
+    return AWAKE
+
+
+def next_transition(schedule, now):
+    """(UTC instant, new state) of the first bedtime/wake change after ``now``"""
+    zone = get_zone(schedule.timezone)
+    today = now.astimezone(zone).date()
+    candidates = []
+    for offset in (-1, 0, 1, 2):
+        day = today + timedelta(days=offset)
+        candidates.append((_local_to_utc(day, schedule.bedtime, zone), BEDTIME))
+        candidates.append((_local_to_utc(day, schedule.wake_time, zone), AWAKE))
+    return min(candidate for candidate in candidates if candidate[0] > now)
+
+
+def load_schedules():
+    """Yield a DeviceSchedule for every device of a child with bedtime mode on"""
+    cursor = get_families_collection().find(
+        {"children.monitoring_settings.bedtime_mode_enabled": True},
+        projection={
+            "family_id": 1,
+            "family_settings": 1,
+            "children.child_id": 1,
+            "children.monitoring_settings.bedtime_mode_enabled": 1,
+            "children.devices.device_id": 1,
+        },
+    )
+    for family in cursor:
+        settings = family.get("family_settings") or {}
+        timezone_name = settings.get("timezone") or DEFAULT_FAMILY_SETTINGS["timezone"]
+        bedtime = _parse_time(
+            settings.get("default_bedtime"), DEFAULT_FAMILY_SETTINGS["default_bedtime"]
+        )
+        wake_time = _parse_time(
+            settings.get("default_wake_time"),
+            DEFAULT_FAMILY_SETTINGS["default_wake_time"],
+        )
+        for child in family.get("children") or []:
+            if not (child.get("monitoring_settings") or {}).get("bedtime_mode_enabled"):
+                continue
+            for device in child.get("devices") or []:
+                if device.get("device_id"):
+                    yield DeviceSchedule(
+                        device_id=device["device_id"],
+                        family_id=family["family_id"],
+                        child_id=child.get("child_id", ""),
+                        timezone=timezone_name,
+                        bedtime=bedtime,
+                        wake_time=wake_time,
+                    )
+
+
+class BedtimeScheduler:
+    """
+    Min-heap of upcoming bedtime transitions, one live entry per device.
+
+    tick() pops only the transitions that are due, hands them to
+    ``dispatch`` in batches and pushes each device's following
+    transition, so a tick costs O(due * log devices). Replaced or removed
+    schedules are invalidated lazily through a per-device generation
+    number and skipped when they surface; the heap is rebuilt once stale
+    entries outnumber live ones.
+    """
+
+    def __init__(self, dispatch, batch_size=1000):
+        self.dispatch = dispatch
+        self.batch_size = batch_size
+        self._heap = []
+        # device_id -> (generation, schedule)
+        self._devices = {}
+        self._generations = itertools.count()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def schedule(self, device, now):
+        generation = next(self._generations)
+        self._devices[device.device_id] = (generation, device)
+        fire_at, state = next_transition(device, now)
+        heapq.heappush(
+            self._heap, (fire_at.timestamp(), generation, device.device_id, state)
+        )
+
+    def remove(self, device_id):
+        self._devices.pop(device_id, None)
+
+    def sync(self, schedules, now):
+        """
+        Replace the device set with ``schedules``.
+
+        New and changed devices are (re)scheduled and their current state
+        is dispatched, which also covers transitions missed while the
+        scheduler was down. Returns the number of devices (re)scheduled.
+        """
+        seen = set()
+        changed = []
+        for device in schedules:
+            seen.add(device.device_id)
+            current = self._devices.get(device.device_id)
+            if current is None or current[1] != device:
+                self.schedule(device, now)
+                changed.append((device, state_at(device, now), now))
+        for device_id in set(self._devices) - seen:
+            self.remove(device_id)
+        for start in range(0, len(changed), self.batch_size):
+            self.dispatch(changed[start : start + self.batch_size])
+        if len(self._heap) > 2 * len(self._devices) + 1024:
+            self._compact()
+        return len(changed)
+
+    def tick(self, now):
+        """Dispatch every transition due at ``now``; return how many fired"""
+        cutoff = now.timestamp()
+        batch = []
+        fired = 0
+        while self._heap and self._heap[0][0] <= cutoff:
+            fire_ts, generation, device_id, state = heapq.heappop(self._heap)
+            current = self._devices.get(device_id)
+            if current is None or current[0] != generation:
+                continue
+            device = current[1]
+            fired_at = datetime.fromtimestamp(fire_ts, dt_timezone.utc)
+            batch.append((device, state, fired_at))
+            self.schedule(device, fired_at)
+            if len(batch) >= self.batch_size:
+                self.dispatch(batch)
+                fired += len(batch)
+                batch = []
+        if batch:
+            self.dispatch(batch)
+            fired += len(batch)
+        return fired
+
+    def next_due(self):
+        """Timestamp of the earliest live entry, or None"""
+        while self._heap:
+            fire_ts, generation, device_id, _ = self._heap[0]
+            current = self._devices.get(device_id)
+            if current is not None and current[0] == generation:
+                return fire_ts
+            heapq.heappop(self._heap)
+        return None
+
+    def _compact(self):
+        live = {generation for generation, _ in self._devices.values()}
+        self._heap = [entry for entry in self._heap if entry[1] in live]
+        heapq.heapify(self._heap)
+
+
+def write_device_states(batch):
+    """Dispatch: upsert each device's enforced bedtime state in one bulk write"""
+    from pymongo import UpdateOne
+
+    from utils.mongodb import mongodb_connection
+
+    operations = [
+        UpdateOne(
+            {"_id": device.device_id},
+            {
+                "$set": {
+                    "family_id": device.family_id,
+                    "child_id": device.child_id,
+                    "bedtime_active": state == BEDTIME,
+                    "bedtime_changed_at": fired_at,
+                }
+            },
+            upsert=True,
+        )
+        for device, state, fired_at in batch
+    ]
+    if operations:
+        collection = mongodb_connection.get_collection(DEVICE_STATES_COLLECTION)
+        collection.bulk_write(operations, ordered=False)
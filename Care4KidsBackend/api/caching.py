@@ -0,0 +1,85 @@
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+def profile_cache_enabled():
+    """
+    Only with a cache shared by all workers: a version bumped in one
+    worker's LocMemCache would leave the others serving stale profiles.
+    """
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def _version_key(user_id):
+    return f"profile-version:{user_id}"
+
+
+def get_profile_version(user_id):
+    """Microsecond timestamp of the user's last profile change, as cached"""
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Unknown (first request or evicted): start a new version, which
+        # only costs clients one full response
+        cache.add(key, time.time_ns() // 1000, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_profile_version(user_id):
+    if not profile_cache_enabled():
+        return
+    cache.set(_version_key(user_id), time.time_ns() // 1000, timeout=None)
+
+
+def profile_cache(name):
+    """
+    Conditional GET plus versioned response caching for per-user views.
+
+    The response data is cached under the user's current profile version,
+    and ETag/Last-Modified are derived from that version. Repeat requests
+    are answered with 304, or with the cached data, without calling the
+    view. Saving a Parent bumps the version (see api.signals). Bypassed
+    when the default cache is process-local (see profile_cache_enabled).
+    """
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if not request.user.is_authenticated or not profile_cache_enabled():
+                return method(self, request, *args, **kwargs)
+            user_id = request.user.id
+            version = get_profile_version(user_id)
+            etag = quote_etag(f"{name}-{user_id}-{version}")
+            last_modified = version // 1_000_000
+
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if response is None:
+                key = f"profile:{name}:{user_id}:{version}"
+                data = cache.get(key)
+                if data is None:
+                    response = method(self, request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                    cache.set(key, response.data, settings.PROFILE_CACHE_TIMEOUT)
+                else:
+                    response = Response(data)
+
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+            response["Cache-Control"] = "private, no-cache"
+            return response
+
+        return wrapper
+
+    return decorator
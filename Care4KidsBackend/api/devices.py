@@ -0,0 +1,118 @@
+import hashlib
+import hmac
+import secrets
+import threading
+from dataclasses import dataclass, field
+
+from cachetools import TTLCache
+from django.conf import settings
+
+from .families import get_families_collection
+
+
+@dataclass(frozen=True)
+class DeviceInfo:
+    """A linked child device and the monitoring flags of its child"""
+
+    device_id: str
+    family_id: str
+    child_id: str
+    child_name: str
+    monitoring_settings: dict
+    # sha256 of the secret issued when the device was linked
+    secret_hash: str = field(default="", repr=False)
+
+    def enabled(self, feature):
+        return bool(self.monitoring_settings.get(f"{feature}_enabled"))
+
+
+_cache = TTLCache(
+    maxsize=getattr(settings, "DEVICE_CACHE", {}).get("MAXSIZE", 50000),
+    ttl=getattr(settings, "DEVICE_CACHE", {}).get("TTL", 300),
+)
+_lock = threading.Lock()
+_indexed = False
+
+
+def _ensure_index(collection):
+    global _indexed
+    if not _indexed:
+        collection.create_index("children.devices.device_id")
+        _indexed = True
+
+
+def resolve_device(device_id):
+    """
+    Return the DeviceInfo for a linked device id, or None.
+
+    Hits are cached for DEVICE_CACHE["TTL"] seconds, so settings changes
+    reach devices within that delay; misses are not cached so a freshly
+    linked device is recognised immediately.
+    """
+    with _lock:
+        info = _cache.get(device_id)
+    if info is not None:
+        return info
+
+    collection = get_families_collection()
+    _ensure_index(collection)
+    family = collection.find_one(
+        {"children.devices.device_id": device_id},
+        projection={
+            "family_id": 1,
+            "children.child_id": 1,
+            "children.name": 1,
+            "children.monitoring_settings": 1,
+            "children.devices.device_id": 1,
+            "children.devices.secret_hash": 1,
+        },
+    )
+    if family is None:
+        return None
+    for child in family.get("children") or []:
+        for device in child.get("devices") or []:
+            if device.get("device_id") != device_id:
+                continue
+            info = DeviceInfo(
+                device_id=device_id,
+                family_id=family["family_id"],
+                child_id=child.get("child_id", ""),
+                child_name=child.get("name", ""),
+                monitoring_settings=dict(child.get("monitoring_settings") or {}),
+                secret_hash=device.get("secret_hash", ""),
+            )
+            with _lock:
+                _cache[device_id] = info
+            return info
+    return None
+
+
+def hash_secret(secret):
+    # Secrets are random 256-bit tokens, so a fast hash is enough
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+def issue_device_secret():
+    """Return (secret, hash): the device keeps the secret, MongoDB the hash"""
+    secret = secrets.token_urlsafe(32)
+    return secret, hash_secret(secret)
+
+
+def authenticate_device(device_id, secret):
+    """DeviceInfo of a linked device if ``secret`` is the one it was issued"""
+    info = resolve_device(device_id)
+    if info is None or not info.secret_hash:
+        # Linked before secrets were issued: the device must link again
+        return None
+    if not hmac.compare_digest(info.secret_hash, hash_secret(secret)):
+        return None
+    return info
+
+
+def invalidate_device(device_id=None):
+    """Drop one cached device (or all of them) after its settings change"""
+    with _lock:
+        if device_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(device_id, None)
@@ -0,0 +1,278 @@
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.utils import timezone
+
+from utils.usage import USAGE_COLLECTION
+
+from .bedtime import DEVICE_STATES_COLLECTION
+from .families import FAMILIES_COLLECTION
+from .locations import GEOFENCE_EVENTS_COLLECTION, PINGS_COLLECTION
+
+DIGESTS_COLLECTION = "weekly_digests"
+
+# family_ids are uuid4 strings, so ranges of their leading hex digits are
+# evenly sized partitions
+_KEYSPACE = 16**8
+
+
+def last_complete_week(today=None):
+    """Monday of the last full Monday-Sunday week before ``today``"""
+    today = today or timezone.now().date()
+    return today - timedelta(days=today.weekday() + 7)
+
+
+def partitions(count):
+    """``count`` (low, high) family_id ranges covering every possible id"""
+    bounds = [None] + [
+        format(i * _KEYSPACE // count, "08x") for i in range(1, count)
+    ] + [None]
+    return list(zip(bounds, bounds[1:]))
+
+
+def _range_query(field, low, high):
+    condition = {}
+    if low is not None:
+        condition["$gte"] = low
+    if high is not None:
+        condition["$lt"] = high
+    return {field: condition} if condition else {}
+
+
+class _Aligned:
+    """
+    Hands out the documents of a family_id-sorted cursor family by family,
+    for family ids requested in ascending order.
+    """
+
+    def __init__(self, cursor, key="family_id"):
+        self._cursor = iter(cursor)
+        self._key = key
+        self._head = next(self._cursor, None)
+
+    def take(self, family_id):
+        documents = []
+        while self._head is not None and (self._head.get(self._key) or "") <= family_id:
+            if self._head.get(self._key) == family_id:
+                documents.append(self._head)
+            self._head = next(self._cursor, None)
+        return documents
+
+
+def render_digest(family, week_start, pings, events, states, usage):
+    """Digest document for one family from its week of activity"""
+    fences = {
+        fence.get("fence_id"): fence.get("name", "")
+        for fence in family.get("geofences") or []
+    }
+    pings_by_child = Counter(ping.get("child_id") for ping in pings)
+    days_by_child = defaultdict(set)
+    for ping in pings:
+        days_by_child[ping.get("child_id")].add(ping["recorded_at"].date())
+    arrivals = defaultdict(Counter)
+    for event in events:
+        if event.get("event") == "enter":
+            arrivals[event.get("child_id")][fences.get(event.get("fence_id"), "")] += 1
+    last_seen = {}
+    for state in states:
+        seen = state.get("last_seen_at")
+        child_id = state.get("child_id")
+        if seen is not None:
+            last_seen[child_id] = max(seen, last_seen.get(child_id, seen))
+
+    settings = family.get("family_settings") or {}
+    children = []
+    lines = [f"Week of {week_start.isoformat()}"]
+    for child in family.get("children") or []:
+        child_id = child.get("child_id")
+        monitoring = child.get("monitoring_settings") or {}
+        summary = {
+            "child_id": child_id,
+            "name": child.get("name", ""),
+            "devices": len(child.get("devices") or []),
+            "location_points": pings_by_child.get(child_id, 0),
+            "days_with_location": len(days_by_child.get(child_id, ())),
+            "arrivals": dict(arrivals.get(child_id, {})),
+            "app_rules": len(child.get("app_rules") or []),
+            "bedtime_mode": bool(monitoring.get("bedtime_mode_enabled")),
+            "last_seen_at": last_seen.get(child_id),
+        }
+        children.append(summary)
+        line = f"{summary['name']}: {summary['devices']} device(s)"
+        if summary["location_points"]:
+            line += f", located on {summary['days_with_location']} day(s)"
+        for place, count in sorted(summary["arrivals"].items()):
+            line += f", arrived at {place or 'a saved place'} {count}x"
+        if summary["bedtime_mode"]:
+            line += (
+                f", bedtime {settings.get('default_bedtime', '')}-"
+                f"{settings.get('default_wake_time', '')}"
+            )
+        lines.append(line)
+
+    chatbot = {
+        "tokens": sum(day.get("tokens", 0) for day in usage),
+        "requests": sum(day.get("requests", 0) for day in usage),
+        "by_day": {day["day"]: day.get("requests", 0) for day in usage},
+    }
+    lines.append(f"Assistant: {chatbot['requests']} question(s) this week")
+    return {
+        "family_id": family["family_id"],
+        "week_start": week_start.isoformat(),
+        "children": children,
+        "chatbot": chatbot,
+        "text": "\n".join(lines),
+        "generated_at": timezone.now(),
+    }
+
+
+def build_partition(low, high, week_start, batch_size=500):
+    """
+    Render and store the digests of every family with low <= family_id < high.
+
+    Families and their week of pings, geofence events, device states and
+    chatbot usage are read as family_id-sorted, projected cursors over the
+    same range and merged in one pass, so only one family's activity is in
+    memory at a time; digests are upserted batch_size at a time. Returns
+    (families, seconds).
+    """
+    from pymongo import UpdateOne
+
+    from utils.mongodb import mongodb_connection
+
+    started = time.perf_counter()
+    start = datetime.combine(week_start, datetime.min.time(), tzinfo=dt_timezone.utc)
+    end = start + timedelta(days=7)
+    window = {"recorded_at": {"$gte": start, "$lt": end}}
+    family_range = _range_query("family_id", low, high)
+    collection = mongodb_connection.get_collection
+
+    families = collection(FAMILIES_COLLECTION).find(
+        family_range,
+        projection={
+            "family_id": 1,
+            "family_settings": 1,
+            "geofences.fence_id": 1,
+            "geofences.name": 1,
+            "children.child_id": 1,
+            "children.name": 1,
+            "children.devices.device_id": 1,
+            "children.monitoring_settings": 1,
+            "children.app_rules.app_id": 1,
+        },
+        sort=[("family_id", 1)],
+    ).batch_size(batch_size)
+    pings = _Aligned(
+        collection(PINGS_COLLECTION)
+        .find(
+            {**family_range, **window},
+            projection={"_id": 0, "family_id": 1, "child_id": 1, "recorded_at": 1},
+            sort=[("family_id", 1)],
+        )
+        .batch_size(batch_size * 20)
+    )
+    events = _Aligned(
+        collection(GEOFENCE_EVENTS_COLLECTION)
+        .find(
+            {**family_range, **window},
+            projection={
+                "_id": 0, "family_id": 1, "child_id": 1, "fence_id": 1, "event": 1,
+            },
+            sort=[("family_id", 1)],
+        )
+        .batch_size(batch_size)
+    )
+    states = _Aligned(
+        collection(DEVICE_STATES_COLLECTION)
+        .find(
+            family_range,
+            projection={"family_id": 1, "child_id": 1, "last_seen_at": 1},
+            sort=[("family_id", 1)],
+        )
+        .batch_size(batch_size)
+    )
+    usage = _Aligned(
+        collection(USAGE_COLLECTION)
+        .find(
+            {
+                "scope": "family",
+                **_range_query("subject_id", low, high),
+                "day": {
+                    "$gte": week_start.isoformat(),
+                    "$lt": (week_start + timedelta(days=7)).isoformat(),
+                },
+            },
+            projection={
+                "_id": 0, "subject_id": 1, "day": 1, "tokens": 1, "requests": 1,
+            },
+            sort=[("subject_id", 1)],
+        )
+        .batch_size(batch_size),
+        key="subject_id",
+    )
+
+    digests = collection(DIGESTS_COLLECTION)
+    operations = []
+    count = 0
+    for family in families:
+        family_id = family.get("family_id")
+        if not family_id:
+            continue
+        digest = render_digest(
+            family,
+            week_start,
+            pings.take(family_id),
+            events.take(family_id),
+            states.take(family_id),
+            usage.take(family_id),
+        )
+        operations.append(
+            UpdateOne(
+                {"_id": f"{family_id}:{digest['week_start']}"},
+                {"$set": digest},
+                upsert=True,
+            )
+        )
+        count += 1
+        if len(operations) >= batch_size:
+            digests.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        digests.bulk_write(operations, ordered=False)
+    return count, time.perf_counter() - started
+
+
+def ensure_indexes():
+    """Indexes that let every partition scan be a sorted range read"""
+    from utils.mongodb import mongodb_connection
+
+    collection = mongodb_connection.get_collection
+    collection(FAMILIES_COLLECTION).create_index("family_id")
+    for name in (PINGS_COLLECTION, GEOFENCE_EVENTS_COLLECTION):
+        collection(name).create_index([("family_id", 1), ("recorded_at", 1)])
+    collection(DEVICE_STATES_COLLECTION).create_index("family_id")
+    collection(USAGE_COLLECTION).create_index(
+        [("scope", 1), ("subject_id", 1), ("day", 1)]
+    )
+    collection(DIGESTS_COLLECTION).create_index([("family_id", 1), ("week_start", -1)])
+
+
+def get_digest(family_id, week_start=None):
+    """Stored digest of a family for a week (latest if None), or None"""
+    from utils.mongodb import mongodb_connection
+
+    collection = mongodb_connection.get_collection(DIGESTS_COLLECTION)
+    if week_start is not None:
+        return collection.find_one(
+            {"_id": f"{family_id}:{week_start.isoformat()}"}, projection={"_id": 0}
+        )
+    return next(
+        iter(
+            collection.find({"family_id": family_id}, projection={"_id": 0})
+            .sort("week_start", -1)
+            .limit(1)
+        ),
+        None,
+    )
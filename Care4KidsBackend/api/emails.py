@@ -0,0 +1,300 @@
+import logging
+import random
+import smtplib
+import threading
+import uuid
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from .models import OutboundEmail
+from .tokens import issue_password_token
+
+logger = logging.getLogger(__name__)
+
+INVITATION = "invitation"
+WELCOME = "welcome"
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+def _config():
+    return getattr(settings, "EMAIL_QUEUE", {})
+
+
+def queue_emails(emails):
+    """
+    Insert unsaved OutboundEmail rows in one query.
+
+    Rows whose dedup_key is already queued (or sent) are skipped, so
+    callers can enqueue the same notification more than once. Call inside
+    the transaction that creates the invitation/account so an email is
+    queued exactly when its subject is committed.
+    """
+    if emails:
+        OutboundEmail.objects.bulk_create(emails, ignore_conflicts=True)
+
+
+def invitation_email(invitation, inviter_name):
+    expires = timezone.localtime(invitation.expires_at).strftime("%d/%m/%Y")
+    return OutboundEmail(
+        dedup_key=f"{INVITATION}:{invitation.pk}",
+        kind=INVITATION,
+        to_email=invitation.invited_email,
+        subject=f"{inviter_name} te invitó a su familia en Care4Kids",
+        body=(
+            f"Hola,\n\n{inviter_name} te invitó a unirte a su familia en "
+            f"Care4Kids.\n\nTu código de invitación es: "
+            f"{invitation.invitation_code}\n\nIngrésalo en la app Care4Kids "
+            f"para crear tu cuenta antes del {expires}.\n"
+        ),
+    )
+
+
+def welcome_email(parent, child_codes):
+    lines = [
+        f"Hola {parent.full_name},",
+        "",
+        f"Se creó tu cuenta familiar de Care4Kids con el correo {parent.email}.",
+    ]
+    if not parent.has_usable_password():
+        setup = getattr(settings, "PASSWORD_SETUP", {})
+        expires = timezone.localtime(
+            timezone.now() + timedelta(seconds=setup.get("TOKEN_TTL", 7 * 24 * 3600))
+        ).strftime("%d/%m/%Y")
+        link = setup.get("URL", "") + "?" + urlencode(
+            {"token": issue_password_token(parent)}
+        )
+        lines += [
+            "",
+            f"Elige tu contraseña en este enlace antes del {expires}:",
+            link,
+        ]
+    if child_codes:
+        expires = timezone.localtime(
+            min(code.expires_at for code in child_codes)
+        ).strftime("%d/%m/%Y")
+        lines += [
+            "",
+            f"Códigos para vincular los dispositivos de tus hijos "
+            f"(válidos hasta el {expires}):",
+        ]
+        lines += [
+            f"- {code.child_name}: {code.registration_code}" for code in child_codes
+        ]
+        lines += ["", "Ingresa cada código en la app Care4Kids del dispositivo."]
+    return OutboundEmail(
+        dedup_key=f"{WELCOME}:{parent.pk}",
+        kind=WELCOME,
+        to_email=parent.email,
+        subject="Bienvenido a Care4Kids",
+        body="\n".join(lines) + "\n",
+    )
+
+
+def backoff(attempts):
+    """Delay before retry number ``attempts``: exponential, capped, jittered"""
+    config = _config()
+    delay = min(
+        config.get("BACKOFF_MAX", 3600),
+        config.get("BACKOFF_BASE", 30) * 2 ** (attempts - 1),
+    )
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def claim(worker_id, batch_size):
+    """
+    Atomically take up to ``batch_size`` due emails for one worker.
+
+    The conditional UPDATE only flips rows still pending, so concurrent
+    workers (threads or processes) never claim the same email. Claims
+    not renewed for CLAIM_TIMEOUT seconds (a worker died mid-batch) are
+    released first; deliver() renews a claim before every message.
+    """
+    now = timezone.now()
+    OutboundEmail.objects.filter(
+        status=SENDING,
+        claimed_at__lt=now - timedelta(seconds=_config().get("CLAIM_TIMEOUT", 300)),
+    ).update(status=PENDING, claimed_by="")
+    ids = list(
+        OutboundEmail.objects.filter(status=PENDING, next_attempt_at__lte=now)
+        .order_by("next_attempt_at")
+        .values_list("id", flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    OutboundEmail.objects.filter(id__in=ids, status=PENDING).update(
+        status=SENDING, claimed_by=worker_id, claimed_at=now
+    )
+    return list(
+        OutboundEmail.objects.filter(id__in=ids, status=SENDING, claimed_by=worker_id)
+    )
+
+
+def deliver(emails, smtp):
+    """
+    Send claimed emails over one open connection and record the outcome.
+
+    Before each message the claim is renewed with a conditional UPDATE;
+    an email whose claim was released and taken by another worker is
+    skipped, so a slow batch never sends a message twice. Each message is
+    marked sent as soon as the server accepts it, so a worker dying
+    mid-batch leaves at most the message in flight to be resent. A failed
+    message doesn't abort the batch: the connection is reopened and the
+    message is retried later with backoff, up to MAX_ATTEMPTS (refused
+    recipients fail at once). Returns (sent, failed) counts.
+    """
+    max_attempts = _config().get("MAX_ATTEMPTS", 5)
+    sent = 0
+    retries = []
+    for email in emails:
+        renewed = OutboundEmail.objects.filter(
+            pk=email.pk, status=SENDING, claimed_by=email.claimed_by
+        ).update(claimed_at=timezone.now())
+        if not renewed:
+            logger.warning("Lost the claim on email %s; skipping it", email.pk)
+            continue
+        message = EmailMessage(
+            email.subject,
+            email.body,
+            settings.DEFAULT_FROM_EMAIL,
+            [email.to_email],
+            connection=smtp,
+        )
+        try:
+            message.send()
+        except Exception as exc:
+            email.attempts += 1
+            email.last_error = f"{type(exc).__name__}: {exc}"[:1000]
+            email.claimed_by = ""
+            permanent = isinstance(exc, smtplib.SMTPRecipientsRefused)
+            if permanent or email.attempts >= max_attempts:
+                email.status = FAILED
+                logger.error("Giving up on email %s: %s", email.pk, email.last_error)
+            else:
+                email.status = PENDING
+                email.next_attempt_at = timezone.now() + backoff(email.attempts)
+            retries.append(email)
+            _reconnect(smtp)
+        else:
+            OutboundEmail.objects.filter(pk=email.pk).update(
+                status=SENT, sent_at=timezone.now(), claimed_by="", last_error=""
+            )
+            sent += 1
+
+    if retries:
+        OutboundEmail.objects.bulk_update(
+            retries,
+            ["status", "attempts", "next_attempt_at", "last_error", "claimed_by"],
+        )
+    return sent, sum(email.status == FAILED for email in retries)
+
+
+def _reconnect(smtp):
+    # The server may have dropped us; start the next message on a fresh session
+    try:
+        smtp.close()
+    except Exception:
+        pass
+    try:
+        smtp.open()
+    except Exception:
+        logger.warning("Email connection failed to reopen", exc_info=True)
+
+
+class EmailWorker:
+    """
+    Thread pool draining the outbound email queue.
+
+    Each thread claims a batch, sends it over its own connection and keeps
+    that connection open while batches keep coming, so a busy queue pays
+    for one SMTP handshake per thread instead of one per email. An idle
+    thread closes its connection and polls every ``poll_interval`` seconds.
+    """
+
+    def __init__(self, threads=None, batch_size=None, poll_interval=None):
+        config = _config()
+        # A claim is renewed per message; sending one (plus a reconnect)
+        # must not outlast it
+        if config.get("CLAIM_TIMEOUT", 300) <= 2 * (settings.EMAIL_TIMEOUT or 60):
+            raise ImproperlyConfigured(
+                "EMAIL_QUEUE['CLAIM_TIMEOUT'] must exceed twice EMAIL_TIMEOUT"
+            )
+        self.threads = threads or config.get("THREADS", 2)
+        self.batch_size = batch_size or config.get("BATCH_SIZE", 50)
+        self.poll_interval = poll_interval or config.get("POLL_INTERVAL", 2)
+        self.sent = 0
+        self.failed = 0
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for number in range(self.threads):
+            thread = threading.Thread(
+                target=self._run, name=f"email-worker-{number}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def drain(self):
+        """Send everything currently due in this thread; returns (sent, failed)"""
+        worker_id = uuid.uuid4().hex
+        smtp = None
+        try:
+            while True:
+                emails = claim(worker_id, self.batch_size)
+                if not emails:
+                    break
+                if smtp is None:
+                    smtp = get_connection()
+                    smtp.open()
+                self._record(*deliver(emails, smtp))
+        finally:
+            if smtp is not None:
+                smtp.close()
+        return self.sent, self.failed
+
+    def _record(self, sent, failed):
+        with self._stats_lock:
+            self.sent += sent
+            self.failed += failed
+
+    def _run(self):
+        worker_id = uuid.uuid4().hex
+        smtp = None
+        try:
+            while not self._stop.is_set():
+                close_old_connections()
+                try:
+                    emails = claim(worker_id, self.batch_size)
+                    if emails:
+                        if smtp is None:
+                            smtp = get_connection()
+                            smtp.open()
+                        self._record(*deliver(emails, smtp))
+                        continue
+                except Exception:
+                    logger.exception("Email worker batch failed")
+                if smtp is not None:
+                    smtp.close()
+                    smtp = None
+                self._stop.wait(self.poll_interval)
+        finally:
+            if smtp is not None:
+                smtp.close()
+            connection.close()
@@ -0,0 +1,292 @@
+import json
+import zipfile
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .bedtime import DEVICE_STATES_COLLECTION
+from .families import FAMILIES_COLLECTION
+from .locations import GEOFENCE_EVENTS_COLLECTION, PINGS_COLLECTION
+from .models import ChildRegistrationCode, FamilyInvitation, Parent
+
+_SALT = "api.exports"
+
+FORMAT_VERSION = 1
+
+# (section, model, exported fields); never the password hash
+SQL_SECTIONS = [
+    (
+        "parents",
+        Parent,
+        (
+            "id", "username", "email", "full_name", "phone", "family_id", "role",
+            "is_verified", "date_joined", "last_login",
+        ),
+    ),
+    (
+        "invitations",
+        FamilyInvitation,
+        (
+            "id", "invitation_code", "invited_email", "invited_by_id", "family_id",
+            "status", "created_at", "expires_at", "accepted_at",
+        ),
+    ),
+    (
+        "child_codes",
+        ChildRegistrationCode,
+        (
+            "id", "registration_code", "child_name", "family_id", "created_by_id",
+            "status", "created_at", "expires_at", "used_at", "device_info",
+        ),
+    ),
+]
+
+# (section, MongoDB collection, projection) of documents carrying a
+# family_id; never the device secret hashes
+MONGO_SECTIONS = [
+    ("family", FAMILIES_COLLECTION, {"children.devices.secret_hash": 0}),
+    ("device_states", DEVICE_STATES_COLLECTION, None),
+    ("location_pings", PINGS_COLLECTION, None),
+    ("geofence_events", GEOFENCE_EVENTS_COLLECTION, None),
+]
+
+SECTIONS = [name for name, _, _ in SQL_SECTIONS] + [
+    name for name, _, _ in MONGO_SECTIONS
+]
+
+
+class ExportCursorError(Exception):
+    """Resume cursor is malformed, tampered with, expired or for another family"""
+
+
+def _require_family(family_id):
+    # Accounts without a family (superusers, failed family setup) share the
+    # empty family_id; filtering on it would export all of them together
+    if not family_id:
+        raise ValueError("A family export needs a non-empty family_id")
+
+
+class _Encoder(DjangoJSONEncoder):
+    def default(self, o):
+        try:
+            return super().default(o)
+        except TypeError:
+            # ObjectId and other BSON types
+            return str(o)
+
+
+def _dumps(value):
+    return json.dumps(value, cls=_Encoder, ensure_ascii=False).encode()
+
+
+def _config():
+    return getattr(settings, "FAMILY_EXPORT", {})
+
+
+def _encode_key(key):
+    if key is None or isinstance(key, (int, str)):
+        return key
+    return {"oid": str(key)}
+
+
+def _decode_key(key):
+    if isinstance(key, dict):
+        from bson import ObjectId
+
+        return ObjectId(key["oid"])
+    return key
+
+
+def encode_cursor(family_id, section, after):
+    """Signed position: resume in ``section`` after the row keyed ``after``"""
+    return signing.dumps(
+        {"fid": family_id, "s": section, "k": _encode_key(after)},
+        salt=_SALT,
+        compress=True,
+    )
+
+
+def decode_cursor(cursor, family_id):
+    """Return (section index, last key) for a cursor issued for ``family_id``"""
+    try:
+        position = signing.loads(
+            cursor,
+            salt=_SALT,
+            max_age=_config().get("CURSOR_MAX_AGE", 7 * 24 * 3600),
+        )
+    except signing.BadSignature as exc:
+        raise ExportCursorError("Invalid or expired cursor") from exc
+    section = position.get("s")
+    if position.get("fid") != family_id or section not in range(len(SECTIONS) + 1):
+        raise ExportCursorError("Cursor does not belong to this export")
+    return section, _decode_key(position.get("k"))
+
+
+def _sql_rows(model, fields, family_id, after, chunk_size):
+    queryset = model.objects.filter(family_id=family_id).order_by("pk").values(*fields)
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    for row in queryset.iterator(chunk_size=chunk_size):
+        yield row["id"], row
+
+
+def _mongo_rows(collection_name, projection, family_id, after, chunk_size):
+    from utils.mongodb import mongodb_connection
+
+    query = {"family_id": family_id}
+    if after is not None:
+        query["_id"] = {"$gt": after}
+    cursor = (
+        mongodb_connection.get_collection(collection_name)
+        .find(query, projection)
+        .sort("_id", 1)
+        .batch_size(chunk_size)
+    )
+    try:
+        for document in cursor:
+            yield document["_id"], document
+    finally:
+        cursor.close()
+
+
+def iter_sections(family_id, start=(0, None), chunk_size=500):
+    """
+    Yield (section index, section name, key, row) for a family, in order.
+
+    Every section is read in primary-key (``_id``) order with keyset
+    pagination, so a cursor from encode_cursor() resumes exactly after the
+    last row delivered; rows added or removed in between are picked up or
+    skipped like any other keyset scan.
+    """
+    _require_family(family_id)
+    first, after = start
+    for index in range(first, len(SECTIONS)):
+        section_after = after if index == first else None
+        if index < len(SQL_SECTIONS):
+            _, model, fields = SQL_SECTIONS[index]
+            rows = _sql_rows(model, fields, family_id, section_after, chunk_size)
+        else:
+            _, collection, projection = MONGO_SECTIONS[index - len(SQL_SECTIONS)]
+            rows = _mongo_rows(
+                collection, projection, family_id, section_after, chunk_size
+            )
+        for key, row in rows:
+            yield index, SECTIONS[index], key, row
+
+
+def ndjson_export(family_id, cursor=None, chunk_size=None):
+    """
+    Stream a family export as NDJSON, one chunk of lines at a time.
+
+    Lines are ``{"type": "export"}`` (header), ``{"type": "record",
+    "section", "data"}`` and, after every chunk and section, ``{"type":
+    "cursor", "cursor"}``; a client that loses the connection passes the
+    last cursor it received back to continue. ``{"type": "end"}`` closes a
+    complete export. Raises ExportCursorError for a bad cursor and
+    ValueError for an empty family_id.
+    """
+    _require_family(family_id)
+    chunk_size = chunk_size or _config().get("CHUNK_SIZE", 500)
+    start = decode_cursor(cursor, family_id) if cursor else (0, None)
+    return _ndjson_chunks(family_id, start, chunk_size, resumed=bool(cursor))
+
+
+def _ndjson_chunks(family_id, start, chunk_size, resumed):
+    header = {
+        "type": "export",
+        "format_version": FORMAT_VERSION,
+        "family_id": family_id,
+        "exported_at": timezone.now(),
+        "resumed": resumed,
+        "sections": SECTIONS[start[0] :],
+    }
+    lines = [_dumps(header)]
+    counts = Counter()
+    current = start[0]
+    for index, name, key, row in iter_sections(family_id, start, chunk_size):
+        while current < index:
+            current += 1
+            lines.append(_cursor_line(family_id, current, None))
+        lines.append(_dumps({"type": "record", "section": name, "data": row}))
+        counts[name] += 1
+        if len(lines) >= chunk_size:
+            lines.append(_cursor_line(family_id, index, key))
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    lines.append(_cursor_line(family_id, len(SECTIONS), None))
+    lines.append(_dumps({"type": "end", "counts": dict(counts)}))
+    yield b"\n".join(lines) + b"\n"
+
+
+def _cursor_line(family_id, section, after):
+    return _dumps(
+        {"type": "cursor", "cursor": encode_cursor(family_id, section, after)}
+    )
+
+
+class _Sink:
+    """Write-only stream ZipFile writes into; drained after every chunk"""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def zip_export(family_id, chunk_size=None):
+    """
+    Stream a family export as a ZIP archive with one NDJSON member per
+    section plus manifest.json.
+
+    The archive is written to a non-seekable sink (sizes go in data
+    descriptors), so it is produced incrementally and only the compressed
+    bytes of the current chunk are held in memory. Raises ValueError for
+    an empty family_id.
+    """
+    _require_family(family_id)
+    return _zip_chunks(family_id, chunk_size or _config().get("CHUNK_SIZE", 500))
+
+
+def _zip_chunks(family_id, chunk_size):
+    flush_bytes = _config().get("ZIP_FLUSH_BYTES", 64 * 1024)
+    sink = _Sink()
+    counts = Counter()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        member = None
+        current = None
+        for _, name, _, row in iter_sections(family_id, chunk_size=chunk_size):
+            if name != current:
+                if member is not None:
+                    member.close()
+                member = archive.open(f"{name}.ndjson", "w", force_zip64=True)
+                current = name
+            member.write(_dumps(row) + b"\n")
+            counts[name] += 1
+            if sink.size >= flush_bytes:
+                yield sink.drain()
+        if member is not None:
+            member.close()
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "family_id": family_id,
+            "exported_at": timezone.now(),
+            "counts": {name: counts[name] for name in SECTIONS},
+        }
+        archive.writestr("manifest.json", _dumps(manifest))
+    yield sink.drain()
@@ -0,0 +1,67 @@
+import uuid
+
+from django.utils import timezone
+
+FAMILIES_COLLECTION = "families"
+
+DEFAULT_FAMILY_SETTINGS = {
+    "timezone": "America/New_York",
+    "emergency_override_enabled": True,
+    "default_bedtime": "21:00",
+    "default_wake_time": "07:00",
+}
+
+DEFAULT_MONITORING_SETTINGS = {
+    "screen_time_enabled": True,
+    "app_restrictions_enabled": True,
+    "location_tracking_enabled": False,  # Can be configured later
+    "bedtime_mode_enabled": True,
+}
+
+
+def get_families_collection():
+    from utils.mongodb import mongodb_connection
+
+    return mongodb_connection.get_collection(FAMILIES_COLLECTION)
+
+
+def parent_entry(parent, joined_at=None):
+    """Entry for a Parent in a family document's ``parents`` array"""
+    entry = {
+        "parent_id": str(parent.id),
+        "django_user_id": parent.id,
+        "full_name": parent.full_name,
+        "email": parent.email,
+        "phone": parent.phone,
+        "role": parent.role,
+        "username": parent.username,
+    }
+    if joined_at is not None:
+        entry["joined_at"] = joined_at
+    return entry
+
+
+def child_entry(child_code, device_data):
+    """Entry for a used ChildRegistrationCode in a family's ``children`` array"""
+    return {
+        "child_id": str(uuid.uuid4()),
+        "name": child_code.child_name,
+        "registration_code": child_code.registration_code,
+        "added_at": timezone.now().isoformat(),
+        "added_by": child_code.created_by_id,
+        "devices": [device_data],  # Array of monitored devices
+        "monitoring_settings": dict(DEFAULT_MONITORING_SETTINGS),
+    }
+
+
+def family_document(parents, family_id=None, children=()):
+    """New family document; the first parent is recorded as its creator"""
+    return {
+        "family_id": family_id or str(uuid.uuid4()),
+        "family_name": None,  # Nullable - can be set later
+        "created_at": timezone.now(),
+        "django_user_id": parents[0].id,  # Link to Django user
+        "parents": [parent_entry(parent) for parent in parents],
+        "children": list(children),
+        "family_settings": dict(DEFAULT_FAMILY_SETTINGS),
+    }
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.contrib.auth.hashers import (Argon2PasswordHasher,
+                                         BCryptSHA256PasswordHasher,
+                                         PBKDF2PasswordHasher)
+
+# Hashers whose cost parameters come from settings.PASSWORD_HASHER_PARAMS.
+# They keep the stock algorithm names, so existing hashes still verify and
+# Django's must_update() flags hashes made with different parameters for a
+# transparent rehash on the next successful login.
+
+
+def _param(profile, name, default):
+    return getattr(settings, "PASSWORD_HASHER_PARAMS", {}).get(profile, {}).get(
+        name, default
+    )
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return _param("argon2", "time_cost", Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        return _param("argon2", "memory_cost", Argon2PasswordHasher.memory_cost)
+
+    @property
+    def parallelism(self):
+        return _param("argon2", "parallelism", Argon2PasswordHasher.parallelism)
+
+
+class TunedBCryptSHA256PasswordHasher(BCryptSHA256PasswordHasher):
+    @property
+    def rounds(self):
+        return _param("bcrypt", "rounds", BCryptSHA256PasswordHasher.rounds)
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return _param("pbkdf2", "iterations", PBKDF2PasswordHasher.iterations)
@@ -0,0 +1,71 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import (check_password, get_hasher,
+                                         identify_hasher)
+
+
+class HashingPoolSaturated(Exception):
+    """Raised when too many password verifications are already queued"""
+
+
+_executor = None
+_slots = None
+_init_lock = threading.Lock()
+
+
+def _pool_settings():
+    return getattr(settings, "PASSWORD_HASHING_POOL", {})
+
+
+def _get_pool():
+    global _executor, _slots
+    if _executor is None:
+        with _init_lock:
+            if _executor is None:
+                config = _pool_settings()
+                workers = config.get("workers", 0)
+                _slots = threading.BoundedSemaphore(
+                    workers + config.get("max_pending", 4 * workers)
+                )
+                # argon2-cffi, bcrypt and hashlib.pbkdf2_hmac release the GIL,
+                # so a small thread pool runs hashes on several cores
+                _executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="password-hashing"
+                )
+    return _executor, _slots
+
+
+def needs_rehash(encoded):
+    """True if the hash wasn't made with the preferred hasher and parameters"""
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    preferred = get_hasher("default")
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+def verify_password(user, raw_password):
+    """
+    Check a user's password, on the bounded hashing pool when it is enabled,
+    and upgrade the stored hash on success if the hasher profile changed.
+    """
+    encoded = user.password
+    if not _pool_settings().get("workers"):
+        valid = check_password(raw_password, encoded)
+    else:
+        executor, slots = _get_pool()
+        if not slots.acquire(timeout=_pool_settings().get("wait_timeout", 2.0)):
+            raise HashingPoolSaturated
+        try:
+            valid = executor.submit(check_password, raw_password, encoded).result()
+        finally:
+            slots.release()
+
+    if valid and needs_rehash(encoded):
+        # Rehash on the request thread so the save uses its DB connection
+        user.set_password(raw_password)
+        user.save(update_fields=["password"])
+    return valid
@@ -0,0 +1,439 @@
+import csv
+import itertools
+import logging
+import random
+import uuid
+from collections import Counter
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers
+
+from .emails import invitation_email, queue_emails, welcome_email
+from .families import family_document, get_families_collection
+from .models import ChildRegistrationCode, FamilyInvitation, Parent
+from .serializers import ImportRowSerializer
+
+logger = logging.getLogger(__name__)
+
+IMPORT_JOBS_COLLECTION = "import_jobs"
+
+COLUMNS = (
+    "family_ref",
+    "guardian_name",
+    "guardian_email",
+    "guardian_phone",
+    "child_name",
+    "device_type",
+    "device_model",
+    "notes",
+)
+REQUIRED_COLUMNS = {"family_ref"}
+
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class ImportFormatError(ValueError):
+    """The file is not a CSV with the expected header"""
+
+
+def _config():
+    return getattr(settings, "BULK_IMPORT", {})
+
+
+def get_jobs_collection():
+    from utils.mongodb import mongodb_connection
+
+    return mongodb_connection.get_collection(IMPORT_JOBS_COLLECTION)
+
+
+def read_rows(lines):
+    """
+    Check the header of a CSV and return a lazy iterator of (line number,
+    row) pairs, with every known column present and stripped.
+    """
+    reader = csv.DictReader(lines)
+    missing = REQUIRED_COLUMNS - set(reader.fieldnames or ())
+    if missing:
+        raise ImportFormatError(f"Missing column(s): {', '.join(sorted(missing))}")
+    return (
+        (reader.line_num, {key: (row.get(key) or "").strip() for key in COLUMNS})
+        for row in reader
+    )
+
+
+def _plain(detail):
+    """ValidationError detail as plain dicts/lists/strings (storable in Mongo)"""
+    if isinstance(detail, dict):
+        return {key: _plain(value) for key, value in detail.items()}
+    if isinstance(detail, list):
+        return [_plain(value) for value in detail]
+    return str(detail)
+
+
+def _unique_codes(model, field, count):
+    """``count`` random 6-digit codes unused in ``model.field``, checked in bulk"""
+    codes = set()
+    while len(codes) < count:
+        candidates = {
+            str(random.randint(100000, 999999)) for _ in range(count - len(codes))
+        } - codes
+        taken = set(
+            model.objects.filter(**{f"{field}__in": candidates}).values_list(
+                field, flat=True
+            )
+        )
+        codes |= candidates - taken
+    return list(codes)
+
+
+def _unique_usernames(emails):
+    """Usernames derived from emails like registration does, one query each way"""
+    bases = [email.split("@")[0] for email in emails]
+    taken = set(
+        Parent.objects.filter(username__in=set(bases)).values_list(
+            "username", flat=True
+        )
+    )
+    if taken:
+        # Only bases that collide need their numbered variants
+        taken |= set(
+            Parent.objects.filter(
+                reduce(or_, (Q(username__startswith=base) for base in taken))
+            ).values_list("username", flat=True)
+        )
+    usernames = []
+    for base in bases:
+        username, counter = base, 1
+        while username in taken:
+            username = f"{base}{counter}"
+            counter += 1
+        taken.add(username)
+        usernames.append(username)
+    return usernames
+
+
+class OnboardingImport:
+    """
+    Create families from an onboarding CSV in bulk.
+
+    Rows sharing a family_ref (which must be contiguous) form a family:
+    the first valid guardian becomes its primary parent, the other
+    guardians get pending invitations and every distinct child a pending
+    registration code, as if each had gone through registration,
+    SendFamilyInvitationView and GenerateChildCodeView.
+
+    Rows are parsed lazily and handled BATCH_SIZE rows at a time (whole
+    families per batch): field validation runs row by row through one
+    serializer instance, the database checks (existing emails, usernames,
+    code collisions) run once per batch, and the batch is written with
+    bulk_create plus one insert_many inside a transaction. Progress is
+    checkpointed in the import_jobs collection after every batch, so an
+    interrupted import can be resumed from the last committed row.
+    Invalid rows are reported with their line number and skipped.
+    Welcome emails (with the child codes) and invitation emails are queued
+    in the same transaction.
+
+    Imported parents have no usable password until they set one.
+    """
+
+    def __init__(self, job_id=None, source="", created_by="", on_error=None):
+        config = _config()
+        self.job_id = job_id or uuid.uuid4().hex
+        self.source = source
+        self.created_by = created_by
+        self.on_error = on_error
+        self.batch_size = config.get("BATCH_SIZE", 500)
+        self.max_errors = config.get("MAX_REPORTED_ERRORS", 1000)
+        self.rows_done = 0
+        self.counts = Counter()
+        self.errors = []
+        self.error_count = 0
+        self._new_errors = []
+        self._batch_errors = {}
+        self._seen_refs = set()
+        self._seen_emails = set()
+        self._row_serializer = ImportRowSerializer()
+
+    @classmethod
+    def resume(cls, job_id, on_error=None):
+        """Importer continuing a checkpointed job; LookupError if unknown"""
+        job = get_jobs_collection().find_one({"_id": job_id})
+        if job is None:
+            raise LookupError(f"Unknown import job {job_id}")
+        importer = cls(
+            job_id=job_id,
+            source=job.get("source", ""),
+            created_by=job.get("created_by", ""),
+            on_error=on_error,
+        )
+        importer.rows_done = job.get("rows_done", 0)
+        importer.counts.update(job.get("counts") or {})
+        importer.errors = list(job.get("errors") or [])
+        importer.error_count = job.get("error_count", 0)
+        return importer
+
+    def summary(self):
+        return {
+            "job_id": self.job_id,
+            "status": COMPLETED,
+            "rows_done": self.rows_done,
+            "counts": dict(self.counts),
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
+
+    def run(self, lines):
+        """Import CSV text lines, skipping rows already checkpointed"""
+        rows = itertools.islice(read_rows(lines), self.rows_done, None)
+        jobs = get_jobs_collection()
+        jobs.update_one(
+            {"_id": self.job_id},
+            {
+                "$set": {"status": RUNNING, "updated_at": timezone.now()},
+                "$setOnInsert": {
+                    "source": self.source,
+                    "created_by": self.created_by,
+                    "started_at": timezone.now(),
+                    "rows_done": 0,
+                },
+            },
+            upsert=True,
+        )
+        try:
+            batch, batch_rows = [], 0
+            families = itertools.groupby(rows, key=lambda row: row[1]["family_ref"])
+            for ref, group in families:
+                group = list(group)
+                batch.append((ref, group))
+                batch_rows += len(group)
+                if batch_rows >= self.batch_size:
+                    self._process(batch, batch_rows)
+                    batch, batch_rows = [], 0
+            if batch:
+                self._process(batch, batch_rows)
+        except Exception:
+            jobs.update_one(
+                {"_id": self.job_id},
+                {"$set": {"status": FAILED, "updated_at": timezone.now()}},
+            )
+            raise
+        jobs.update_one(
+            {"_id": self.job_id},
+            {"$set": {"status": COMPLETED, "finished_at": timezone.now()}},
+        )
+        logger.info(
+            "Import %s completed: %s rows, %s errors",
+            self.job_id,
+            self.rows_done,
+            self.error_count,
+        )
+        return self.summary()
+
+    def _error(self, line, ref, errors):
+        """Record errors of a row; reported once its batch is committed"""
+        error = self._batch_errors.setdefault(
+            line, {"row": line, "family_ref": ref, "errors": {}}
+        )
+        for field, messages in _plain(errors).items():
+            error["errors"].setdefault(field, []).extend(messages)
+
+    def _report_errors(self):
+        for line in sorted(self._batch_errors):
+            error = self._batch_errors[line]
+            self.error_count += 1
+            if len(self.errors) < self.max_errors:
+                self.errors.append(error)
+                self._new_errors.append(error)
+            if self.on_error is not None:
+                self.on_error(error)
+        self._batch_errors = {}
+
+    def _validate(self, ref, group):
+        """Valid (line, row) pairs of one family, reporting the others"""
+        if ref in self._seen_refs:
+            for line, _ in group:
+                self._error(
+                    line,
+                    ref,
+                    {"family_ref": ["Rows of a family must be contiguous"]},
+                )
+            return []
+        self._seen_refs.add(ref)
+        valid = []
+        for line, row in group:
+            try:
+                valid.append((line, self._row_serializer.run_validation(row)))
+            except serializers.ValidationError as exc:
+                self._error(line, ref, exc.detail)
+        return valid
+
+    def _plan(self, ref, rows, existing_emails):
+        """Primary guardian, invitees and children of one family, or None"""
+        guardians = {}
+        children = {}
+        for line, row in rows:
+            email = row["guardian_email"]
+            if email and email not in guardians:
+                if email in existing_emails:
+                    problem = "This email already has an account"
+                elif email in self._seen_emails:
+                    problem = "Email is used by another family in this file"
+                else:
+                    guardians[email] = row
+                    problem = None
+                if problem:
+                    self._error(line, ref, {"guardian_email": [problem]})
+            if row["child_name"]:
+                children.setdefault(row["child_name"], row)
+        if not guardians:
+            for line, _ in rows:
+                self._error(
+                    line, ref, {"non_field_errors": ["Family has no valid guardian"]}
+                )
+            return None
+        self._seen_emails.update(guardians)
+        primary, *invitees = guardians.values()
+        return primary, invitees, list(children.values())
+
+    def _process(self, batch, batch_rows):
+        families = [(ref, self._validate(ref, group)) for ref, group in batch]
+        emails = {
+            row["guardian_email"]
+            for _, rows in families
+            for _, row in rows
+            if row["guardian_email"]
+        }
+        existing = set(
+            Parent.objects.filter(email__in=emails).values_list("email", flat=True)
+        )
+        plans = []
+        for ref, rows in families:
+            plan = self._plan(ref, rows, existing) if rows else None
+            if plan is not None:
+                plans.append(plan)
+
+        if plans:
+            self._create(plans)
+        self.rows_done += batch_rows
+        self._report_errors()
+        self._checkpoint()
+
+    def _create(self, plans):
+        now = timezone.now()
+        usernames = _unique_usernames(
+            [primary["guardian_email"] for primary, _, _ in plans]
+        )
+        invitation_codes = iter(
+            _unique_codes(
+                FamilyInvitation,
+                "invitation_code",
+                sum(len(invitees) for _, invitees, _ in plans),
+            )
+        )
+        child_codes = iter(
+            _unique_codes(
+                ChildRegistrationCode,
+                "registration_code",
+                sum(len(children) for _, _, children in plans),
+            )
+        )
+        code_ttl = timedelta(hours=_config().get("CHILD_CODE_TTL_HOURS", 24))
+
+        parents = [
+            Parent(
+                username=username,
+                email=primary["guardian_email"],
+                full_name=primary["guardian_name"],
+                phone=primary["guardian_phone"],
+                family_id=str(uuid.uuid4()),
+                role="primary",
+                password=make_password(None),
+            )
+            for username, (primary, _, _) in zip(usernames, plans)
+        ]
+        invitations = []
+        codes = []
+        with transaction.atomic():
+            # Returns primary keys (PostgreSQL, SQLite, MariaDB)
+            Parent.objects.bulk_create(parents)
+            for parent, (_, invitees, children) in zip(parents, plans):
+                invitations.extend(
+                    FamilyInvitation(
+                        invitation_code=next(invitation_codes),
+                        invited_email=invitee["guardian_email"],
+                        invited_by=parent,
+                        family_id=parent.family_id,
+                        expires_at=now + timedelta(days=7),
+                    )
+                    for invitee in invitees
+                )
+                codes.extend(
+                    ChildRegistrationCode(
+                        registration_code=next(child_codes),
+                        child_name=child["child_name"],
+                        family_id=parent.family_id,
+                        created_by=parent,
+                        expires_at=now + code_ttl,
+                        device_info={
+                            "device_type": child["device_type"],
+                            "device_model": child["device_model"],
+                            "notes": child["notes"],
+                            "expected_setup_date": now.isoformat(),
+                        },
+                    )
+                    for child in children
+                )
+            FamilyInvitation.objects.bulk_create(invitations)
+            ChildRegistrationCode.objects.bulk_create(codes)
+            codes_by_family = {}
+            for code in codes:
+                codes_by_family.setdefault(code.family_id, []).append(code)
+            queue_emails(
+                [
+                    welcome_email(parent, codes_by_family.get(parent.family_id, []))
+                    for parent in parents
+                ]
+                + [
+                    invitation_email(invitation, invitation.invited_by.full_name)
+                    for invitation in invitations
+                ]
+            )
+            # Inside the transaction: if MongoDB fails, the SQL rows roll back
+            get_families_collection().insert_many(
+                [
+                    family_document([parent], family_id=parent.family_id)
+                    for parent in parents
+                ],
+                ordered=False,
+            )
+
+        self.counts.update(
+            parents=len(parents),
+            families=len(parents),
+            invitations=len(invitations),
+            child_codes=len(codes),
+        )
+        return parents, invitations, codes
+
+    def _checkpoint(self):
+        update = {
+            "$set": {
+                "rows_done": self.rows_done,
+                "counts": dict(self.counts),
+                "error_count": self.error_count,
+                "updated_at": timezone.now(),
+            }
+        }
+        if self._new_errors:
+            update["$push"] = {"errors": {"$each": self._new_errors}}
+            self._new_errors = []
+        get_jobs_collection().update_one({"_id": self.job_id}, update)
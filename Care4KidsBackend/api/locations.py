@@ -0,0 +1,299 @@
+import math
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from datetime import timezone as dt_timezone
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.utils import timezone
+
+from .bedtime import DEVICE_STATES_COLLECTION
+from .families import get_families_collection
+
+PINGS_COLLECTION = "location_pings"
+GEOFENCE_EVENTS_COLLECTION = "geofence_events"
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = 111320.0
+
+
+def _config():
+    return getattr(settings, "LOCATION_INGEST", {})
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = (
+        math.sin(dphi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class GeofenceIndex:
+    """
+    Circular geofences bucketed into a fixed lat/lng grid.
+
+    Each fence is registered in every cell its bounding box touches, so a
+    point is only distance-checked against the fences of its own cell.
+    """
+
+    def __init__(self, fences, cell_deg=0.01):
+        self.cell_deg = cell_deg
+        self._cells = defaultdict(list)
+        for fence in fences:
+            lat, lng, radius = fence["lat"], fence["lng"], fence["radius_m"]
+            dlat = radius / METERS_PER_DEGREE
+            dlng = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+            min_row, min_col = self._cell(lat - dlat, lng - dlng)
+            max_row, max_col = self._cell(lat + dlat, lng + dlng)
+            entry = (fence["fence_id"], lat, lng, radius)
+            for row in range(min_row, max_row + 1):
+                for col in range(min_col, max_col + 1):
+                    self._cells[(row, col)].append(entry)
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def containing(self, lat, lng):
+        """Ids of the fences that contain the point"""
+        return frozenset(
+            fence_id
+            for fence_id, fence_lat, fence_lng, radius in self._cells.get(
+                self._cell(lat, lng), ()
+            )
+            if haversine_m(lat, lng, fence_lat, fence_lng) <= radius
+        )
+
+
+_lock = threading.Lock()
+_geofence_cache = TTLCache(maxsize=50000, ttl=60)
+_indexed = False
+
+
+def _ensure_indexes():
+    global _indexed
+    if not _indexed:
+        from utils.mongodb import mongodb_connection
+
+        pings = mongodb_connection.get_collection(PINGS_COLLECTION)
+        pings.create_index([("location", "2dsphere")])
+        pings.create_index([("device_id", 1), ("recorded_at", -1)])
+        _indexed = True
+
+
+def get_geofence_index(family_id):
+    with _lock:
+        index = _geofence_cache.get(family_id)
+    if index is None:
+        family = get_families_collection().find_one(
+            {"family_id": family_id}, projection={"geofences": 1}
+        )
+        fences = (family or {}).get("geofences") or []
+        index = GeofenceIndex(fences, _config().get("GEOFENCE_CELL_DEG", 0.01))
+        with _lock:
+            _geofence_cache[family_id] = index
+    return index
+
+
+def invalidate_geofences(family_id):
+    with _lock:
+        _geofence_cache.pop(family_id, None)
+
+
+def add_geofence(family_id, name, kind, lat, lng, radius_m):
+    fence = {
+        "fence_id": uuid.uuid4().hex,
+        "name": name,
+        "type": kind,
+        "lat": lat,
+        "lng": lng,
+        "radius_m": radius_m,
+        "created_at": timezone.now(),
+    }
+    get_families_collection().update_one(
+        {"family_id": family_id},
+        {"$push": {"geofences": fence}, "$set": {"updated_at": timezone.now()}},
+    )
+    invalidate_geofences(family_id)
+    return fence
+
+
+def remove_geofence(family_id, fence_id):
+    result = get_families_collection().update_one(
+        {"family_id": family_id, "geofences.fence_id": fence_id},
+        {
+            "$pull": {"geofences": {"fence_id": fence_id}},
+            "$set": {"updated_at": timezone.now()},
+        },
+    )
+    invalidate_geofences(family_id)
+    return result.matched_count > 0
+
+
+def _timestamp(value):
+    if timezone.is_naive(value):
+        # pymongo returns naive UTC datetimes unless tz_aware is set
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return value.timestamp()
+
+
+def _stored_state(device_id, collection):
+    """Geofence state of a device, from device_states"""
+    document = collection.find_one(
+        {"_id": device_id},
+        projection={
+            "last_location": 1,
+            "inside_geofences": 1,
+            "evaluated_at": 1,
+            "geofence_version": 1,
+        },
+    ) or {}
+    last = document.get("last_location")
+    if last:
+        last = (_timestamp(last["recorded_at"]), last["lat"], last["lng"])
+    seen = document.get("evaluated_at")
+    return {
+        # (timestamp, lat, lng) of the last stored ping
+        "last": last,
+        # Timestamp of the newest ping evaluated against the geofences
+        "seen": _timestamp(seen) if seen else last and last[0],
+        "inside": frozenset(document.get("inside_geofences") or ()),
+        # Bumped on every write; guards against concurrent ingests
+        "version": document.get("geofence_version") or 0,
+    }
+
+
+def _evaluate(device, pings, state, index, min_distance, max_interval, received_at):
+    """Return (new state, ping documents to store, geofence events)"""
+    state = dict(state)
+    documents = []
+    events = []
+    for ping in sorted(pings, key=lambda p: p["recorded_at"]):
+        lat, lng = ping["lat"], ping["lng"]
+        recorded_at = ping["recorded_at"]
+        ts = recorded_at.timestamp()
+        if state["seen"] is not None and ts <= state["seen"]:
+            continue  # duplicate, replayed or out of order
+        state["seen"] = ts
+
+        inside = index.containing(lat, lng)
+        for fence_id in inside ^ state["inside"]:
+            events.append(
+                {
+                    "device_id": device.device_id,
+                    "family_id": device.family_id,
+                    "child_id": device.child_id,
+                    "fence_id": fence_id,
+                    "event": "enter" if fence_id in inside else "exit",
+                    "recorded_at": recorded_at,
+                    "location": {"type": "Point", "coordinates": [lng, lat]},
+                }
+            )
+        state["inside"] = inside
+
+        last = state["last"]
+        if last is not None:
+            moved = haversine_m(lat, lng, last[1], last[2])
+            if moved < min_distance and ts - last[0] < max_interval:
+                continue  # stationary
+        state["last"] = (ts, lat, lng)
+        documents.append(
+            {
+                "device_id": device.device_id,
+                "family_id": device.family_id,
+                "child_id": device.child_id,
+                "location": {"type": "Point", "coordinates": [lng, lat]},
+                "accuracy_m": ping.get("accuracy"),
+                "recorded_at": recorded_at,
+                "received_at": received_at,
+            }
+        )
+    return state, documents, events
+
+
+def _save_state(collection, device, previous, state, last_recorded_at):
+    """
+    Write the new state unless another ingest wrote since ``previous`` was
+    read. Returns False on such a conflict.
+    """
+    from pymongo.errors import DuplicateKeyError
+
+    update = {
+        "family_id": device.family_id,
+        "child_id": device.child_id,
+        "inside_geofences": sorted(state["inside"]),
+        "evaluated_at": datetime.fromtimestamp(state["seen"], dt_timezone.utc),
+        "geofence_version": previous["version"] + 1,
+    }
+    if last_recorded_at is not None:
+        update["last_location"] = {
+            "lat": state["last"][1],
+            "lng": state["last"][2],
+            "recorded_at": last_recorded_at,
+        }
+    try:
+        result = collection.update_one(
+            # Version 0 also matches a missing field (no geofence write yet)
+            {"_id": device.device_id, "geofence_version": previous["version"] or None},
+            {"$set": update},
+            upsert=not previous["version"],
+        )
+    except DuplicateKeyError:
+        # The upsert lost: the document exists with another version
+        return False
+    return result.matched_count > 0 or result.upserted_id is not None
+
+
+def ingest_pings(device, pings):
+    """
+    Store a batch of pings from one device and evaluate its geofences.
+
+    Pings not newer than the last evaluated one (replays, late batches)
+    are skipped. Every other ping is checked against the family's fences,
+    but only stored if the device moved at least MIN_DISTANCE_M since the
+    last stored ping or MAX_INTERVAL_S passed, so a stationary device
+    writes one point per interval. Returns (stored count, geofence events).
+
+    The geofence state lives in device_states and is written with a
+    version check, so concurrent ingests for one device (several workers)
+    never report the same transition twice: the loser re-reads the state
+    and evaluates its batch again on top of it.
+    """
+    from utils.mongodb import mongodb_connection
+
+    config = _config()
+    min_distance = config.get("MIN_DISTANCE_M", 25)
+    max_interval = config.get("MAX_INTERVAL_S", 300)
+    _ensure_indexes()
+    states = mongodb_connection.get_collection(DEVICE_STATES_COLLECTION)
+    index = get_geofence_index(device.family_id)
+    received_at = timezone.now()
+
+    while True:
+        previous = _stored_state(device.device_id, states)
+        state, documents, events = _evaluate(
+            device, pings, previous, index, min_distance, max_interval, received_at
+        )
+        if not (documents or events):
+            # Re-evaluating these pings gives the same result; nothing to save
+            return 0, []
+        last_recorded_at = documents[-1]["recorded_at"] if documents else None
+        if _save_state(states, device, previous, state, last_recorded_at):
+            break
+
+    if documents:
+        mongodb_connection.get_collection(PINGS_COLLECTION).insert_many(
+            documents, ordered=False
+        )
+    if events:
+        # insert_many adds _id to the dicts; callers get the plain events
+        mongodb_connection.get_collection(GEOFENCE_EVENTS_COLLECTION).insert_many(
+            [dict(event) for event in events], ordered=False
+        )
+    return len(documents), events
@@ -0,0 +1,312 @@
+import json
+import os
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from utils.fakes import FakeGenerativeModel
+from utils.gemini import reset_model
+
+# URL names exercised by each virtual user, in order
+FLOW = [
+    "parent-register",
+    "parent-login",
+    "generate-child-code",
+    "accept-child-code",
+    "chatbot",
+]
+
+BENCH_PASSWORD = "Bench-Passw0rd!"
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive register -> login -> child code -> accept code -> chatbot with "
+        "concurrent virtual users against a throwaway database, a local MongoDB "
+        "stand-in and a stubbed Gemini model, and report latency percentiles"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument(
+            "--iterations", type=int, default=3, help="Flows per virtual user"
+        )
+        parser.add_argument(
+            "--gemini-latency",
+            type=float,
+            default=0.0,
+            help="Injected stub model latency in milliseconds",
+        )
+        parser.add_argument(
+            "--budget",
+            help="JSON file mapping URL names (or '*') to p50_ms/p95_ms/p99_ms/"
+            "min_rps/max_error_rate limits",
+        )
+        parser.add_argument(
+            "--baseline", help="Results JSON from a previous run to compare against"
+        )
+        parser.add_argument(
+            "--max-regression",
+            type=float,
+            default=0.2,
+            help="Allowed relative p95/rps regression against --baseline",
+        )
+        parser.add_argument("--output", help="Write results JSON to this path")
+        parser.add_argument(
+            "--fast-hashing",
+            action="store_true",
+            help="Use a cheap password hasher to isolate non-hashing costs",
+        )
+        parser.add_argument(
+            "--real-mongo",
+            action="store_true",
+            help="Use the configured MongoDB instead of the in-memory stand-in",
+        )
+
+    def handle(self, *args, **options):
+        overrides = {}
+        if not options["real_mongo"]:
+            overrides["MONGODB_SETTINGS"] = {
+                **settings.MONGODB_SETTINGS,
+                "client_class": "utils.fakes.InMemoryMongoClient",
+            }
+        if options["fast_hashing"]:
+            overrides["PASSWORD_HASHERS"] = [
+                "django.contrib.auth.hashers.MD5PasswordHasher"
+            ]
+
+        with override_settings(**overrides):
+            from utils.mongodb import mongodb_connection
+
+            mongodb_connection.connect()
+            reset_model(FakeGenerativeModel(latency=options["gemini_latency"] / 1000))
+            try:
+                report = self.run_benchmark(options["users"], options["iterations"])
+            finally:
+                reset_model()
+
+        self.print_report(report)
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(report, fh, indent=2)
+
+        violations = []
+        if options["budget"]:
+            with open(options["budget"]) as fh:
+                violations += self.check_budget(report, json.load(fh))
+        if options["baseline"]:
+            with open(options["baseline"]) as fh:
+                violations += self.check_baseline(
+                    report, json.load(fh), options["max_regression"]
+                )
+        if violations:
+            raise CommandError(
+                "Performance budget exceeded:\n  " + "\n  ".join(violations)
+            )
+
+    def run_benchmark(self, users, iterations):
+        setup_test_environment()
+        test_settings = connection.settings_dict.setdefault("TEST", {})
+        if connection.vendor == "sqlite" and not test_settings.get("NAME"):
+            # Shared-cache in-memory SQLite fails concurrent writers instead of
+            # queueing them, so run against a temporary file database
+            test_settings["NAME"] = os.path.join(
+                tempfile.mkdtemp(prefix="care4kids-bench-"), "bench.sqlite3"
+            )
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            run_id = uuid.uuid4().hex[:8]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=users) as executor:
+                futures = [
+                    executor.submit(self.run_user, f"{run_id}-{index}", iterations)
+                    for index in range(users)
+                ]
+                samples = [sample for future in futures for sample in future.result()]
+            wall_seconds = time.perf_counter() - started
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        return self.summarize(samples, users, iterations, wall_seconds)
+
+    def run_user(self, user_tag, iterations):
+        client = APIClient()
+        samples = []
+        try:
+            for iteration in range(iterations):
+                self.run_flow(client, f"{user_tag}-{iteration}", samples)
+        finally:
+            # Each virtual user thread holds its own database connection
+            connection.close()
+        return samples
+
+    def run_flow(self, client, tag, samples):
+        client.credentials()
+        email = f"bench-{tag}@example.com"
+
+        data = self.timed_post(
+            client,
+            samples,
+            "parent-register",
+            {
+                "full_name": f"Bench Parent {tag}",
+                "email": email,
+                "password": BENCH_PASSWORD,
+                "password_confirm": BENCH_PASSWORD,
+            },
+            201,
+        )
+        if data is None:
+            return
+
+        data = self.timed_post(
+            client,
+            samples,
+            "parent-login",
+            {"email": email, "password": BENCH_PASSWORD},
+            200,
+        )
+        if data is None:
+            return
+        client.credentials(HTTP_AUTHORIZATION=f"Token {data['token']}")
+
+        data = self.timed_post(
+            client, samples, "generate-child-code", {"child_name": f"Child {tag}"}, 201
+        )
+        if data is None:
+            return
+
+        self.timed_post(
+            client,
+            samples,
+            "accept-child-code",
+            {
+                "registration_code": data["child_registration"]["registration_code"],
+                "device_id": f"device-{tag}",
+            },
+            200,
+        )
+        self.timed_post(
+            client,
+            samples,
+            "chatbot",
+            {"message": "¿Cómo puedo ayudar a mi hijo a dormir mejor?"},
+            200,
+        )
+
+    def timed_post(self, client, samples, url_name, payload, expected_status):
+        started = time.perf_counter()
+        response = client.post(reverse(url_name), payload, format="json")
+        elapsed = time.perf_counter() - started
+        ok = response.status_code == expected_status
+        samples.append((url_name, elapsed, ok))
+        return response.json() if ok else None
+
+    def summarize(self, samples, users, iterations, wall_seconds):
+        by_endpoint = defaultdict(list)
+        errors = defaultdict(int)
+        for url_name, elapsed, ok in samples:
+            by_endpoint[url_name].append(elapsed * 1000)
+            if not ok:
+                errors[url_name] += 1
+
+        endpoints = {}
+        for url_name in FLOW:
+            latencies = sorted(by_endpoint.get(url_name, []))
+            count = len(latencies)
+            endpoints[url_name] = {
+                "count": count,
+                "errors": errors[url_name],
+                "error_rate": errors[url_name] / count if count else 0.0,
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "rps": count / wall_seconds if wall_seconds else 0.0,
+            }
+
+        return {
+            "users": users,
+            "iterations": iterations,
+            "wall_seconds": wall_seconds,
+            "endpoints": endpoints,
+        }
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{report['users']} users x {report['iterations']} flows "
+            f"in {report['wall_seconds']:.2f}s"
+        )
+        self.stdout.write(
+            f"{'endpoint':<22}{'count':>7}{'errors':>8}{'p50 ms':>10}"
+            f"{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}"
+        )
+        for url_name, stats in report["endpoints"].items():
+            self.stdout.write(
+                f"{url_name:<22}{stats['count']:>7}{stats['errors']:>8}"
+                f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+                f"{stats['p99_ms']:>10.1f}{stats['rps']:>9.1f}"
+            )
+
+    def check_budget(self, report, budget):
+        violations = []
+        for url_name, stats in report["endpoints"].items():
+            limits = {**budget.get("*", {}), **budget.get(url_name, {})}
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                if key in limits and stats[key] > limits[key]:
+                    violations.append(
+                        f"{url_name}: {key} {stats[key]:.1f} > budget {limits[key]}"
+                    )
+            if "min_rps" in limits and stats["rps"] < limits["min_rps"]:
+                violations.append(
+                    f"{url_name}: rps {stats['rps']:.1f} < budget {limits['min_rps']}"
+                )
+            if (
+                "max_error_rate" in limits
+                and stats["error_rate"] > limits["max_error_rate"]
+            ):
+                violations.append(
+                    f"{url_name}: error rate {stats['error_rate']:.2%} > budget "
+                    f"{limits['max_error_rate']:.2%}"
+                )
+        return violations
+
+    def check_baseline(self, report, baseline, max_regression):
+        violations = []
+        for url_name, stats in report["endpoints"].items():
+            previous = baseline.get("endpoints", {}).get(url_name)
+            if not previous or not stats["count"]:
+                continue
+            p95_limit = previous["p95_ms"] * (1 + max_regression)
+            if stats["p95_ms"] > p95_limit:
+                violations.append(
+                    f"{url_name}: p95 {stats['p95_ms']:.1f}ms regressed past "
+                    f"{p95_limit:.1f}ms (baseline {previous['p95_ms']:.1f}ms)"
+                )
+            rps_floor = previous["rps"] * (1 - max_regression)
+            if stats["rps"] < rps_floor:
+                violations.append(
+                    f"{url_name}: {stats['rps']:.1f} req/s regressed below "
+                    f"{rps_floor:.1f} (baseline {previous['rps']:.1f})"
+                )
+        return violations
@@ -0,0 +1,127 @@
+import gzip
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api.middleware import brotli
+from api.models import ChildRegistrationCode
+from api.renderers import MessagePackRenderer
+from api.views import child_code_entry
+
+DEVICE_TYPES = ["tablet", "phone", "laptop"]
+DEVICE_MODELS = ["Galaxy Tab A8", "iPad 9th gen", "Moto G54", "Redmi Note 13"]
+CHILD_NAMES = ["Sofía", "Mateo", "Valentina", "Santiago", "Isabella", "Sebastián"]
+
+
+def sample_child_codes(count, seed=0):
+    """Unsaved ChildRegistrationCode rows shaped like real used/pending codes"""
+    rng = random.Random(seed)
+    now = timezone.now()
+    codes = []
+    for i in range(count):
+        created_at = now - timedelta(hours=rng.randint(1, 24 * 30))
+        used = rng.random() < 0.7
+        device_info = {
+            "device_type": rng.choice(DEVICE_TYPES),
+            "device_model": rng.choice(DEVICE_MODELS),
+            "notes": "",
+            "expected_setup_date": created_at.isoformat(),
+        }
+        if used:
+            device_info["actual_device"] = {
+                "device_id": f"{rng.getrandbits(64):016x}",
+                "device_name": f"Dispositivo de {CHILD_NAMES[i % len(CHILD_NAMES)]}",
+                "device_os": rng.choice(["Android 14", "iPadOS 17.5"]),
+                "device_model": device_info["device_model"],
+                "app_version": "1.4.2",
+                "linked_at": (created_at + timedelta(minutes=5)).isoformat(),
+                "status": "active",
+            }
+            device_info["monitoring_enabled"] = True
+        codes.append(
+            ChildRegistrationCode(
+                registration_code=f"{rng.randint(100000, 999999)}",
+                child_name=CHILD_NAMES[i % len(CHILD_NAMES)],
+                family_id=f"{rng.getrandbits(96):024x}",
+                status="used" if used else "pending",
+                created_at=created_at,
+                expires_at=created_at + timedelta(hours=24),
+                used_at=created_at + timedelta(minutes=5) if used else None,
+                device_info=device_info,
+            )
+        )
+    return codes
+
+
+def _measure(func, repeat):
+    """Return (result, CPU microseconds per call)"""
+    started = time.process_time()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.process_time() - started) / repeat * 1e6
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare response sizes and encode/compress CPU cost for JSON vs "
+        "MessagePack, uncompressed, gzip and brotli, on MyChildCodesView payloads"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--codes",
+            type=int,
+            nargs="+",
+            default=[1, 10, 100],
+            help="Number of child codes per payload",
+        )
+        parser.add_argument("--repeat", type=int, default=200)
+        parser.add_argument("--gzip-level", type=int, default=6)
+        parser.add_argument("--brotli-quality", type=int, default=4)
+
+    def handle(self, *args, **options):
+        repeat = options["repeat"]
+        renderers = [("json", JSONRenderer()), ("msgpack", MessagePackRenderer())]
+        compressors = [
+            ("identity", lambda body: body),
+            ("gzip", lambda body: gzip.compress(body, options["gzip_level"])),
+        ]
+        if brotli is not None:
+            compressors.append(
+                (
+                    "br",
+                    lambda body: brotli.compress(
+                        body, quality=options["brotli_quality"]
+                    ),
+                )
+            )
+        else:
+            self.stdout.write("brotli not installed; skipping br")
+
+        self.stdout.write(
+            f"{'codes':>5}  {'format':<8} {'encoding':<9} {'bytes':>8} "
+            f"{'ratio':>6} {'render us':>10} {'compress us':>12}"
+        )
+        for count in options["codes"]:
+            data = {
+                "success": True,
+                "child_codes": [
+                    child_code_entry(code) for code in sample_child_codes(count)
+                ],
+                "total_codes": count,
+            }
+            baseline = None
+            for format_name, renderer in renderers:
+                body, render_us = _measure(lambda: renderer.render(data), repeat)
+                for encoding, compress in compressors:
+                    compressed, compress_us = _measure(lambda: compress(body), repeat)
+                    baseline = baseline or len(compressed)
+                    self.stdout.write(
+                        f"{count:>5}  {format_name:<8} {encoding:<9} "
+                        f"{len(compressed):>8} {len(compressed) / baseline:>6.2f} "
+                        f"{render_us:>10.1f} {compress_us:>12.1f}"
+                    )
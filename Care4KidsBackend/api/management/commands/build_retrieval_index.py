@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from utils.retrieval import publish_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the memory-mapped BM25 index the chatbot uses for grounding "
+        "(kept if the corpus didn't change)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--corpus", default=str(settings.RETRIEVAL_CORPUS))
+        parser.add_argument("--output", default=str(settings.RETRIEVAL_INDEX_DIR))
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        index_dir = publish_index(options["corpus"], options["output"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Index of {options['corpus']} is in {index_dir} "
+                f"({time.perf_counter() - started:.2f}s)"
+            )
+        )
@@ -0,0 +1,90 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.exports import ExportCursorError, ndjson_export, zip_export
+
+
+def _last_cursor(path):
+    """(cursor, byte offset just after its line) of the last cursor in a file"""
+    cursor, offset, position = None, 0, 0
+    with open(path, "rb") as handle:
+        for line in handle:
+            position += len(line)
+            if line.startswith(b'{"type": "cursor"') and line.endswith(b"\n"):
+                cursor, offset = json.loads(line)["cursor"], position
+    return cursor, offset
+
+
+class Command(BaseCommand):
+    help = (
+        "Export every SQL row and MongoDB document of a family as NDJSON or a "
+        "ZIP archive, streamed in bounded chunks"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("family_id")
+        parser.add_argument(
+            "--output", default="-", help="File to write, or - for stdout"
+        )
+        parser.add_argument(
+            "--zip", action="store_true", help="Write a ZIP archive instead of NDJSON"
+        )
+        parser.add_argument("--cursor", help="Resume an NDJSON export after a cursor")
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue a partial NDJSON --output file from its last cursor",
+        )
+        parser.add_argument("--chunk-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        family_id = options["family_id"]
+        output = options["output"]
+        cursor = options["cursor"]
+        if options["zip"] and (cursor or options["resume"]):
+            raise CommandError("--cursor and --resume only apply to NDJSON exports")
+        if options["resume"] and output == "-":
+            raise CommandError("--resume needs an --output file")
+
+        mode = "wb"
+        if options["resume"]:
+            try:
+                cursor, offset = _last_cursor(output)
+            except FileNotFoundError:
+                cursor, offset = None, 0
+            with open(output, "ab") as handle:
+                handle.truncate(offset)
+            mode = "ab"
+
+        try:
+            if options["zip"]:
+                chunks = zip_export(family_id, chunk_size=options["chunk_size"])
+            else:
+                chunks = ndjson_export(
+                    family_id, cursor=cursor, chunk_size=options["chunk_size"]
+                )
+        except (ExportCursorError, ValueError) as exc:
+            raise CommandError(str(exc))
+
+        started = time.perf_counter()
+        written = 0
+        handle = sys.stdout.buffer if output == "-" else open(output, mode)
+        try:
+            for chunk in chunks:
+                handle.write(chunk)
+                written += len(chunk)
+        finally:
+            if handle is not sys.stdout.buffer:
+                handle.close()
+
+        if output != "-":
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Exported family {family_id} to {output} "
+                    f"({written} bytes in {elapsed:.1f}s)"
+                )
+            )
@@ -0,0 +1,348 @@
+import math
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.families import child_entry, family_document, get_families_collection
+from api.models import ChildRegistrationCode, FamilyInvitation, Parent
+
+CODE_MIN = 100000
+CODE_SPACE = 900000  # 6-digit codes, 100000-999999
+
+FIRST_NAMES = [
+    "María", "José", "Ana", "Luis", "Carmen", "Juan", "Laura", "Carlos",
+    "Lucía", "Miguel", "Elena", "Javier", "Paula", "Andrés", "Sara", "Diego",
+]
+LAST_NAMES = [
+    "García", "Rodríguez", "Martínez", "López", "González", "Pérez",
+    "Sánchez", "Ramírez", "Torres", "Flores", "Rivera", "Gómez",
+]
+CHILD_NAMES = [
+    "Sofía", "Mateo", "Valentina", "Santiago", "Isabella", "Sebastián",
+    "Camila", "Nicolás", "Valeria", "Emiliano", "Regina", "Leonardo",
+]
+TIMEZONES = [
+    "America/Mexico_City", "America/Bogota", "America/Lima",
+    "America/Santiago", "America/Argentina/Buenos_Aires", "America/New_York",
+    "Europe/Madrid",
+]
+DEVICES = [
+    ("Android 14", "Galaxy Tab A8"), ("Android 13", "Moto G54"),
+    ("Android 14", "Redmi Note 13"), ("iPadOS 17.5", "iPad 9th gen"),
+    ("iOS 17.5", "iPhone 12"),
+]
+
+
+class CodeSequence:
+    """
+    Distinct 6-digit codes in a seeded, scattered order, skipping ``taken``
+    (codes already in the database).
+
+    Walks i -> (a*i + b) mod CODE_SPACE with a coprime to CODE_SPACE, which
+    visits every code exactly once.
+    """
+
+    def __init__(self, rng, taken=()):
+        self.a = rng.randrange(1, CODE_SPACE)
+        while math.gcd(self.a, CODE_SPACE) != 1:
+            self.a = rng.randrange(1, CODE_SPACE)
+        self.b = rng.randrange(CODE_SPACE)
+        self.index = 0
+        self.taken = taken
+
+    def __next__(self):
+        while self.index < CODE_SPACE:
+            code = str(CODE_MIN + (self.a * self.index + self.b) % CODE_SPACE)
+            self.index += 1
+            if code not in self.taken:
+                return code
+        raise CommandError("6-digit code space exhausted")
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate realistic synthetic parents, invitations, child codes and "
+        "family documents (children and devices) in streamed bulk batches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--families", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--code-fill-ratio",
+            type=float,
+            default=0.05,
+            help="Fraction of the 6-digit space taken by invitation codes, and "
+            "separately by child codes (adds pending/expired codes as needed)",
+        )
+        parser.add_argument(
+            "--second-parent-ratio",
+            type=float,
+            default=0.6,
+            help="Fraction of families with an accepted second parent",
+        )
+        parser.add_argument("--max-children", type=int, default=3)
+        parser.add_argument("--max-devices", type=int, default=2)
+        parser.add_argument(
+            "--prefix",
+            default="synth",
+            help="Username/email prefix, also used by --clear",
+        )
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Delete previously generated data with this prefix first",
+        )
+
+    def handle(self, *args, **options):
+        if not 0 <= options["code_fill_ratio"] <= 1:
+            raise CommandError("--code-fill-ratio must be between 0 and 1")
+        prefix = options["prefix"]
+        collection = get_families_collection()
+        collection.create_index("family_id")
+
+        if options["clear"]:
+            deleted, _ = Parent.objects.filter(
+                username__startswith=f"{prefix}-"
+            ).delete()
+            result = collection.delete_many({"synthetic": prefix})
+            self.stdout.write(
+                f"Cleared {deleted} SQL rows and {result.deleted_count} families"
+            )
+        elif Parent.objects.filter(username__startswith=f"{prefix}-").exists():
+            raise CommandError(
+                f"Data with prefix '{prefix}' exists; pass --clear or another --prefix"
+            )
+
+        # The prefix is part of the seed, so reusing a seed with another
+        # prefix yields different family ids and codes
+        rng = random.Random(f"{prefix}:{options['seed']}")
+        self.now = timezone.now()
+        # One shared hash: hashing each password would dominate the run
+        self.password = make_password(f"{prefix}-Passw0rd!")
+        # Codes are unique across all families, not just generated ones
+        self.invitation_codes = CodeSequence(
+            rng,
+            set(FamilyInvitation.objects.values_list("invitation_code", flat=True)),
+        )
+        self.child_codes = CodeSequence(
+            rng,
+            set(
+                ChildRegistrationCode.objects.values_list(
+                    "registration_code", flat=True
+                )
+            ),
+        )
+
+        families = options["families"]
+        batch_size = options["batch_size"]
+        target_codes = int(CODE_SPACE * options["code_fill_ratio"])
+        # Extra pending/expired codes per family needed to reach the target
+        self.extra_invitations = max(
+            0, target_codes / max(families, 1) - options["second_parent_ratio"]
+        )
+        self.extra_child_codes = max(
+            0, target_codes / max(families, 1) - (options["max_children"] / 2)
+        )
+
+        started = time.perf_counter()
+        totals = dict(parents=0, invitations=0, codes=0, families=0, devices=0)
+        for start in range(0, families, batch_size):
+            count = min(batch_size, families - start)
+            batch_totals = self.generate_batch(rng, start, count, options, collection)
+            for key, value in batch_totals.items():
+                totals[key] += value
+            elapsed = time.perf_counter() - started
+            done = start + count
+            self.stdout.write(
+                f"{done}/{families} families "
+                f"({done / elapsed:.0f} families/s, {elapsed:.1f}s)"
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Generated {parents} parents, {invitations} invitations, "
+                "{codes} child codes, {families} families with {devices} "
+                "devices".format(**totals)
+            )
+        )
+
+    def _extra(self, rng, mean):
+        """Integer count with the given mean"""
+        whole = int(mean)
+        return whole + (rng.random() < mean - whole)
+
+    def generate_batch(self, rng, start, count, options, collection):
+        prefix = options["prefix"]
+        now = self.now
+        plans = []
+        parents = []
+        for offset in range(count):
+            n = start + offset
+            family_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            members = 2 if rng.random() < options["second_parent_ratio"] else 1
+            plan = {"family_id": family_id, "parents": []}
+            for member in range(members):
+                last_name = rng.choice(LAST_NAMES)
+                parent = Parent(
+                    username=f"{prefix}-{n}-{member}",
+                    email=f"{prefix}-{n}-{member}@example.com",
+                    full_name=f"{rng.choice(FIRST_NAMES)} {last_name}",
+                    phone=f"+52 55 {rng.randint(1000, 9999)} "
+                    f"{rng.randint(1000, 9999)}",
+                    family_id=family_id,
+                    role="primary" if member == 0 else "secondary",
+                    password=self.password,
+                    date_joined=now - timedelta(days=rng.randint(0, 720)),
+                )
+                plan["parents"].append(parent)
+                parents.append(parent)
+            plans.append(plan)
+
+        invitations = []
+        codes = []
+        with transaction.atomic():
+            # Returns primary keys (PostgreSQL, SQLite, MariaDB)
+            Parent.objects.bulk_create(parents, batch_size=count)
+            for plan in plans:
+                invitations.extend(self.invitations_for(rng, plan, prefix))
+                plan["codes"] = self.codes_for(rng, plan, options)
+                codes.extend(plan["codes"])
+            FamilyInvitation.objects.bulk_create(invitations, batch_size=count)
+            ChildRegistrationCode.objects.bulk_create(codes, batch_size=count)
+
+        documents = []
+        devices = 0
+        for plan in plans:
+            children = []
+            for code in plan["codes"]:
+                if code.status != "used":
+                    continue
+                entry = child_entry(code, code.device_info["actual_device"])
+                entry["child_id"] = str(
+                    uuid.UUID(int=rng.getrandbits(128), version=4)
+                )
+                entry["added_at"] = code.used_at.isoformat()
+                for _ in range(rng.randint(0, options["max_devices"] - 1)):
+                    entry["devices"].append(self.device(rng, code.child_name))
+                entry["monitoring_settings"]["bedtime_mode_enabled"] = (
+                    rng.random() < 0.8
+                )
+                devices += len(entry["devices"])
+                children.append(entry)
+            document = family_document(
+                plan["parents"], family_id=plan["family_id"], children=children
+            )
+            document["family_settings"].update(
+                timezone=rng.choice(TIMEZONES),
+                default_bedtime=f"{rng.randint(19, 22)}:{rng.choice(['00', '30'])}",
+                default_wake_time=f"0{rng.randint(6, 8)}:00",
+            )
+            document["synthetic"] = prefix
+            documents.append(document)
+        collection.insert_many(documents, ordered=False)
+
+        return dict(
+            parents=len(parents),
+            invitations=len(invitations),
+            codes=len(codes),
+            families=len(documents),
+            devices=devices,
+        )
+
+    def invitations_for(self, rng, plan, prefix):
+        primary = plan["parents"][0]
+        invitations = []
+        for parent in plan["parents"][1:]:
+            invitations.append(
+                FamilyInvitation(
+                    invitation_code=next(self.invitation_codes),
+                    invited_email=parent.email,
+                    invited_by=primary,
+                    family_id=plan["family_id"],
+                    status="accepted",
+                    expires_at=parent.date_joined + timedelta(days=7),
+                    accepted_at=parent.date_joined,
+                )
+            )
+        for i in range(self._extra(rng, self.extra_invitations)):
+            status, expires_in = self._unused_status(rng, days=(7, 90))
+            invitations.append(
+                FamilyInvitation(
+                    invitation_code=next(self.invitation_codes),
+                    invited_email=f"{primary.username}-invitee{i}@example.com",
+                    invited_by=primary,
+                    family_id=plan["family_id"],
+                    status=status,
+                    expires_at=self.now + expires_in,
+                )
+            )
+        return invitations
+
+    def codes_for(self, rng, plan, options):
+        primary = plan["parents"][0]
+        codes = []
+        for _ in range(rng.randint(0, options["max_children"])):
+            name = rng.choice(CHILD_NAMES)
+            used_at = self.now - timedelta(days=rng.randint(0, 365))
+            device = self.device(rng, name)
+            codes.append(
+                ChildRegistrationCode(
+                    registration_code=next(self.child_codes),
+                    child_name=name,
+                    family_id=plan["family_id"],
+                    created_by=primary,
+                    status="used",
+                    expires_at=used_at + timedelta(hours=24),
+                    used_at=used_at,
+                    device_info={
+                        "device_type": device["device_type"],
+                        "device_model": device["device_model"],
+                        "notes": "",
+                        "expected_setup_date": used_at.isoformat(),
+                        "actual_device": device,
+                        "monitoring_enabled": True,
+                    },
+                )
+            )
+        for _ in range(self._extra(rng, self.extra_child_codes)):
+            status, expires_in = self._unused_status(rng, days=(1, 90))
+            codes.append(
+                ChildRegistrationCode(
+                    registration_code=next(self.child_codes),
+                    child_name=rng.choice(CHILD_NAMES),
+                    family_id=plan["family_id"],
+                    created_by=primary,
+                    status=status,
+                    expires_at=self.now + expires_in,
+                )
+            )
+        return codes
+
+    def _unused_status(self, rng, days):
+        """(status, expiry offset) for a code that was never used"""
+        valid_days, max_age_days = days
+        if rng.random() < 0.3:
+            return "pending", timedelta(hours=rng.randint(1, valid_days * 24))
+        status = rng.choice(["expired", "cancelled"])
+        return status, -timedelta(days=rng.randint(1, max_age_days))
+
+    def device(self, rng, child_name):
+        device_os, model = rng.choice(DEVICES)
+        return {
+            "device_type": "tablet" if "Tab" in model or "iPad" in model else "phone",
+            "device_id": f"{rng.getrandbits(64):016x}",
+            "device_name": f"{child_name}'s Device",
+            "device_os": device_os,
+            "device_model": model,
+            "app_version": rng.choice(["1.3.0", "1.4.1", "1.4.2"]),
+            "linked_at": self.now.isoformat(),
+            "status": "active",
+        }
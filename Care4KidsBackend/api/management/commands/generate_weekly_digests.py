@@ -0,0 +1,112 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api.digests import (build_partition, ensure_indexes, last_complete_week,
+                         partitions)
+from utils.mongodb import mongodb_connection
+
+
+def _init_worker():
+    # Under the spawn start method workers import Django from scratch
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        "Render every family's weekly digest (children's activity and chatbot "
+        "usage) across a process pool, one family_id range per task"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--week",
+            help="Monday (YYYY-MM-DD) of the week to summarise; defaults to the "
+            "last complete week",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Worker processes; 1 runs in this process",
+        )
+        parser.add_argument(
+            "--partitions",
+            type=int,
+            default=None,
+            help="family_id ranges to split the work into (default 4 per worker)",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        self.verbosity = options["verbosity"]
+        if options["week"]:
+            try:
+                week_start = date.fromisoformat(options["week"])
+            except ValueError:
+                raise CommandError("--week must be a YYYY-MM-DD date")
+            if week_start.weekday() != 0:
+                raise CommandError("--week must be a Monday")
+        else:
+            week_start = last_complete_week()
+        workers = max(1, options["workers"])
+        count = options["partitions"] or (1 if workers == 1 else workers * 4)
+        tasks = [
+            (low, high, week_start, options["batch_size"])
+            for low, high in partitions(count)
+        ]
+        ensure_indexes()
+        self.stdout.write(
+            f"Digests for the week of {week_start}: {count} partitions, "
+            f"{workers} worker(s)"
+        )
+
+        started = time.perf_counter()
+        families = 0
+        busy = 0.0
+        if workers == 1:
+            results = (build_partition(*task) for task in tasks)
+            for done, (built, seconds) in enumerate(results, 1):
+                families += built
+                busy += seconds
+                self.report(done, count, families, started)
+        else:
+            # Forked workers must open their own database connections
+            connections.close_all()
+            mongodb_connection.close()
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker
+            ) as pool:
+                futures = [pool.submit(build_partition, *task) for task in tasks]
+                for done, future in enumerate(as_completed(futures), 1):
+                    built, seconds = future.result()
+                    families += built
+                    busy += seconds
+                    self.report(done, count, families, started)
+
+        elapsed = time.perf_counter() - started
+        efficiency = busy / (elapsed * workers) if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Stored {families} digests in {elapsed:.1f}s "
+                f"({families / elapsed if elapsed else 0:.0f} families/s, "
+                f"{efficiency:.0%} worker utilisation)"
+            )
+        )
+
+    def report(self, done, count, families, started):
+        if self.verbosity < 1:
+            return
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"  {done}/{count} partitions, {families} families "
+            f"({families / elapsed if elapsed else 0:.0f} families/s)"
+        )
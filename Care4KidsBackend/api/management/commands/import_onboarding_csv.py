@@ -0,0 +1,74 @@
+import csv
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.imports import COLUMNS, ImportFormatError, OnboardingImport
+
+
+class Command(BaseCommand):
+    help = (
+        "Create parents, families, invitations and child registration codes "
+        "from an onboarding CSV (columns: " + ", ".join(COLUMNS) + ")"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file, UTF-8 with a header row")
+        parser.add_argument(
+            "--resume",
+            metavar="JOB_ID",
+            help="Continue a checkpointed import of the same file",
+        )
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--errors", metavar="FILE", help="Write every row error to this CSV"
+        )
+
+    def handle(self, *args, **options):
+        errors_file = writer = None
+        if options["errors"]:
+            errors_file = open(options["errors"], "w", newline="")
+            writer = csv.writer(errors_file)
+            writer.writerow(["row", "family_ref", "errors"])
+
+        def on_error(error):
+            if writer is not None:
+                writer.writerow(
+                    [error["row"], error["family_ref"], json.dumps(error["errors"])]
+                )
+            if options["verbosity"] >= 2:
+                self.stderr.write(f"Row {error['row']}: {error['errors']}")
+
+        try:
+            if options["resume"]:
+                try:
+                    importer = OnboardingImport.resume(
+                        options["resume"], on_error=on_error
+                    )
+                except LookupError as exc:
+                    raise CommandError(str(exc))
+            else:
+                importer = OnboardingImport(source=options["path"], on_error=on_error)
+            if options["batch_size"]:
+                importer.batch_size = options["batch_size"]
+
+            self.stdout.write(f"Import job {importer.job_id}")
+            started = time.perf_counter()
+            with open(options["path"], newline="", encoding="utf-8-sig") as handle:
+                try:
+                    summary = importer.run(handle)
+                except ImportFormatError as exc:
+                    raise CommandError(str(exc))
+        finally:
+            if errors_file is not None:
+                errors_file.close()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{summary['rows_done']} rows in {elapsed:.1f}s, "
+            f"{summary['error_count']} with errors"
+        )
+        for name, count in sorted(summary["counts"].items()):
+            self.stdout.write(f"  {name}: {count}")
+        self.stdout.write(self.style.SUCCESS(f"Import {importer.job_id} completed"))
@@ -0,0 +1,104 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+# What a worker does before it can serve its first request
+STARTUP_SCRIPT = """
+import time
+started = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+import {wsgi_module}
+print("ready_ms=%.1f" % ((time.perf_counter() - started) * 1000))
+"""
+
+
+def parse_importtime(stderr):
+    """Parse `python -X importtime` output into (module, self_us, cumulative_us)"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # header row
+        self_us, cumulative_us, module = fields
+        rows.append((module.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure worker startup in a fresh interpreter and report the import "
+        "cost per module and per top-level package"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=25)
+        parser.add_argument(
+            "--sort",
+            choices=["self", "cumulative"],
+            default="cumulative",
+        )
+        parser.add_argument(
+            "--budget-ms",
+            type=float,
+            help="Fail if the worker takes longer than this to become ready",
+        )
+        parser.add_argument("--wsgi-module", default="Care4Kids.wsgi")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ)
+        env.setdefault("DJANGO_SETTINGS_MODULE", "Care4Kids.settings")
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-c",
+                STARTUP_SCRIPT.format(wsgi_module=options["wsgi_module"]),
+            ],
+            capture_output=True,
+            text=True,
+            env=env,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Startup script failed:\n{result.stderr[-2000:]}")
+
+        ready_ms = float(result.stdout.strip().rsplit("ready_ms=", 1)[1])
+        rows = parse_importtime(result.stderr)
+
+        index = 1 if options["sort"] == "self" else 2
+        self.stdout.write(f"Top {options['top']} modules by {options['sort']} time:")
+        self.stdout.write(f"{'self ms':>9}{'cumul ms':>10}  module")
+        for module, self_us, cumulative_us in sorted(
+            rows, key=lambda row: row[index], reverse=True
+        )[: options["top"]]:
+            self.stdout.write(
+                f"{self_us / 1000:>9.1f}{cumulative_us / 1000:>10.1f}  {module}"
+            )
+
+        packages = defaultdict(int)
+        for module, self_us, _ in rows:
+            packages[module.split(".")[0]] += self_us
+        self.stdout.write("\nImport cost by top-level package:")
+        for package, self_us in sorted(
+            packages.items(), key=lambda item: item[1], reverse=True
+        )[: options["top"]]:
+            self.stdout.write(f"{self_us / 1000:>9.1f}  {package}")
+
+        total_ms = sum(row[1] for row in rows) / 1000
+        self.stdout.write(
+            f"\nImports: {total_ms:.1f}ms across {len(rows)} modules; "
+            f"worker ready in {ready_ms:.1f}ms"
+        )
+        if options["budget_ms"] is not None and ready_ms > options["budget_ms"]:
+            raise CommandError(
+                f"Worker startup {ready_ms:.1f}ms exceeds budget "
+                f"{options['budget_ms']:.1f}ms"
+            )
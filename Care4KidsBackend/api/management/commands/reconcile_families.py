@@ -0,0 +1,252 @@
+import itertools
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models.functions import Collate
+from django.utils import timezone
+from pymongo import DeleteOne, InsertOne, UpdateOne
+
+from api.families import (child_entry, family_document, get_families_collection,
+                          parent_entry)
+from api.models import ChildRegistrationCode, Parent
+
+_END = object()
+
+# Byte-order collation per database vendor, so SQL sorts family ids like
+# Python and MongoDB's simple collation (code point order)
+BINARY_COLLATIONS = {"postgresql": "C", "sqlite": "BINARY", "mysql": "utf8mb4_bin"}
+
+
+class MergeOrderError(Exception):
+    """A stream is not sorted by family_id in code point order"""
+
+
+def _grouped(rows, key):
+    """Yield (family_id, [rows]) from rows already sorted by family_id"""
+    for family_id, group in itertools.groupby(rows, key=key):
+        yield family_id, list(group)
+
+
+def _checked(stream, name):
+    """Pass (family_id, value) pairs through, raising if family_id decreases"""
+    previous = None
+    for family_id, value in stream:
+        if previous is not None and family_id < previous:
+            raise MergeOrderError(
+                f"{name} are not sorted by family_id: {family_id!r} came after "
+                f"{previous!r}"
+            )
+        previous = family_id
+        yield family_id, value
+
+
+def merge_families(parents, children, families):
+    """
+    Merge three family_id-sorted streams into (family_id, parents, children,
+    document) tuples, with [] / None for sides that lack the family.
+
+    Only one family per stream is held in memory at a time. Raises
+    MergeOrderError as soon as a stream turns out not to be sorted.
+    """
+    streams = [
+        _checked(_grouped(parents, lambda p: p.family_id), "parents"),
+        _checked(_grouped(children, lambda c: c.family_id), "child codes"),
+        _checked(((doc["family_id"], doc) for doc in families), "families"),
+    ]
+    heads = [next(stream, _END) for stream in streams]
+    while any(head is not _END for head in heads):
+        family_id = min(head[0] for head in heads if head is not _END)
+        values = []
+        for i, head in enumerate(heads):
+            if head is not _END and head[0] == family_id:
+                values.append(head[1])
+                heads[i] = next(streams[i], _END)
+            else:
+                values.append(None)
+        yield family_id, values[0] or [], values[1] or [], values[2]
+
+
+def diff_family(family_id, parents, children, document, prune=False):
+    """Return (issues Counter, repair operations) for one family"""
+    issues = Counter()
+    operations = []
+
+    if document is None:
+        if not parents:
+            # Only used child codes point at this family; nothing to rebuild from
+            issues["children_without_family"] += len(children)
+            return issues, operations
+        issues["missing_family"] += 1
+        entries = [_child_entry_for(code) for code in children]
+        operations.append(
+            InsertOne(family_document(parents, family_id=family_id, children=entries))
+        )
+        return issues, operations
+
+    known_parents = {
+        entry.get("django_user_id") for entry in document.get("parents") or []
+    }
+    known_children = {
+        entry.get("registration_code") for entry in document.get("children") or []
+    }
+    sql_parents = {parent.id for parent in parents}
+    sql_children = {code.registration_code for code in children}
+
+    if not parents:
+        issues["orphan_family"] += 1
+        if prune:
+            operations.append(DeleteOne({"_id": document["_id"]}))
+        return issues, operations
+
+    missing_parents = [p for p in parents if p.id not in known_parents]
+    missing_children = [
+        c for c in children if c.registration_code not in known_children
+    ]
+    stale_parents = [pid for pid in known_parents if pid not in sql_parents]
+    unknown_children = [code for code in known_children if code not in sql_children]
+    issues["missing_parent"] += len(missing_parents)
+    issues["missing_child"] += len(missing_children)
+    issues["stale_parent"] += len(stale_parents)
+    issues["unknown_child"] += len(unknown_children)
+
+    update = {}
+    if missing_parents:
+        now = timezone.now()
+        update["$push"] = {
+            "parents": {
+                "$each": [parent_entry(p, joined_at=now) for p in missing_parents]
+            }
+        }
+    if missing_children:
+        update.setdefault("$push", {})["children"] = {
+            "$each": [_child_entry_for(code) for code in missing_children]
+        }
+    if prune and (stale_parents or unknown_children):
+        update["$pull"] = {}
+        if stale_parents:
+            update["$pull"]["parents"] = {"django_user_id": {"$in": stale_parents}}
+        if unknown_children:
+            update["$pull"]["children"] = {
+                "registration_code": {"$in": unknown_children}
+            }
+    if update:
+        update["$set"] = {"updated_at": timezone.now()}
+        operations.append(UpdateOne({"_id": document["_id"]}, update))
+    return issues, operations
+
+
+def _child_entry_for(code):
+    return child_entry(code, (code.device_info or {}).get("actual_device", {}))
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare Parent.family_id and used child codes in SQL with MongoDB "
+        "family documents in one sorted pass, and repair drift in batches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Report drift without writing"
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help="Also remove Mongo parents/children/families unknown to SQL",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Rows per SQL chunk / Mongo batch, and operations per bulk write",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        dry_run = options["dry_run"]
+        collection = get_families_collection()
+        collection.create_index("family_id")
+
+        # Both sides sort in code point order, whatever the column's or the
+        # collection's default collation; merge_families() checks it
+        collation = BINARY_COLLATIONS.get(connection.vendor)
+        family_order = Collate("family_id", collation) if collation else "family_id"
+        parents = (
+            Parent.objects.exclude(family_id="")
+            .only("id", "family_id", "full_name", "email", "phone", "role", "username")
+            .order_by(family_order, "id")
+            .iterator(chunk_size=batch_size)
+        )
+        children = (
+            ChildRegistrationCode.objects.filter(status="used")
+            .only(
+                "family_id",
+                "registration_code",
+                "child_name",
+                "created_by_id",
+                "device_info",
+            )
+            .order_by(family_order, "id")
+            .iterator(chunk_size=batch_size)
+        )
+        families = (
+            collection.find(
+                {"family_id": {"$gt": ""}},
+                projection={
+                    "family_id": 1,
+                    "parents.django_user_id": 1,
+                    "children.registration_code": 1,
+                },
+                collation={"locale": "simple"},
+            )
+            .sort("family_id", 1)
+            .batch_size(batch_size)
+        )
+
+        started = time.perf_counter()
+        issues = Counter()
+        pending = []
+        checked = written = 0
+        try:
+            for family_id, family_parents, family_children, document in (
+                merge_families(parents, children, families)
+            ):
+                checked += 1
+                family_issues, operations = diff_family(
+                    family_id,
+                    family_parents,
+                    family_children,
+                    document,
+                    prune=options["prune"],
+                )
+                issues.update(family_issues)
+                if family_issues and options["verbosity"] >= 2:
+                    self.stdout.write(f"{family_id}: {dict(family_issues)}")
+                if not dry_run:
+                    pending.extend(operations)
+                    if len(pending) >= batch_size:
+                        collection.bulk_write(pending, ordered=False)
+                        written += len(pending)
+                        pending = []
+        except MergeOrderError as e:
+            raise CommandError(
+                f"{e}. Stopped after {written} repair operations; check the "
+                "family_id collation"
+            )
+        if pending and not dry_run:
+            collection.bulk_write(pending, ordered=False)
+            written += len(pending)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Checked {checked} families in {elapsed:.1f}s")
+        for issue, count in sorted(issues.items()):
+            if count:
+                self.stdout.write(f"  {issue}: {count}")
+        if dry_run:
+            self.stdout.write("Dry run: no changes written")
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f"Applied {written} repair operations")
+            )
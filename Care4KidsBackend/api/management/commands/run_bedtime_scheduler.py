@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.bedtime import BedtimeScheduler, load_schedules, write_device_states
+
+
+class Command(BaseCommand):
+    help = (
+        "Enforce family bedtime windows: keep the next bedtime/wake transition "
+        "of every monitored device in a heap and write device states as they fire"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-sleep",
+            type=float,
+            default=1.0,
+            help="Longest pause between ticks, in seconds",
+        )
+        parser.add_argument(
+            "--reload-interval",
+            type=float,
+            default=300.0,
+            help="Seconds between re-reading family settings from MongoDB",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Write current states and due transitions, then exit",
+        )
+
+    def handle(self, *args, **options):
+        scheduler = BedtimeScheduler(write_device_states, options["batch_size"])
+        changed = scheduler.sync(load_schedules(), timezone.now())
+        self.stdout.write(
+            f"Scheduling {len(scheduler)} devices ({changed} states written)"
+        )
+        if options["once"]:
+            fired = scheduler.tick(timezone.now())
+            self.stdout.write(f"Dispatched {fired} transitions")
+            return
+
+        next_reload = time.monotonic() + options["reload_interval"]
+        try:
+            while True:
+                fired = scheduler.tick(timezone.now())
+                if fired and options["verbosity"] >= 2:
+                    self.stdout.write(f"Dispatched {fired} transitions")
+                if time.monotonic() >= next_reload:
+                    changed = scheduler.sync(load_schedules(), timezone.now())
+                    if changed:
+                        self.stdout.write(f"Rescheduled {changed} devices")
+                    next_reload = time.monotonic() + options["reload_interval"]
+
+                pause = options["max_sleep"]
+                next_due = scheduler.next_due()
+                if next_due is not None:
+                    pause = min(pause, max(0.0, next_due - time.time()))
+                time.sleep(pause)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped")
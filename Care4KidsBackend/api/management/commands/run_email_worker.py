@@ -0,0 +1,60 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.emails import EmailWorker
+
+
+class Command(BaseCommand):
+    help = (
+        "Send queued emails (invitation codes, welcome emails) from worker "
+        "threads that reuse their mail server connections"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=None)
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=None,
+            help="Seconds an idle thread waits before checking the queue again",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Send what is due now in this thread, then exit",
+        )
+
+    def handle(self, *args, **options):
+        worker = EmailWorker(
+            threads=options["threads"],
+            batch_size=options["batch_size"],
+            poll_interval=options["poll_interval"],
+        )
+        if options["once"]:
+            started = time.perf_counter()
+            sent, failed = worker.drain()
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Sent {sent} email(s), {failed} failed permanently "
+                    f"({time.perf_counter() - started:.1f}s)"
+                )
+            )
+            return
+
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        worker.start()
+        self.stdout.write(f"Email worker running with {worker.threads} thread(s)")
+        try:
+            while not stopping:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write("Stopping email worker...")
+        worker.stop()
+        self.stdout.write(
+            self.style.SUCCESS(f"Sent {worker.sent} email(s), {worker.failed} failed")
+        )
@@ -0,0 +1,248 @@
+import random
+import re
+import time
+import uuid
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.utils.cache import patch_vary_headers
+
+from utils import metrics
+from utils.log import request_id_var
+
+from .profiling import CPU, profiler, read_token
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only
+    brotli = None
+
+# Already compressed; recompressing only costs CPU
+_INCOMPRESSIBLE_TYPES = ("application/zip", "application/gzip", "image/", "video/")
+
+# Accept caller-supplied request IDs only if they look like IDs
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class _QueryStats:
+    """execute_wrapper that counts SQL queries and the time spent in them"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def _route_label(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.route or match.view_name or "unmatched"
+
+
+class RequestMetricsMiddleware:
+    """Record per-route latency and SQL accounting into the metrics registry"""
+
+    def __init__(self, get_response):
+        if not getattr(settings, "METRICS_ENABLED", True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        query_stats = _QueryStats()
+        started = time.perf_counter()
+        with connection.execute_wrapper(query_stats):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        route = _route_label(request)
+        metrics.HTTP_REQUEST_DURATION.observe(
+            duration, method=request.method, route=route, status=response.status_code
+        )
+        if query_stats.count:
+            metrics.DB_QUERIES.inc(query_stats.count, route=route)
+            metrics.DB_QUERY_DURATION.inc(query_stats.duration, route=route)
+        return response
+
+
+class RequestIdMiddleware:
+    """Tag each request (and its log records) with an X-Request-ID"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.META.get("HTTP_X_REQUEST_ID", "")
+        if not _REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+        token = request_id_var.set(request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response["X-Request-ID"] = request_id
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests carrying a staff-issued X-Profile token (see
+    api.profiling.issue_token) and a PROFILING["SAMPLE_RATE"] fraction of
+    all requests (CPU only). Profiled responses get an X-Profile-Id header
+    when requested by token. Streaming bodies are produced after the
+    profile ends. Unless PROFILING["ENABLED"], the middleware removes
+    itself from the stack.
+    """
+
+    def __init__(self, get_response):
+        config = getattr(settings, "PROFILING", {})
+        if not config.get("ENABLED"):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = config.get("SAMPLE_RATE", 0.0)
+
+    def __call__(self, request):
+        profiler.expire_tracing()
+        header = request.META.get("HTTP_X_PROFILE")
+        modes = read_token(header) if header else None
+        if not modes and self.sample_rate and random.random() < self.sample_rate:
+            modes = frozenset([CPU])
+        if not modes:
+            return self.get_response(request)
+        response, profile_id = profiler.run(request, self.get_response, modes)
+        if profile_id and header:
+            response["X-Profile-Id"] = profile_id
+        return response
+
+
+def _accepted_encodings(header):
+    """Map encodings in an Accept-Encoding header to their q-values"""
+    accepted = {}
+    for item in header.split(","):
+        encoding, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if encoding:
+            accepted[encoding.strip().lower()] = q
+    return accepted
+
+
+class _GzipCompressor:
+    def __init__(self, level):
+        # wbits 16+ -> gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    Negotiated brotli/gzip compression for responses above a size threshold.
+
+    Brotli is used when the client accepts it and the optional ``brotli``
+    package is installed. Streaming responses are compressed chunk by
+    chunk (flushing after each one, so NDJSON consumers still see records
+    as they are produced) instead of being buffered.
+    """
+
+    def __init__(self, get_response):
+        config = getattr(settings, "COMPRESSION", {})
+        if not config.get("ENABLED", True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.min_size = config.get("MIN_SIZE", 1024)
+        self.gzip_level = config.get("GZIP_LEVEL", 6)
+        self.brotli_quality = config.get("BROTLI_QUALITY", 4)
+
+    def _choose(self, request):
+        accepted = _accepted_encodings(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if brotli is not None and accepted.get("br", 0) > 0:
+            return "br"
+        if accepted.get("gzip", 0) > 0:
+            return "gzip"
+        return None
+
+    def _compressor(self, encoding):
+        if encoding == "br":
+            return _BrotliCompressor(self.brotli_quality)
+        return _GzipCompressor(self.gzip_level)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        patch_vary_headers(response, ("Accept-Encoding",))
+        if response.has_header("Content-Encoding") or response.status_code in (
+            204,
+            304,
+        ):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+        if response.get("Content-Type", "").startswith(_INCOMPRESSIBLE_TYPES):
+            return response
+        encoding = self._choose(request)
+        if encoding is None:
+            return response
+
+        compressor = self._compressor(encoding)
+        if response.streaming:
+            response.streaming_content = self._stream(
+                compressor, response.streaming_content
+            )
+            del response.headers["Content-Length"]
+        else:
+            compressed = compressor.compress(response.content) + compressor.finish()
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(compressed))
+
+        # The representation changed, so a strong validator no longer holds
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    @staticmethod
+    def _stream(compressor, chunks):
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
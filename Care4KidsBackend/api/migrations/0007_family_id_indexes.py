@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 14:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='childregistrationcode',
+            name='family_id',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='parent',
+            name='family_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_family_id_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='familyinvitation',
+            name='family_id',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
@@ -12,7 +12,7 @@ class Parent(AbstractUser):
 
     full_name = models.CharField(max_length=100)
     phone = models.CharField(max_length=20, blank=True)
-    family_id = models.CharField(max_length=100, blank=True)
+    family_id = models.CharField(max_length=100, blank=True, db_index=True)
     role = models.CharField(
         max_length=20,
         choices=[("primary", "Primary"), ("secondary", "Secondary")],
@@ -35,7 +35,7 @@ class FamilyInvitation(models.Model):
     invited_by = models.ForeignKey(
         Parent, on_delete=models.CASCADE, related_name="sent_invitations"
     )
-    family_id = models.CharField(max_length=100)
+    family_id = models.CharField(max_length=100, db_index=True)
     status = models.CharField(
         max_length=20,
         choices=[
@@ -88,7 +88,7 @@ class ChildRegistrationCode(models.Model):
 
     registration_code = models.CharField(max_length=6, unique=True, editable=False)
     child_name = models.CharField(max_length=100)
-    family_id = models.CharField(max_length=100)
+    family_id = models.CharField(max_length=100, db_index=True)
     created_by = models.ForeignKey(
         Parent, on_delete=models.CASCADE, related_name="child_registrations"
     )
@@ -137,3 +137,52 @@ class ChildRegistrationCode(models.Model):
 
     def __str__(self):
         return f"Child registration {self.registration_code} for {self.child_name} in family {self.family_id}"
+
+
+class RevokedToken(models.Model):
+    """Signed token revoked before its expiry (see api.tokens)"""
+
+    jti = models.CharField(max_length=32, unique=True)
+    user_id = models.IntegerField(db_index=True)
+    token_type = models.CharField(max_length=10)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = "revoked_tokens"
+
+    def __str__(self):
+        return f"Revoked {self.token_type} token {self.jti} for user {self.user_id}"
+
+
+class OutboundEmail(models.Model):
+    """Queued email, delivered by run_email_worker (see api.emails)"""
+
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("sending", "Sending"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    ]
+
+    # One email per purpose, e.g. "invitation:<pk>"; enqueueing again is a no-op
+    dedup_key = models.CharField(max_length=200, unique=True)
+    kind = models.CharField(max_length=30)
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=200)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "outbound_emails"
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"{self.kind} email to {self.to_email} ({self.status})"
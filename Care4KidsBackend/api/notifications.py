@@ -0,0 +1,458 @@
+import logging
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from utils import metrics
+from utils.periodic import PeriodicTask
+
+from .families import get_families_collection
+
+logger = logging.getLogger(__name__)
+
+INVITATION_ACCEPTED = "invitation_accepted"
+DEVICE_LINKED = "device_linked"
+BEDTIME_BREACH = "bedtime_breach"
+GEOFENCE_ENTER = "geofence_enter"
+GEOFENCE_EXIT = "geofence_exit"
+DEVICE_OFFLINE = "device_offline"
+
+# kind -> (title, body); formatted with the event params plus ``child``
+# (the child's name) and ``place`` (the geofence name)
+TEMPLATES = {
+    INVITATION_ACCEPTED: (
+        "Nuevo miembro de la familia",
+        "{name} se unió a tu familia",
+    ),
+    DEVICE_LINKED: (
+        "Dispositivo vinculado",
+        "El dispositivo {device_name} de {child} ya está supervisado",
+    ),
+    BEDTIME_BREACH: (
+        "Hora de dormir",
+        "{child} está usando su dispositivo en horario de descanso",
+    ),
+    GEOFENCE_ENTER: ("Llegada", "{child} llegó a {place}"),
+    GEOFENCE_EXIT: ("Salida", "{child} salió de {place}"),
+    DEVICE_OFFLINE: (
+        "Dispositivo sin conexión",
+        "El dispositivo de {child} dejó de reportar",
+    ),
+}
+
+DEFAULT_PROVIDER = "api.notifications.LoggingPushProvider"
+
+PUSH_NOTIFICATIONS = metrics.registry.counter(
+    "push_notifications_total",
+    "Family events and push messages by outcome",
+    ["outcome"],
+)
+
+
+def _config():
+    return getattr(settings, "NOTIFICATIONS", {})
+
+
+@dataclass(frozen=True)
+class Event:
+    """Something every parent of a family should hear about"""
+
+    family_id: str
+    kind: str
+    child_id: str = ""
+    params: dict = field(default_factory=dict)
+    # parent_ids not to notify, e.g. the parent who caused the event
+    exclude: frozenset = frozenset()
+
+
+@dataclass(frozen=True)
+class PushMessage:
+    """One notification for one device token of a parent"""
+
+    token: str
+    title: str
+    body: str
+    data: dict
+    family_id: str = ""
+    parent_id: str = ""
+
+
+@dataclass(frozen=True)
+class Roster:
+    """Who to notify in a family, and the names messages refer to"""
+
+    # parent_id -> push tokens, for parents with at least one token
+    recipients: dict
+    children: dict
+    places: dict
+
+
+class PushProvider:
+    """
+    Delivers push messages to a notification service.
+
+    send() is called from the dispatcher's worker threads with at most
+    NOTIFICATIONS["BATCH_SIZE"] messages and returns the tokens the service
+    reported as no longer registered; the dispatcher removes those from the
+    family document.
+    """
+
+    def send(self, messages):
+        raise NotImplementedError
+
+
+class LoggingPushProvider(PushProvider):
+    """Logs each batch and sends nothing (development, no provider configured)"""
+
+    def send(self, messages):
+        logger.debug("Push delivery disabled; dropped %s messages", len(messages))
+        return []
+
+
+class FcmPushProvider(PushProvider):
+    """
+    Firebase Cloud Messaging HTTP v1, which reaches Android devices and,
+    through APNs, iOS devices.
+
+    FCM v1 takes one message per request, so each worker thread keeps its
+    own authorized HTTP session and sends its batch over that connection.
+    """
+
+    SCOPE = "https://www.googleapis.com/auth/firebase.messaging"
+    URL = "https://fcm.googleapis.com/v1/projects/{}/messages:send"
+
+    def __init__(self):
+        from google.oauth2 import service_account
+
+        config = _config()
+        if not config.get("FCM_PROJECT_ID") or not config.get("FCM_CREDENTIALS_FILE"):
+            raise ImproperlyConfigured(
+                "FCM_PROJECT_ID and FCM_CREDENTIALS_FILE must be set for FCM"
+            )
+        self._credentials = service_account.Credentials.from_service_account_file(
+            config["FCM_CREDENTIALS_FILE"], scopes=[self.SCOPE]
+        )
+        self._url = self.URL.format(config["FCM_PROJECT_ID"])
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            from google.auth.transport.requests import AuthorizedSession
+
+            session = self._local.session = AuthorizedSession(self._credentials)
+        return session
+
+    def send(self, messages):
+        session = self._session()
+        unregistered = []
+        for message in messages:
+            response = session.post(
+                self._url,
+                json={
+                    "message": {
+                        "token": message.token,
+                        "notification": {"title": message.title, "body": message.body},
+                        "data": message.data,
+                    }
+                },
+                timeout=10,
+            )
+            if response.ok:
+                continue
+            if response.status_code == 404 or "UNREGISTERED" in response.text:
+                unregistered.append(message.token)
+            else:
+                PUSH_NOTIFICATIONS.inc(outcome="failed")
+                logger.warning(
+                    "FCM rejected a message (%s): %s",
+                    response.status_code,
+                    response.text[:200],
+                )
+        return unregistered
+
+
+def _render(event, roster, count):
+    title, body = TEMPLATES.get(event.kind, ("Care4Kids", event.kind))
+    values = {
+        "child": roster.children.get(event.child_id) or "Tu hijo",
+        "place": roster.places.get(event.params.get("fence_id")) or "un lugar guardado",
+        **event.params,
+    }
+    try:
+        body = body.format(**values)
+    except KeyError:
+        pass
+    if count > 1:
+        body = f"{body} ({count} actualizaciones)"
+    return title, body
+
+
+def _coalesce_key(event):
+    """Events with the same key replace each other within one window"""
+    if event.kind in (GEOFENCE_ENTER, GEOFENCE_EXIT):
+        # Flapping at a fence boundary: only the latest crossing matters
+        return ("geofence", event.child_id, event.params.get("fence_id"))
+    return (event.kind, event.child_id)
+
+
+class NotificationDispatcher:
+    """
+    Fans family events out to every parent's devices, off the request path.
+
+    notify() only appends to an in-memory queue, dropping events whose
+    ``key`` was seen in the last DEDUP_TTL seconds. Every COALESCE_WINDOW
+    seconds a background flush resolves each family's recipients from a
+    roster cached for ROSTER_TTL seconds (one find_one per family, not per
+    event), coalesces each parent's events (the latest per child and kind;
+    beyond MAX_PER_RECIPIENT the oldest fold into one summary) and hands
+    BATCH_SIZE-message batches to the provider on a pool of WORKERS
+    threads.
+
+    Deduplication is per process: code that runs in every worker (such as
+    the presence sweep) claims an event in the database before notifying.
+    """
+
+    def __init__(self, provider=None):
+        config = _config()
+        self.batch_size = config.get("BATCH_SIZE", 100)
+        self.max_per_recipient = config.get("MAX_PER_RECIPIENT", 3)
+        self._provider = provider
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._recent = TTLCache(maxsize=100000, ttl=config.get("DEDUP_TTL", 600))
+        self._rosters = TTLCache(maxsize=10000, ttl=config.get("ROSTER_TTL", 60))
+        self._pool = None
+        self._flusher = PeriodicTask(
+            "notifications-flush", config.get("COALESCE_WINDOW", 2), self.flush
+        )
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    @property
+    def provider(self):
+        if self._provider is None:
+            with self._lock:
+                if self._provider is None:
+                    path = _config().get("PROVIDER", DEFAULT_PROVIDER)
+                    self._provider = import_string(path)()
+        return self._provider
+
+    def notify(self, family_id, kind, child_id="", key="", exclude=(), **params):
+        """Queue an event; returns False if ``key`` was already notified"""
+        if not family_id:
+            return False
+        with self._lock:
+            if key:
+                dedup_key = (family_id, kind, key)
+                if dedup_key in self._recent:
+                    PUSH_NOTIFICATIONS.inc(outcome="deduplicated")
+                    return False
+                self._recent[dedup_key] = True
+            self._pending.append(
+                Event(
+                    family_id=family_id,
+                    kind=kind,
+                    child_id=child_id or "",
+                    params={k: str(v) for k, v in params.items() if v is not None},
+                    exclude=frozenset(str(parent_id) for parent_id in exclude),
+                )
+            )
+        self._flusher.start()
+        return True
+
+    def roster(self, family_id):
+        with self._lock:
+            roster = self._rosters.get(family_id)
+        if roster is not None:
+            return roster
+        family = get_families_collection().find_one(
+            {"family_id": family_id},
+            projection={
+                "parents.parent_id": 1,
+                "parents.push_tokens": 1,
+                "children.child_id": 1,
+                "children.name": 1,
+                "geofences.fence_id": 1,
+                "geofences.name": 1,
+            },
+        ) or {}
+        roster = Roster(
+            recipients={
+                parent["parent_id"]: tuple(parent["push_tokens"])
+                for parent in family.get("parents") or []
+                if parent.get("push_tokens")
+            },
+            children={
+                child.get("child_id"): child.get("name", "")
+                for child in family.get("children") or []
+            },
+            places={
+                fence.get("fence_id"): fence.get("name", "")
+                for fence in family.get("geofences") or []
+            },
+        )
+        with self._lock:
+            self._rosters[family_id] = roster
+        return roster
+
+    def invalidate_roster(self, family_id):
+        """Drop a cached roster after the family's parents or tokens change"""
+        with self._lock:
+            self._rosters.pop(family_id, None)
+
+    def flush(self):
+        """Fan out and send everything queued; returns the messages sent"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._pending = self._pending, []
+            if not events:
+                return 0
+            messages = self._fan_out(events)
+            batches = [
+                messages[start : start + self.batch_size]
+                for start in range(0, len(messages), self.batch_size)
+            ]
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=_config().get("WORKERS", 4),
+                    thread_name_prefix="push",
+                )
+            wait([self._pool.submit(self._send, batch) for batch in batches])
+            return len(messages)
+
+    def _fan_out(self, events):
+        by_family = defaultdict(list)
+        for event in events:
+            by_family[event.family_id].append(event)
+
+        messages = []
+        for family_id, family_events in by_family.items():
+            try:
+                roster = self.roster(family_id)
+            except Exception:
+                logger.exception("Could not load the roster of family %s", family_id)
+                continue
+            for parent_id, tokens in roster.recipients.items():
+                # coalesce key -> (latest event, count), in arrival order
+                latest = {}
+                for event in family_events:
+                    if parent_id in event.exclude:
+                        continue
+                    key = _coalesce_key(event)
+                    _, count = latest.pop(key, (None, 0))
+                    latest[key] = (event, count + 1)
+                if not latest:
+                    continue
+                PUSH_NOTIFICATIONS.inc(
+                    sum(count for _, count in latest.values()) - len(latest),
+                    outcome="coalesced",
+                )
+                entries = list(latest.values())
+                notes = []
+                if len(entries) > self.max_per_recipient:
+                    keep = max(self.max_per_recipient - 1, 0)
+                    hidden = entries[: len(entries) - keep]
+                    entries = entries[len(entries) - keep :]
+                    notes.append(
+                        (
+                            "Care4Kids",
+                            f"{sum(count for _, count in hidden)} "
+                            "actualizaciones más de tu familia",
+                            {"kind": "summary", "family_id": family_id},
+                        )
+                    )
+                for event, count in entries:
+                    title, body = _render(event, roster, count)
+                    data = {
+                        "kind": event.kind,
+                        "family_id": family_id,
+                        "child_id": event.child_id,
+                        **event.params,
+                    }
+                    notes.append((title, body, data))
+                messages.extend(
+                    PushMessage(
+                        token=token,
+                        title=title,
+                        body=body,
+                        data=data,
+                        family_id=family_id,
+                        parent_id=parent_id,
+                    )
+                    for title, body, data in notes
+                    for token in tokens
+                )
+        return messages
+
+    def _send(self, batch):
+        try:
+            unregistered = set(self.provider.send(batch) or ())
+        except Exception:
+            PUSH_NOTIFICATIONS.inc(len(batch), outcome="failed")
+            logger.exception("Push provider failed on %s messages", len(batch))
+            return
+        PUSH_NOTIFICATIONS.inc(len(batch) - len(unregistered), outcome="sent")
+        if unregistered:
+            PUSH_NOTIFICATIONS.inc(len(unregistered), outcome="unregistered")
+            families = {m.family_id for m in batch if m.token in unregistered}
+            for family_id in families:
+                _pull_tokens({"family_id": family_id}, list(unregistered))
+                self.invalidate_roster(family_id)
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._pool = None
+
+
+def _pull_tokens(query, tokens):
+    get_families_collection().update_many(
+        query, {"$pull": {"parents.$[].push_tokens": {"$in": tokens}}}
+    )
+
+
+_indexed = False
+
+
+def register_push_token(parent, token):
+    """Attach a device token to a parent, detaching it from anyone else"""
+    global _indexed
+    collection = get_families_collection()
+    if not _indexed:
+        collection.create_index("parents.push_tokens")
+        _indexed = True
+    # A phone handed to another parent (or family) must stop getting the
+    # previous owner's notifications
+    previous = [
+        family["family_id"]
+        for family in collection.find(
+            {"parents.push_tokens": token}, projection={"family_id": 1}
+        )
+    ]
+    if previous:
+        _pull_tokens({"family_id": {"$in": previous}}, [token])
+    collection.update_one(
+        {"family_id": parent.family_id},
+        {"$addToSet": {"parents.$[p].push_tokens": token}},
+        array_filters=[{"p.parent_id": str(parent.id)}],
+    )
+    for family_id in {*previous, parent.family_id}:
+        dispatcher.invalidate_roster(family_id)
+
+
+def unregister_push_token(parent, token):
+    _pull_tokens({"family_id": parent.family_id}, [token])
+    dispatcher.invalidate_roster(parent.family_id)
+
+
+dispatcher = NotificationDispatcher()
+notify = dispatcher.notify
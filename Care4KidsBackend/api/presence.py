@@ -0,0 +1,287 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from utils.periodic import PeriodicTask
+
+from .bedtime import DEVICE_STATES_COLLECTION
+from .notifications import BEDTIME_BREACH, DEVICE_OFFLINE, notify
+
+logger = logging.getLogger(__name__)
+
+ONLINE = "online"
+OFFLINE = "offline"
+
+
+def _config():
+    return getattr(settings, "PRESENCE", {})
+
+
+def offline_after():
+    return _config().get("OFFLINE_AFTER", 180)
+
+
+def _as_utc(value):
+    # pymongo returns naive UTC datetimes unless tz_aware is set
+    if value is not None and timezone.is_naive(value):
+        return value.replace(tzinfo=dt_timezone.utc)
+    return value
+
+
+def presence_status(last_seen_at, now=None):
+    """ONLINE if a heartbeat arrived within OFFLINE_AFTER seconds"""
+    if last_seen_at is None:
+        return OFFLINE
+    now = now or timezone.now()
+    fresh = now - _as_utc(last_seen_at) < timedelta(seconds=offline_after())
+    return ONLINE if fresh else OFFLINE
+
+
+class PresenceTracker:
+    """
+    Last-seen table of linked devices, flushed to device_states in bulk.
+
+    heartbeat() only updates memory. Every PRESENCE["FLUSH_INTERVAL"]
+    seconds the devices seen since the previous flush are written with one
+    bulk_write, so a device costs at most one write per interval however
+    often it beats. ``$max`` keeps concurrent workers from moving
+    last_seen_at backwards. Every SWEEP_INTERVAL seconds the same task
+    marks devices that stopped beating as offline with one update_many.
+    Parents are notified when a device goes offline, and when a device
+    reports its screen on while its bedtime is enforced.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # device_id -> {"last_seen_at", "family_id", "child_id", extra fields}
+        self._seen = {}
+        self._dirty = set()
+        self._flush_lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._indexed = False
+        self._flusher = PeriodicTask(
+            "presence-flush", _config().get("FLUSH_INTERVAL", 5), self.flush
+        )
+
+    def heartbeat(self, device, at=None, **fields):
+        """Record a heartbeat; returns True if the device was offline here"""
+        at = at or timezone.now()
+        with self._lock:
+            entry = self._seen.get(device.device_id)
+            came_online = entry is None or presence_status(
+                entry["last_seen_at"], at
+            ) == OFFLINE
+            if entry is None or at >= entry["last_seen_at"]:
+                entry = {
+                    "last_seen_at": at,
+                    "family_id": device.family_id,
+                    "child_id": device.child_id,
+                }
+                entry.update((k, v) for k, v in fields.items() if v is not None)
+                self._seen[device.device_id] = entry
+                self._dirty.add(device.device_id)
+        self._flusher.start()
+        return came_online
+
+    def entries(self, family_id):
+        """device_id -> copy of the in-memory entry, for a family's devices"""
+        with self._lock:
+            return {
+                device_id: dict(entry)
+                for device_id, entry in self._seen.items()
+                if entry["family_id"] == family_id
+            }
+
+    def flush(self):
+        """Write pending heartbeats in one bulk upsert, then sweep if due"""
+        from pymongo import UpdateOne
+
+        from utils.mongodb import mongodb_connection
+
+        collection = mongodb_connection.get_collection(DEVICE_STATES_COLLECTION)
+        with self._flush_lock:
+            if not self._indexed:
+                collection.create_index([("online", 1), ("last_seen_at", 1)])
+                collection.create_index("family_id")
+                self._indexed = True
+
+            with self._lock:
+                pending = {
+                    device_id: dict(self._seen[device_id]) for device_id in self._dirty
+                }
+                self._dirty = set()
+
+            operations = []
+            for device_id, entry in pending.items():
+                last_seen_at = entry.pop("last_seen_at")
+                operations.append(
+                    UpdateOne(
+                        {"_id": device_id},
+                        {
+                            "$max": {"last_seen_at": last_seen_at},
+                            "$set": {**entry, "online": True},
+                        },
+                        upsert=True,
+                    )
+                )
+            try:
+                if operations:
+                    collection.bulk_write(operations, ordered=False)
+            except Exception:
+                # Retry these devices with the next flush
+                with self._lock:
+                    self._dirty |= set(pending)
+                raise
+
+            in_use = [
+                device_id
+                for device_id, entry in pending.items()
+                if entry.get("screen_on")
+            ]
+            if in_use:
+                self.report_bedtime_breaches(collection, in_use)
+
+            interval = _config().get("SWEEP_INTERVAL", 30)
+            if time.monotonic() - self._last_sweep >= interval:
+                self._last_sweep = time.monotonic()
+                for device in self.sweep(collection):
+                    notify(
+                        device["family_id"],
+                        DEVICE_OFFLINE,
+                        child_id=device["child_id"],
+                        key=f"{device['device_id']}:{device['last_seen_at']}",
+                    )
+
+    def report_bedtime_breaches(self, collection, device_ids):
+        """
+        Notify parents of devices in use during their enforced bedtime.
+
+        One breach is reported per device and bedtime window: the window
+        start (bedtime_changed_at) is remembered as breach_reported_for.
+        Returns the device ids reported.
+        """
+        breaches = [
+            document
+            for document in collection.find(
+                {"_id": {"$in": device_ids}, "bedtime_active": True},
+                projection={
+                    "family_id": 1,
+                    "child_id": 1,
+                    "bedtime_changed_at": 1,
+                    "breach_reported_for": 1,
+                },
+            )
+            if document.get("breach_reported_for") != document.get("bedtime_changed_at")
+        ]
+        reported = []
+        for document in breaches:
+            window = document.get("bedtime_changed_at")
+            # Conditional, so of several workers only one reports the breach
+            claimed = collection.update_one(
+                {"_id": document["_id"], "breach_reported_for": {"$ne": window}},
+                {"$set": {"breach_reported_for": window}},
+            )
+            if not claimed.matched_count:
+                continue
+            notify(
+                document.get("family_id"),
+                BEDTIME_BREACH,
+                child_id=document.get("child_id"),
+                key=f"{document['_id']}:{window}",
+                device_id=document["_id"],
+            )
+            reported.append(document["_id"])
+        return reported
+
+    def sweep(self, collection, now=None):
+        """
+        Mark devices without a heartbeat in OFFLINE_AFTER seconds offline.
+
+        Every worker may run it: each device is flipped with a conditional
+        update, and only the devices this call flipped are returned, so
+        concurrent sweeps never report a device twice. Returns dicts with
+        device_id, family_id, child_id and last_seen_at.
+        """
+        now = now or timezone.now()
+        cutoff = now - timedelta(seconds=offline_after())
+        stale = {"online": True, "last_seen_at": {"$lt": cutoff}}
+        went_offline = []
+        for document in collection.find(
+            stale, projection={"family_id": 1, "child_id": 1, "last_seen_at": 1}
+        ):
+            flipped = collection.update_one(
+                {**stale, "_id": document["_id"]},
+                {"$set": {"online": False, "offline_at": now}},
+            )
+            if flipped.matched_count:
+                went_offline.append(
+                    {
+                        "device_id": document["_id"],
+                        "family_id": document.get("family_id"),
+                        "child_id": document.get("child_id"),
+                        "last_seen_at": _as_utc(document.get("last_seen_at")),
+                    }
+                )
+
+        # Forget devices that have been silent for a while
+        forget_before = now - timedelta(seconds=10 * offline_after())
+        with self._lock:
+            for device_id in [
+                device_id
+                for device_id, entry in self._seen.items()
+                if entry["last_seen_at"] < forget_before
+                and device_id not in self._dirty
+            ]:
+                del self._seen[device_id]
+        return went_offline
+
+
+def family_presence(family_id, now=None):
+    """
+    Presence of every device of a family that ever sent a heartbeat.
+
+    Stored state is overlaid with this process' unflushed heartbeats, and
+    the status is derived from last_seen_at rather than the stored flag,
+    so a device reads offline as soon as OFFLINE_AFTER passes even if the
+    sweep hasn't run yet.
+    """
+    from utils.mongodb import mongodb_connection
+
+    now = now or timezone.now()
+    collection = mongodb_connection.get_collection(DEVICE_STATES_COLLECTION)
+    devices = {}
+    for document in collection.find(
+        {"family_id": family_id, "last_seen_at": {"$exists": True}},
+        projection={
+            "child_id": 1,
+            "last_seen_at": 1,
+            "battery_level": 1,
+            "app_version": 1,
+        },
+    ):
+        document["last_seen_at"] = _as_utc(document["last_seen_at"])
+        devices[document["_id"]] = document
+    for device_id, entry in presence_tracker.entries(family_id).items():
+        document = devices.get(device_id)
+        if document is None or entry["last_seen_at"] > document["last_seen_at"]:
+            devices[device_id] = {**(document or {}), **entry}
+
+    return [
+        {
+            "device_id": device_id,
+            "child_id": document.get("child_id"),
+            "status": presence_status(document["last_seen_at"], now),
+            "last_seen_at": document["last_seen_at"],
+            "battery_level": document.get("battery_level"),
+            "app_version": document.get("app_version"),
+        }
+        for device_id, document in sorted(devices.items())
+    ]
+
+
+presence_tracker = PresenceTracker()
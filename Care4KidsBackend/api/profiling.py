@@ -0,0 +1,204 @@
+import cProfile
+import io
+import json
+import logging
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+HEADER = "X-Profile"
+CPU = "cpu"
+MEMORY = "memory"
+
+# Downloadable files of a profile: kind -> (file suffix, content type)
+FILES = {
+    "cpu": (".prof", "application/octet-stream"),
+    "cpu_text": (".cpu.txt", "text/plain; charset=utf-8"),
+    "memory": (".tracemalloc", "application/octet-stream"),
+    "memory_text": (".memory.txt", "text/plain; charset=utf-8"),
+}
+
+_SALT = "api.profiling"
+_PROFILE_ID_RE = re.compile(r"^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$")
+
+
+def _config():
+    return getattr(settings, "PROFILING", {})
+
+
+def profile_dir():
+    return Path(_config().get("DIR") or settings.BASE_DIR / "var" / "profiles")
+
+
+def issue_token(user, memory=False):
+    """Signed X-Profile header value letting a staff user profile requests"""
+    modes = [CPU, MEMORY] if memory else [CPU]
+    return signing.dumps({"user": user.pk, "modes": modes}, salt=_SALT)
+
+
+def read_token(value):
+    """Profiling modes granted by an X-Profile header value, or None"""
+    try:
+        claims = signing.loads(
+            value, salt=_SALT, max_age=_config().get("TOKEN_MAX_AGE", 3600)
+        )
+    except signing.BadSignature:
+        return None
+    return frozenset(claims.get("modes") or ())
+
+
+class RequestProfiler:
+    """
+    Profile single requests with cProfile and tracemalloc and store the
+    results under PROFILING["DIR"], one set of files per profile.
+
+    One request is profiled at a time per process (cProfile and the
+    tracemalloc diff are process-wide); requests arriving meanwhile run
+    unprofiled. The memory profile is the difference between the
+    tracemalloc snapshot taken after this request and the one taken after
+    the previous memory-profiled request, so allocations that survive
+    between requests (leaks, growing caches) stand out. Tracing stays on
+    for TRACE_TTL seconds after the last memory profile, then stops.
+    """
+
+    def __init__(self):
+        self._busy = threading.Lock()
+        self._previous_snapshot = None
+        self._trace_until = 0.0
+
+    def expire_tracing(self):
+        """Stop tracemalloc once TRACE_TTL passed without a memory profile"""
+        if self._trace_until and time.monotonic() > self._trace_until:
+            with self._busy:
+                tracemalloc.stop()
+                self._previous_snapshot = None
+                self._trace_until = 0.0
+
+    def run(self, request, get_response, modes):
+        """Return (response, profile id or None)"""
+        if not self._busy.acquire(blocking=False):
+            return get_response(request), None
+        try:
+            memory = MEMORY in modes
+            if memory and not tracemalloc.is_tracing():
+                tracemalloc.start(_config().get("TRACEMALLOC_FRAMES", 10))
+            cpu = cProfile.Profile()
+            started = time.perf_counter()
+            cpu.enable()
+            try:
+                response = get_response(request)
+            finally:
+                cpu.disable()
+            duration = time.perf_counter() - started
+            snapshot = None
+            if memory:
+                # Drop the profilers' own allocations, previous snapshot included
+                snapshot = tracemalloc.take_snapshot().filter_traces(
+                    [
+                        tracemalloc.Filter(False, tracemalloc.__file__),
+                        tracemalloc.Filter(False, cProfile.__file__),
+                        tracemalloc.Filter(False, __file__),
+                    ]
+                )
+            profile_id = self._store(request, response, duration, cpu, snapshot)
+            if memory:
+                self._previous_snapshot = snapshot
+                self._trace_until = time.monotonic() + _config().get("TRACE_TTL", 600)
+            return response, profile_id
+        finally:
+            self._busy.release()
+
+    def _store(self, request, response, duration, cpu, snapshot):
+        directory = profile_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        now = timezone.now()
+        profile_id = f"{now:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        base = directory / profile_id
+
+        cpu.dump_stats(f"{base}{FILES['cpu'][0]}")
+        text = io.StringIO()
+        stats = pstats.Stats(cpu, stream=text)
+        stats.sort_stats("cumulative").print_stats(_config().get("TOP", 50))
+        Path(f"{base}{FILES['cpu_text'][0]}").write_text(text.getvalue())
+        files = ["cpu", "cpu_text"]
+
+        if snapshot is not None:
+            snapshot.dump(f"{base}{FILES['memory'][0]}")
+            top = _config().get("TOP", 50)
+            if self._previous_snapshot is not None:
+                title = "Allocations grown since the previous memory profile"
+                lines = snapshot.compare_to(self._previous_snapshot, "lineno")[:top]
+            else:
+                title = "Live allocations traced since this request started"
+                lines = snapshot.statistics("lineno")[:top]
+            current, peak = tracemalloc.get_traced_memory()
+            Path(f"{base}{FILES['memory_text'][0]}").write_text(
+                f"{title}\ntraced: {current} bytes, peak: {peak} bytes\n\n"
+                + "\n".join(str(line) for line in lines)
+                + "\n"
+            )
+            files += ["memory", "memory_text"]
+
+        user = getattr(request, "user", None)
+        metadata = {
+            "id": profile_id,
+            "created_at": now.isoformat(),
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(duration * 1000, 2),
+            "request_id": getattr(request, "request_id", ""),
+            "user": getattr(user, "username", "") or "",
+            "files": files,
+        }
+        Path(f"{base}.json").write_text(json.dumps(metadata))
+        _prune(directory, _config().get("MAX_PROFILES", 200))
+        logger.info(
+            "Profiled %s %s in %.1f ms as %s",
+            request.method,
+            request.path,
+            duration * 1000,
+            profile_id,
+        )
+        return profile_id
+
+
+def _prune(directory, keep):
+    # Profile ids start with their timestamp, so names sort oldest first
+    stale = sorted(directory.glob("*.json"))[:-keep] if keep else []
+    for metadata in stale:
+        for path in directory.glob(f"{metadata.stem}.*"):
+            path.unlink(missing_ok=True)
+
+
+def list_profiles():
+    """Metadata of the stored profiles, newest first"""
+    profiles = []
+    for path in sorted(profile_dir().glob("*.json"), reverse=True):
+        try:
+            profiles.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_file(profile_id, kind):
+    """(path, content type) of one file of a stored profile, or None"""
+    if not _PROFILE_ID_RE.match(profile_id) or kind not in FILES:
+        return None
+    suffix, content_type = FILES[kind]
+    path = profile_dir() / f"{profile_id}{suffix}"
+    return (path, content_type) if path.is_file() else None
+
+
+profiler = RequestProfiler()
@@ -0,0 +1,19 @@
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Render responses as MessagePack for clients that send Accept: application/msgpack"""
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        import msgpack
+
+        if data is None:
+            return b""
+        # Same coercions as the JSON renderer (datetimes, UUIDs, decimals...)
+        return msgpack.packb(data, default=JSONEncoder().default, use_bin_type=True)
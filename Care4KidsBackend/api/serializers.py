@@ -1,11 +1,17 @@
 import re
-import uuid
 
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.db import transaction
 from django.utils import timezone
 from rest_framework import serializers
 
+from .emails import invitation_email, queue_emails
+from .families import (child_entry, family_document, get_families_collection,
+                       parent_entry)
+from .devices import issue_device_secret
 from .models import ChildRegistrationCode, FamilyInvitation, Parent
+from .tokens import TokenError, read_password_token
 
 
 class ParentRegistrationSerializer(serializers.ModelSerializer):
@@ -47,52 +53,21 @@ class ParentRegistrationSerializer(serializers.ModelSerializer):
             username=username,
             email=validated_data["email"],
             full_name=validated_data["full_name"],
+            password=password,
         )
-        parent.set_password(password)
 
         # Create family in MongoDB and link to Django user
         family_id = self.create_mongodb_family(parent)
-        print(family_id)
         parent.family_id = family_id
-        parent.save()
+        parent.save(update_fields=["family_id"])
 
         return parent
 
     def create_mongodb_family(self, parent):
-        import uuid
-
-        from django.utils import timezone
-        from utils.mongodb import mongodb_connection
-
-        db = mongodb_connection.get_database()
-        families_collection = db.families
-
-        family_document = {
-            "family_id": str(uuid.uuid4()),
-            "family_name": None,  # Nullable - can be set later
-            "created_at": timezone.now(),
-            "django_user_id": parent.id,  # Link to Django user
-            "parents": [
-                {
-                    "parent_id": str(parent.id),
-                    "django_user_id": parent.id,
-                    "full_name": parent.full_name,
-                    "email": parent.email,
-                    "phone": parent.phone,
-                    "role": parent.role,
-                    "username": parent.username,
-                }
-            ],
-            "children": [],  # Empty initially - can add children later
-            "family_settings": {
-                "timezone": "America/New_York",
-                "emergency_override_enabled": True,
-                "default_bedtime": "21:00",
-            },
-        }
-
-        result = families_collection.insert_one(family_document)
-        return family_document["family_id"]
+        # Children are empty initially - can add children later
+        document = family_document([parent])
+        get_families_collection().insert_one(document)
+        return document["family_id"]
 
 
 class LoginSerializer(serializers.Serializer):
@@ -104,26 +79,47 @@ class LoginSerializer(serializers.Serializer):
         password = attrs.get("password")
 
         if email and password:
-            # Find user by email
-            try:
-                parent = Parent.objects.get(email=email)
-                user = authenticate(username=parent.username, password=password)
+            # Single lookup by email (api.backends.EmailBackend)
+            user = authenticate(
+                request=self.context.get("request"), email=email, password=password
+            )
 
-                if not user:
-                    raise serializers.ValidationError("Invalid credentials")
+            if not user:
+                raise serializers.ValidationError("Invalid credentials")
 
-                if not user.is_active:
-                    raise serializers.ValidationError("Account is disabled")
+            if not user.is_active:
+                raise serializers.ValidationError("Account is disabled")
 
-                attrs["user"] = user
-            except Parent.DoesNotExist:
-                raise serializers.ValidationError("Invalid credentials")
+            attrs["user"] = user
         else:
             raise serializers.ValidationError("Email and password are required")
 
         return attrs
 
 
+class SetPasswordSerializer(serializers.Serializer):
+    token = serializers.CharField()
+    password = serializers.CharField(write_only=True, min_length=8)
+    password_confirm = serializers.CharField(write_only=True)
+
+    def validate(self, attrs):
+        if attrs["password"] != attrs["password_confirm"]:
+            raise serializers.ValidationError("Passwords don't match")
+        return attrs
+
+    def validate_token(self, value):
+        try:
+            self.user = read_password_token(value)
+        except TokenError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def save(self):
+        self.user.set_password(self.validated_data["password"])
+        self.user.save(update_fields=["password"])
+        return self.user
+
+
 class SendFamilyInvitationSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
@@ -154,19 +150,23 @@ class SendFamilyInvitationSerializer(serializers.Serializer):
         request = self.context["request"]
         user = request.user
 
-        # Cancel any existing pending invitations for this email to this family
-        FamilyInvitation.objects.filter(
-            invited_email=validated_data["email"],
-            family_id=user.family_id,
-            status="pending",
-        ).update(status="cancelled")
+        with transaction.atomic():
+            # Cancel any existing pending invitations for this email to this family
+            FamilyInvitation.objects.filter(
+                invited_email=validated_data["email"],
+                family_id=user.family_id,
+                status="pending",
+            ).update(status="cancelled")
+
+            # Create new invitation
+            invitation = FamilyInvitation.objects.create(
+                invited_email=validated_data["email"],
+                invited_by_id=user.id,
+                family_id=user.family_id,
+            )
 
-        # Create new invitation
-        invitation = FamilyInvitation.objects.create(
-            invited_email=validated_data["email"],
-            invited_by=user,
-            family_id=user.family_id,
-        )
+            # Delivered by run_email_worker, not in this request
+            queue_emails([invitation_email(invitation, user.full_name)])
 
         return invitation
 
@@ -183,7 +183,8 @@ class CheckInvitationSerializer(serializers.Serializer):
 
         # Find the invitation by invitation_code
         try:
-            invitation = FamilyInvitation.objects.get(
+            # The response shows the inviter's name
+            invitation = FamilyInvitation.objects.select_related("invited_by").get(
                 invitation_code=value, status="pending"
             )
         except FamilyInvitation.DoesNotExist:
@@ -193,7 +194,7 @@ class CheckInvitationSerializer(serializers.Serializer):
 
         if invitation.is_expired:
             invitation.status = "expired"
-            invitation.save()
+            invitation.save(update_fields=["status"])
             raise serializers.ValidationError("This invitation has expired")
 
         self.invitation = invitation
@@ -230,7 +231,7 @@ class AcceptInvitationSerializer(serializers.Serializer):
 
         if invitation.is_expired:
             invitation.status = "expired"
-            invitation.save()
+            invitation.save(update_fields=["status"])
             raise serializers.ValidationError("This invitation has expired")
 
         # Check if email already has an account
@@ -261,9 +262,8 @@ class AcceptInvitationSerializer(serializers.Serializer):
             full_name=validated_data["full_name"],
             family_id=invitation.family_id,
             role="secondary",  # Second parent is secondary by default
+            password=validated_data["password"],
         )
-        parent.set_password(validated_data["password"])
-        parent.save()
 
         # Add parent to MongoDB family document
         self.add_parent_to_mongodb_family(parent, invitation)
@@ -271,29 +271,15 @@ class AcceptInvitationSerializer(serializers.Serializer):
         # Mark invitation as accepted
         invitation.status = "accepted"
         invitation.accepted_at = timezone.now()
-        invitation.save()
+        invitation.save(update_fields=["status", "accepted_at"])
 
         return parent
 
     def add_parent_to_mongodb_family(self, parent, invitation):
-        from utils.mongodb import mongodb_connection
-
-        db = mongodb_connection.get_database()
-        families_collection = db.families
-
         # Add parent to the existing family document
-        new_parent_data = {
-            "parent_id": str(parent.id),
-            "django_user_id": parent.id,
-            "full_name": parent.full_name,
-            "email": parent.email,
-            "phone": parent.phone,
-            "role": parent.role,
-            "username": parent.username,
-            "joined_at": timezone.now(),
-        }
+        new_parent_data = parent_entry(parent, joined_at=timezone.now())
 
-        families_collection.update_one(
+        get_families_collection().update_one(
             {"family_id": invitation.family_id},
             {
                 "$push": {"parents": new_parent_data},
@@ -366,13 +352,54 @@ class GenerateChildCodeSerializer(serializers.Serializer):
         child_code = ChildRegistrationCode.objects.create(
             child_name=validated_data["child_name"],
             family_id=user.family_id,
-            created_by=user,
+            created_by_id=user.id,
             device_info=device_info,
         )
 
         return child_code
 
 
+class ImportRowSerializer(serializers.Serializer):
+    """One row of an onboarding CSV: a guardian and/or a child of a family"""
+
+    family_ref = serializers.CharField(max_length=100)
+    guardian_name = serializers.CharField(
+        max_length=100, required=False, allow_blank=True, default=""
+    )
+    guardian_email = serializers.EmailField(
+        required=False, allow_blank=True, default=""
+    )
+    guardian_phone = serializers.CharField(
+        max_length=20, required=False, allow_blank=True, default=""
+    )
+    child_name = serializers.CharField(
+        max_length=100, required=False, allow_blank=True, default=""
+    )
+    device_type = serializers.CharField(
+        max_length=50, required=False, allow_blank=True, default=""
+    )
+    device_model = serializers.CharField(
+        max_length=100, required=False, allow_blank=True, default=""
+    )
+    notes = serializers.CharField(
+        max_length=500, required=False, allow_blank=True, default=""
+    )
+
+    def validate_guardian_email(self, value):
+        return Parent.objects.normalize_email(value)
+
+    def validate(self, attrs):
+        if not attrs["guardian_email"] and not attrs["child_name"]:
+            raise serializers.ValidationError(
+                "A row needs a guardian_email or a child_name"
+            )
+        if attrs["guardian_email"] and not attrs["guardian_name"]:
+            raise serializers.ValidationError(
+                {"guardian_name": "Required when guardian_email is given"}
+            )
+        return attrs
+
+
 class AcceptChildCodeSerializer(serializers.Serializer):
     registration_code = serializers.CharField(max_length=6, min_length=6)
     device_id = serializers.CharField(max_length=100)  # Device unique identifier
@@ -400,7 +427,7 @@ class AcceptChildCodeSerializer(serializers.Serializer):
 
         if child_code.is_expired:
             child_code.status = "expired"
-            child_code.save()
+            child_code.save(update_fields=["status"])
             raise serializers.ValidationError("This registration code has expired")
 
         # Store for use in create method
@@ -439,40 +466,130 @@ class AcceptChildCodeSerializer(serializers.Serializer):
         # Mark as used
         child_code.status = "used"
         child_code.used_at = timezone.now()
-        child_code.save()
+        child_code.save(update_fields=["device_info", "status", "used_at"])
 
-        # Add child and device to MongoDB family
-        self.add_child_to_mongodb_family(child_code, device_data)
+        # Add child and device to MongoDB family; only the device gets the
+        # secret, the family document keeps its hash
+        self.device_secret, secret_hash = issue_device_secret()
+        self.add_child_to_mongodb_family(
+            child_code, {**device_data, "secret_hash": secret_hash}
+        )
 
         return child_code
 
     def add_child_to_mongodb_family(self, child_code, device_data):
-        from utils.mongodb import mongodb_connection
-
-        db = mongodb_connection.get_database()
-        families_collection = db.families
-
         # Create child document with device for monitoring (convert datetime to ISO strings)
-        child_data = {
-            "child_id": str(uuid.uuid4()),
-            "name": child_code.child_name,
-            "registration_code": child_code.registration_code,
-            "added_at": timezone.now().isoformat(),
-            "added_by": child_code.created_by.id,
-            "devices": [device_data],  # Array of monitored devices
-            "monitoring_settings": {
-                "screen_time_enabled": True,
-                "app_restrictions_enabled": True,
-                "location_tracking_enabled": False,  # Can be configured later
-                "bedtime_mode_enabled": True,
-            },
-        }
+        child_data = child_entry(child_code, device_data)
 
         # Add child to family
-        families_collection.update_one(
+        get_families_collection().update_one(
             {"family_id": child_code.family_id},
             {
                 "$push": {"children": child_data},
                 "$set": {"updated_at": timezone.now().isoformat()},
             },
         )
+
+
+class LocationPingSerializer(serializers.Serializer):
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lng = serializers.FloatField(min_value=-180, max_value=180)
+    accuracy = serializers.FloatField(min_value=0, required=False)
+    recorded_at = serializers.DateTimeField()
+
+
+class LocationBatchSerializer(serializers.Serializer):
+    pings = LocationPingSerializer(many=True, allow_empty=False)
+
+    def validate_pings(self, value):
+        max_batch = settings.LOCATION_INGEST["MAX_BATCH"]
+        if len(value) > max_batch:
+            raise serializers.ValidationError(
+                f"At most {max_batch} pings per request"
+            )
+        return value
+
+
+class HeartbeatSerializer(serializers.Serializer):
+    battery_level = serializers.IntegerField(
+        min_value=0, max_value=100, required=False
+    )
+    app_version = serializers.CharField(max_length=20, required=False)
+    # Reported so parents can be told about use during bedtime
+    screen_on = serializers.BooleanField(required=False)
+
+
+class PushTokenSerializer(serializers.Serializer):
+    token = serializers.CharField(max_length=4096)
+
+    def validate_token(self, value):
+        if not value.strip():
+            raise serializers.ValidationError("Token is required")
+        return value.strip()
+
+
+class GeofenceSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=100)
+    type = serializers.ChoiceField(
+        choices=["home", "school", "other"], default="other"
+    )
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lng = serializers.FloatField(min_value=-180, max_value=180)
+    radius_m = serializers.FloatField(min_value=25, max_value=5000)
+
+
+class MonitoringSettingsSerializer(serializers.Serializer):
+    screen_time_enabled = serializers.BooleanField(required=False)
+    app_restrictions_enabled = serializers.BooleanField(required=False)
+    location_tracking_enabled = serializers.BooleanField(required=False)
+    bedtime_mode_enabled = serializers.BooleanField(required=False)
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError("No settings to update")
+        return attrs
+
+
+HHMM_REGEX = r"^([01]\d|2[0-3]):[0-5]\d$"
+
+
+class AppWindowSerializer(serializers.Serializer):
+    # Weekdays, Monday = 0; empty means every day
+    days = serializers.ListField(
+        child=serializers.IntegerField(min_value=0, max_value=6),
+        required=False,
+        default=list,
+    )
+    start = serializers.RegexField(HHMM_REGEX)
+    end = serializers.RegexField(HHMM_REGEX)
+
+    def validate(self, attrs):
+        if attrs["start"] == attrs["end"]:
+            raise serializers.ValidationError("Window start and end must differ")
+        return attrs
+
+
+class AppRuleSerializer(serializers.Serializer):
+    app_id = serializers.CharField(max_length=255)
+    action = serializers.ChoiceField(choices=["allow", "deny", "schedule"])
+    windows = AppWindowSerializer(many=True, required=False, default=list)
+
+    def validate(self, attrs):
+        if attrs["action"] == "schedule" and not attrs["windows"]:
+            raise serializers.ValidationError(
+                "Scheduled rules need at least one window"
+            )
+        if attrs["action"] != "schedule":
+            attrs["windows"] = []
+        return attrs
+
+
+class AppPolicyDefaultSerializer(serializers.Serializer):
+    default = serializers.ChoiceField(choices=["allow", "deny"])
+
+
+class AppCheckSerializer(serializers.Serializer):
+    app_ids = serializers.ListField(
+        child=serializers.CharField(max_length=255), allow_empty=False, max_length=500
+    )
+    at = serializers.DateTimeField(required=False)
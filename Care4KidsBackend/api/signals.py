@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import bump_profile_version
+from .models import Parent
+
+
+@receiver(post_save, sender=Parent)
+@receiver(post_delete, sender=Parent)
+def invalidate_profile_cache(sender, instance, **kwargs):
+    bump_profile_version(instance.pk)
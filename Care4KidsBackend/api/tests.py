@@ -1,3 +1,1541 @@
-from django.test import TestCase
+import inspect
+import io
+import json
+import smtplib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.management import call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+
+from utils.fakes import FakeGenerativeModel, InMemoryCollection
+from utils.gemini import (GEMINI_EVENTS, CircuitBreaker, CircuitOpen,
+                          DeadlineExceeded, GeminiUnavailable, Overloaded,
+                          ResilientModel, reset_model)
+from utils.mongodb import mongodb_connection
+from utils.prefilter import SENSITIVE, MessagePrefilter
+from utils.query_budget import (LOG, OFF, RAISE, QUERY_BUDGET_VIOLATIONS,
+                                QueryBudgetExceeded, QueryRecorder,
+                                assert_max_queries, query_budget)
+from utils.retrieval import RetrievalIndex, get_index, publish_index, reset_index
+from utils.usage import USAGE_COLLECTION, UsageTracker, usage_tracker
+
+from . import emails, views
+from .bedtime import (AWAKE, BEDTIME, BedtimeScheduler, DeviceSchedule,
+                      next_transition, state_at)
+from .management.commands.reconcile_families import (MergeOrderError,
+                                                     merge_families)
+from .devices import hash_secret, invalidate_device
+from .exports import ndjson_export
+from .families import family_document, get_families_collection
+from .models import (ChildRegistrationCode, FamilyInvitation, OutboundEmail,
+                     Parent, RevokedToken)
+from .notifications import (DEVICE_LINKED, DEVICE_OFFLINE, GEOFENCE_ENTER,
+                            GEOFENCE_EXIT, NotificationDispatcher,
+                            PushProvider, dispatcher)
+from .presence import presence_tracker
+from .tokens import (ACCESS, REFRESH, TokenError, decode_token, issue_token,
+                     issue_password_token, read_password_token, revocation_list,
+                     revoke)
+
+FAKE_MONGODB = {
+    **settings.MONGODB_SETTINGS,
+    "client_class": "utils.fakes.InMemoryMongoClient",
+}
+
+
+@override_settings(MONGODB_SETTINGS=FAKE_MONGODB)
+class MongoTestCase(TestCase):
+    """TestCase running against a fresh in-memory MongoDB (utils.fakes)"""
+
+    def setUp(self):
+        super().setUp()
+        mongodb_connection.close()
+        self.addCleanup(mongodb_connection.close)
+
+
+class QueryRecorderTests(TestCase):
+    def setUp(self):
+        for n in range(4):
+            Parent.objects.create_user(
+                username=f"parent{n}", email=f"parent{n}@example.com", password="x"
+            )
+
+    def test_records_queries(self):
+        with QueryRecorder() as recorder:
+            Parent.objects.count()
+            list(Parent.objects.all())
+        self.assertEqual(len(recorder), 2)
+
+    def test_within_budget(self):
+        with assert_max_queries(1):
+            Parent.objects.count()
+
+    def test_over_budget(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, "2 queries, budget is 1"):
+            with assert_max_queries(1):
+                Parent.objects.count()
+                Parent.objects.exists()
+
+    def test_repeated_query_is_n_plus_one(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, "N+1 suspected"):
+            with assert_max_queries(10, n_plus_one_threshold=3):
+                for parent in Parent.objects.all():
+                    Parent.objects.filter(pk=parent.pk).exists()
+
+    def test_repeats_below_threshold_pass(self):
+        with assert_max_queries(10, n_plus_one_threshold=3):
+            for parent in Parent.objects.all()[:2]:
+                Parent.objects.filter(pk=parent.pk).exists()
+
+    def test_transaction_control_is_no_n_plus_one(self):
+        with QueryRecorder() as recorder:
+            for n in range(4):
+                with transaction.atomic():
+                    Parent.objects.filter(username=f"parent{n}").update(phone="1")
+        # Only the UPDATEs count, whether atomic() issued BEGIN or SAVEPOINT
+        self.assertEqual(len(recorder), 4)
+        self.assertEqual(recorder.repeated(threshold=3)[0][1], 4)
+
+
+class BudgetedView:
+    @query_budget(1)
+    def get(self, request, lookups=1):
+        for _ in range(lookups):
+            Parent.objects.exists()
+        return "response"
+
+
+class QueryBudgetDecoratorTests(TestCase):
+    def test_declares_budget(self):
+        self.assertEqual(BudgetedView.get.query_budget, 1)
+
+    @override_settings(QUERY_BUDGETS={"MODE": RAISE})
+    def test_raise_mode(self):
+        self.assertEqual(BudgetedView().get(None), "response")
+        with self.assertRaisesMessage(QueryBudgetExceeded, "BudgetedView.get"):
+            BudgetedView().get(None, lookups=2)
+
+    @override_settings(QUERY_BUDGETS={"MODE": LOG})
+    def test_log_mode(self):
+        before = QUERY_BUDGET_VIOLATIONS.value(view="BudgetedView.get", kind="budget")
+        with self.assertLogs("utils.query_budget", "WARNING"):
+            self.assertEqual(BudgetedView().get(None, lookups=2), "response")
+        self.assertEqual(
+            QUERY_BUDGET_VIOLATIONS.value(view="BudgetedView.get", kind="budget"),
+            before + 1,
+        )
+
+    @override_settings(QUERY_BUDGETS={"MODE": OFF})
+    def test_off_mode(self):
+        self.assertEqual(BudgetedView().get(None, lookups=5), "response")
+
+
+class ViewBudgetCoverageTests(TestCase):
+    def test_every_view_handler_declares_a_budget(self):
+        for name, view in inspect.getmembers(views, inspect.isclass):
+            if not issubclass(view, APIView) or view.__module__ != views.__name__:
+                continue
+            for method in view.http_method_names:
+                handler = view.__dict__.get(method)
+                if handler is not None:
+                    with self.subTest(view=name, method=method):
+                        self.assertTrue(hasattr(handler, "query_budget"))
+
+
+@override_settings(
+    QUERY_BUDGETS={"MODE": RAISE, "N_PLUS_ONE_THRESHOLD": 3},
+    GEMINI_MODEL_FACTORY="utils.fakes.FakeGenerativeModel",
+    SIGNED_TOKENS={**settings.SIGNED_TOKENS, "ENABLED": True},
+)
+class ViewQueryBudgetTests(MongoTestCase):
+    """
+    Every budgeted view on its main path in RAISE mode: a view over its
+    budget, or repeating a query, raises QueryBudgetExceeded.
+    """
+
+    password = "Str0ng-Passw0rd!"
+
+    def setUp(self):
+        super().setUp()
+        reset_model()
+        self.addCleanup(reset_model)
+        # Views start these background tasks; flush them while the fake
+        # MongoDB and test database are still in place
+        for task in (
+            usage_tracker._flusher,
+            presence_tracker._flusher,
+            dispatcher._flusher,
+            revocation_list._syncer,
+        ):
+            self.addCleanup(task.stop)
+        self.anonymous = APIClient()
+        response = self.anonymous.post(
+            "/api/auth/register/",
+            {
+                "full_name": "Ana García",
+                "email": "ana@example.com",
+                "password": self.password,
+                "password_confirm": self.password,
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.parent = Parent.objects.get(email="ana@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.parent)
+        self.staff = Parent.objects.create_user(
+            username="staff",
+            email="staff@example.com",
+            password="x",
+            is_staff=True,
+            family_id=self.parent.family_id,
+        )
+        self.staff_client = APIClient()
+        self.staff_client.force_authenticate(self.staff)
+
+    def assertStatus(self, response, code=200):
+        self.assertEqual(response.status_code, code, getattr(response, "data", None))
+        return response
+
+    def link_child(self, device_id="tablet-1"):
+        response = self.assertStatus(
+            self.client.post(
+                "/api/children/generate-code/",
+                {"child_name": "Sofía"},
+                format="json",
+            ),
+            201,
+        )
+        code = ChildRegistrationCode.objects.get(created_by=self.parent)
+        self.assertIn(code.registration_code, response.content.decode())
+        linked = self.assertStatus(
+            self.anonymous.post(
+                "/api/children/accept-code/",
+                {
+                    "registration_code": code.registration_code,
+                    "device_id": device_id,
+                    "device_name": "Tablet",
+                },
+                format="json",
+            )
+        )
+        self.device = APIClient()
+        self.device.credentials(
+            HTTP_AUTHORIZATION=f"Device {device_id}:{linked.data['device_secret']}"
+        )
+        family = get_families_collection().find_one(
+            {"family_id": self.parent.family_id}
+        )
+        return family["children"][0]["child_id"]
+
+    def invite(self):
+        self.assertStatus(
+            self.client.post(
+                "/api/invitations/send/", {"email": "bo@example.com"}, format="json"
+            ),
+            201,
+        )
+        return FamilyInvitation.objects.get(invited_by=self.parent).invitation_code
+
+    def test_login(self):
+        self.assertStatus(
+            self.anonymous.post(
+                "/api/auth/login/",
+                {"email": "ana@example.com", "password": self.password},
+                format="json",
+            )
+        )
+
+    def test_token_refresh(self):
+        login = self.assertStatus(
+            self.anonymous.post(
+                "/api/auth/login/",
+                {"email": "ana@example.com", "password": self.password},
+                format="json",
+            )
+        )
+        self.assertStatus(
+            self.anonymous.post(
+                "/api/auth/token/refresh/",
+                {"refresh_token": login.data["refresh_token"]},
+                format="json",
+            )
+        )
+
+    def test_set_password(self):
+        imported = Parent.objects.create_user(
+            username="luis", email="luis@example.com", password=None
+        )
+        self.assertStatus(
+            self.anonymous.post(
+                "/api/auth/set-password/",
+                {
+                    "token": issue_password_token(imported),
+                    "password": self.password,
+                    "password_confirm": self.password,
+                },
+                format="json",
+            )
+        )
+
+    def test_logout(self):
+        login = self.assertStatus(
+            self.anonymous.post(
+                "/api/auth/login/",
+                {"email": "ana@example.com", "password": self.password},
+                format="json",
+            )
+        )
+        self.anonymous.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {login.data['access_token']}"
+        )
+        self.assertStatus(
+            self.anonymous.post(
+                "/api/auth/logout/",
+                {"refresh_token": login.data["refresh_token"]},
+                format="json",
+            )
+        )
+
+    def test_profile(self):
+        self.assertStatus(self.client.get("/api/auth/profile/"))
+
+    def test_first_name(self):
+        self.assertStatus(self.client.get("/api/auth/first-name/"))
+
+    def test_send_check_and_list_invitations(self):
+        code = self.invite()
+        self.assertStatus(
+            self.anonymous.post(
+                "/api/invitations/check/", {"invitation_code": code}, format="json"
+            )
+        )
+        self.assertStatus(self.client.get("/api/invitations/my/"))
+
+    def test_accept_invitation(self):
+        code = self.invite()
+        self.assertStatus(
+            self.anonymous.post(
+                "/api/invitations/accept/",
+                {
+                    "invitation_code": code,
+                    "full_name": "Bo Pérez",
+                    "password": self.password,
+                    "password_confirm": self.password,
+                },
+                format="json",
+            ),
+            201,
+        )
+
+    def test_chatbot(self):
+        self.assertStatus(
+            self.client.post(
+                "/api/chatbot/",
+                {"message": "¿Cómo limito el tiempo de pantalla de mi hijo?"},
+                format="json",
+            )
+        )
+        self.assertStatus(self.client.get("/api/chatbot/usage/"))
+
+    def test_chatbot_falls_back_when_gemini_fails(self):
+        reset_model(FakeGenerativeModel(fail_every=1))
+        response = self.assertStatus(
+            self.client.post(
+                "/api/chatbot/",
+                {"message": "¿Cómo limito el tiempo de pantalla de mi hijo?"},
+                format="json",
+            )
+        )
+        self.assertTrue(response.data["degraded"])
+
+    def test_child_codes(self):
+        self.link_child()
+        self.assertStatus(self.client.get("/api/children/my-codes/"))
+
+    def test_monitoring_settings(self):
+        child_id = self.link_child()
+        self.assertStatus(
+            self.client.patch(
+                f"/api/children/{child_id}/monitoring/",
+                {"location_tracking_enabled": True},
+                format="json",
+            )
+        )
+
+    def test_app_rules_and_device_policy(self):
+        child_id = self.link_child()
+        url = f"/api/children/{child_id}/app-rules/"
+        rule = self.assertStatus(
+            self.client.post(
+                url, {"app_id": "com.example.game", "action": "deny"}, format="json"
+            ),
+            201,
+        ).data["rule"]
+        self.assertStatus(self.client.get(url))
+        self.assertStatus(self.client.patch(url, {"default": "deny"}, format="json"))
+        self.assertStatus(self.device.get("/api/devices/policy/"))
+        self.assertStatus(
+            self.device.post(
+                "/api/devices/policy/check/",
+                {"app_ids": ["com.example.game"]},
+                format="json",
+            )
+        )
+        self.assertStatus(self.client.delete(f"{url}{rule['rule_id']}/"))
+
+    def test_presence(self):
+        self.link_child()
+        self.assertStatus(
+            self.device.post("/api/devices/heartbeat/", {}, format="json")
+        )
+        self.assertStatus(self.client.get("/api/devices/presence/"))
+
+    def test_push_token(self):
+        url = "/api/notifications/push-token/"
+        self.assertStatus(self.client.post(url, {"token": "t1"}, format="json"), 201)
+        self.assertStatus(self.client.delete(url, {"token": "t1"}, format="json"))
+
+    def test_locations_and_geofences(self):
+        child_id = self.link_child()
+        self.assertStatus(
+            self.client.patch(
+                f"/api/children/{child_id}/monitoring/",
+                {"location_tracking_enabled": True},
+                format="json",
+            )
+        )
+        fence = self.assertStatus(
+            self.client.post(
+                "/api/geofences/",
+                {
+                    "name": "Casa",
+                    "type": "home",
+                    "lat": 40.0,
+                    "lng": -3.0,
+                    "radius_m": 100,
+                },
+                format="json",
+            ),
+            201,
+        ).data["geofence"]
+        self.assertStatus(self.client.get("/api/geofences/"))
+        self.assertStatus(
+            self.device.post(
+                "/api/locations/ingest/",
+                {
+                    "pings": [
+                        {
+                            "lat": 40.0,
+                            "lng": -3.0,
+                            "recorded_at": timezone.now().isoformat(),
+                        }
+                    ],
+                },
+                format="json",
+            )
+        )
+        self.assertStatus(self.client.get("/api/locations/family/"))
+        self.assertStatus(self.client.delete(f"/api/geofences/{fence['fence_id']}/"))
+
+    def test_weekly_digest(self):
+        mongodb_connection.get_collection("weekly_digests").insert_one(
+            {
+                "_id": f"{self.parent.family_id}:2026-10-12",
+                "family_id": self.parent.family_id,
+                "week_start": "2026-10-12",
+            }
+        )
+        self.assertStatus(self.client.get("/api/families/digest/"))
+
+    def test_export(self):
+        response = self.assertStatus(self.client.get("/api/families/export/"))
+        b"".join(response.streaming_content)
+
+    def test_import(self):
+        upload = SimpleUploadedFile(
+            "families.csv",
+            b"family_ref,guardian_name,guardian_email,child_name\n"
+            b"F1,Luis Ramos,luis@example.com,Mateo\n"
+            b"F2,Marta Gil,marta@example.com,Lucas\n",
+        )
+        response = self.assertStatus(
+            self.staff_client.post(
+                "/api/families/import/", {"file": upload}, format="multipart"
+            )
+        )
+        self.assertStatus(
+            self.staff_client.get(f"/api/families/import/{response.data['job_id']}/")
+        )
+
+    def test_metrics(self):
+        self.assertStatus(self.anonymous.get("/api/metrics/"))
+
+    def test_profiling(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profile_id = "20261019T120000-0123abcd"
+        Path(directory.name, f"{profile_id}.json").write_text(
+            json.dumps({"id": profile_id})
+        )
+        Path(directory.name, f"{profile_id}.cpu.txt").write_text("stats")
+        profiling = {**settings.PROFILING, "ENABLED": True, "DIR": directory.name}
+        with override_settings(PROFILING=profiling):
+            self.assertStatus(
+                self.staff_client.post("/api/profiling/token/", {}, format="json")
+            )
+            self.assertStatus(self.staff_client.get("/api/profiling/"))
+            response = self.assertStatus(
+                self.staff_client.get(f"/api/profiling/{profile_id}/cpu_text/")
+            )
+            response.close()
+
+
+@override_settings(
+    LLM_QUOTAS={
+        "user_daily_tokens": 1000,
+        "user_daily_requests": 3,
+        "family_daily_tokens": 0,
+        "family_daily_requests": 4,
+    }
+)
+class UsageTrackerTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tracker = self.new_tracker()
+        self.usage = mongodb_connection.get_collection(USAGE_COLLECTION)
+        self.today = timezone.now().date().isoformat()
+
+    def new_tracker(self):
+        tracker = UsageTracker()
+        self.addCleanup(tracker._flusher.stop, run_final=False)
+        return tracker
+
+    def test_request_quota(self):
+        for _ in range(3):
+            self.assertEqual(self.tracker.check(1, "FAM1"), (True, None))
+            self.tracker.record(1, "FAM1", 10)
+        self.assertEqual(
+            self.tracker.check(1, "FAM1"), (False, "user_daily_requests")
+        )
+        # The family has one request left for another parent
+        self.assertEqual(self.tracker.check(2, "FAM1"), (True, None))
+        self.tracker.record(2, "FAM1", 10)
+        self.assertEqual(
+            self.tracker.check(2, "FAM1"), (False, "family_daily_requests")
+        )
+
+    def test_token_quota(self):
+        self.tracker.record(1, "FAM1", 999)
+        self.assertEqual(self.tracker.check(1, "FAM1"), (True, None))
+        self.tracker.record(1, "FAM1", 1)
+        self.assertEqual(self.tracker.check(1, "FAM1"), (False, "user_daily_tokens"))
+        # The family token quota is 0, i.e. unlimited
+        self.assertEqual(self.tracker.usage("family", "FAM1"), (1000, 2))
+        self.assertEqual(self.tracker.check(2, "FAM1"), (True, None))
+
+    def test_flush_upserts_one_document_per_subject_and_day(self):
+        self.tracker.record(1, "FAM1", 100)
+        self.tracker.record(1, "FAM1", 50)
+        self.tracker.record(2, "", 7)
+        self.tracker.flush()
+        self.tracker.record(1, "FAM1", 25)
+        self.tracker.flush()
+        documents = {d["_id"]: d for d in self.usage.find({})}
+        self.assertEqual(
+            set(documents),
+            {
+                f"{self.today}:user:1",
+                f"{self.today}:user:2",
+                f"{self.today}:family:FAM1",
+            },
+        )
+        user = documents[f"{self.today}:user:1"]
+        self.assertEqual((user["tokens"], user["requests"]), (175, 3))
+        self.assertEqual(
+            (user["day"], user["scope"], user["subject_id"]), (self.today, "user", "1")
+        )
+        self.assertEqual(documents[f"{self.today}:family:FAM1"]["requests"], 3)
+        # Totals now come from the database; nothing is counted twice
+        self.assertEqual(self.tracker.usage("user", 1), (175, 3))
+
+    def test_flush_reads_back_usage_from_other_processes(self):
+        other = self.new_tracker()
+        self.assertEqual(self.tracker.check(1, "FAM1"), (True, None))
+        for _ in range(3):
+            other.record(1, "FAM1", 10)
+        other.flush()
+        self.assertEqual(self.tracker.check(1, "FAM1"), (True, None))
+        self.tracker.flush()
+        self.assertEqual(self.tracker.usage("user", 1), (30, 3))
+        self.assertEqual(
+            self.tracker.check(1, "FAM1"), (False, "user_daily_requests")
+        )
+
+    def test_failed_flush_keeps_the_increments(self):
+        self.tracker.record(1, "FAM1", 10)
+        with mock.patch.object(
+            InMemoryCollection, "bulk_write", side_effect=RuntimeError("down")
+        ):
+            with self.assertRaises(RuntimeError):
+                self.tracker.flush()
+        self.assertEqual(self.tracker.usage("user", 1), (10, 1))
+        self.tracker.record(1, "FAM1", 5)
+        self.tracker.flush()
+        document = self.usage.find_one({"_id": f"{self.today}:user:1"})
+        self.assertEqual((document["tokens"], document["requests"]), (15, 2))
+        self.assertEqual(self.tracker.usage("user", 1), (15, 2))
+
+
+class DeviceAuthenticationTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(presence_tracker._flusher.stop)
+        self.addCleanup(dispatcher._flusher.stop)
+        invalidate_device()
+        self.addCleanup(invalidate_device)
+        parent = Parent.objects.create_user(
+            username="ana", email="ana@example.com", password="x"
+        )
+        family = family_document([parent])
+        parent.family_id = family["family_id"]
+        parent.save(update_fields=["family_id"])
+        get_families_collection().insert_one(family)
+        code = ChildRegistrationCode.objects.create(
+            registration_code="123456",
+            child_name="Sofía",
+            family_id=parent.family_id,
+            created_by=parent,
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        self.response = APIClient().post(
+            "/api/children/accept-code/",
+            {"registration_code": code.registration_code, "device_id": "tablet-1"},
+            format="json",
+        )
+        self.secret = self.response.data["device_secret"]
+
+    def heartbeat(self, authorization=None):
+        client = APIClient()
+        if authorization:
+            client.credentials(HTTP_AUTHORIZATION=authorization)
+        return client.post("/api/devices/heartbeat/", {}, format="json")
+
+    def test_linked_device_with_its_secret_is_accepted(self):
+        response = self.heartbeat(f"Device tablet-1:{self.secret}")
+        self.assertEqual(response.status_code, 200, response.data)
+
+    def test_missing_or_wrong_secret_is_rejected(self):
+        for authorization in (
+            None,
+            "Device tablet-1",
+            "Device tablet-1:wrong",
+            f"Device tablet-2:{self.secret}",
+        ):
+            with self.subTest(authorization=authorization):
+                self.assertEqual(self.heartbeat(authorization).status_code, 401)
+
+    def test_device_linked_without_a_secret_must_link_again(self):
+        get_families_collection().update_one(
+            {"children.devices.device_id": "tablet-1"},
+            {"$unset": {"children.$[].devices.$[].secret_hash": ""}},
+        )
+        invalidate_device()
+        response = self.heartbeat(f"Device tablet-1:{self.secret}")
+        self.assertEqual(response.status_code, 401)
+
+    def test_only_the_hash_is_stored(self):
+        family = get_families_collection().find_one({})
+        (device,) = family["children"][0]["devices"]
+        self.assertEqual(device["secret_hash"], hash_secret(self.secret))
+        device_info = self.response.data["device_registration"]["device_info"]
+        self.assertNotIn("secret_hash", device_info["actual_device"])
+        self.assertNotIn(
+            self.secret,
+            json.dumps(list(ChildRegistrationCode.objects.values("device_info"))),
+        )
+
+    def test_exports_leave_out_the_hash(self):
+        family_id = get_families_collection().find_one({})["family_id"]
+        exported = b"".join(ndjson_export(family_id))
+        self.assertIn(b"tablet-1", exported)
+        self.assertNotIn(b"secret_hash", exported)
+
+
+class FakePushProvider(PushProvider):
+    """Keeps messages in ``sent`` instead of sending them"""
+
+    def __init__(self):
+        self.sent = []
+        # Tokens to report as unregistered
+        self.invalid_tokens = set()
+        self._lock = threading.Lock()
+
+    def send(self, messages):
+        with self._lock:
+            self.sent.extend(messages)
+        return [m.token for m in messages if m.token in self.invalid_tokens]
+
+
+class NotificationDispatcherTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        get_families_collection().insert_one(
+            {
+                "family_id": "fam-1",
+                "parents": [
+                    {"parent_id": "1", "push_tokens": ["phone-1", "tablet-1"]},
+                    {"parent_id": "2", "push_tokens": ["phone-2"]},
+                    {"parent_id": "3", "push_tokens": []},
+                ],
+                "children": [
+                    {"child_id": "c1", "name": "Sofía"},
+                    {"child_id": "c2", "name": "Mateo"},
+                ],
+                "geofences": [{"fence_id": "g1", "name": "Escuela"}],
+            }
+        )
+        self.provider = FakePushProvider()
+        # Flushed explicitly, never by the background task
+        with override_settings(
+            NOTIFICATIONS={**settings.NOTIFICATIONS, "COALESCE_WINDOW": 3600}
+        ):
+            self.dispatcher = NotificationDispatcher(provider=self.provider)
+        self.addCleanup(self.dispatcher._flusher.stop, run_final=False)
+
+    def sent_to(self, parent_id):
+        return [m for m in self.provider.sent if m.parent_id == parent_id]
+
+    def test_fans_out_to_every_token_of_every_parent(self):
+        self.dispatcher.notify(
+            "fam-1", DEVICE_LINKED, child_id="c1", device_name="Tablet"
+        )
+        self.assertEqual(self.dispatcher.flush(), 3)
+        self.assertCountEqual(
+            [m.token for m in self.provider.sent], ["phone-1", "tablet-1", "phone-2"]
+        )
+        self.assertEqual(
+            self.provider.sent[0].body,
+            "El dispositivo Tablet de Sofía ya está supervisado",
+        )
+        self.assertEqual(self.sent_to("3"), [])
+
+    def test_excluded_parents_are_skipped(self):
+        self.dispatcher.notify(
+            "fam-1", DEVICE_LINKED, child_id="c1", exclude=[1], device_name="Tablet"
+        )
+        self.dispatcher.flush()
+        self.assertEqual([m.token for m in self.provider.sent], ["phone-2"])
+
+    def test_duplicate_keys_are_dropped(self):
+        self.assertTrue(self.dispatcher.notify("fam-1", DEVICE_OFFLINE, key="d1:t"))
+        self.assertFalse(self.dispatcher.notify("fam-1", DEVICE_OFFLINE, key="d1:t"))
+        self.assertEqual(self.dispatcher.flush(), 3)
+
+    def test_geofence_crossings_coalesce_to_the_latest(self):
+        self.dispatcher.notify("fam-1", GEOFENCE_ENTER, child_id="c1", fence_id="g1")
+        self.dispatcher.notify("fam-1", GEOFENCE_EXIT, child_id="c1", fence_id="g1")
+        self.dispatcher.notify("fam-1", GEOFENCE_ENTER, child_id="c1", fence_id="g1")
+        self.dispatcher.flush()
+        (message,) = self.sent_to("2")
+        self.assertEqual(message.body, "Sofía llegó a Escuela (3 actualizaciones)")
+
+    def test_events_beyond_the_limit_fold_into_a_summary(self):
+        with override_settings(
+            NOTIFICATIONS={**settings.NOTIFICATIONS, "MAX_PER_RECIPIENT": 3}
+        ):
+            limited = NotificationDispatcher(provider=self.provider)
+        self.addCleanup(limited._flusher.stop, run_final=False)
+        for child_id in ("c1", "c2"):
+            limited.notify("fam-1", DEVICE_OFFLINE, child_id=child_id)
+            limited.notify(
+                "fam-1", DEVICE_LINKED, child_id=child_id, device_name="Tablet"
+            )
+        limited.notify("fam-1", GEOFENCE_ENTER, child_id="c2", fence_id="g1")
+        limited.flush()
+        bodies = [m.body for m in self.sent_to("2")]
+        self.assertEqual(
+            bodies,
+            [
+                "3 actualizaciones más de tu familia",
+                "El dispositivo Tablet de Mateo ya está supervisado",
+                "Mateo llegó a Escuela",
+            ],
+        )
+        self.assertEqual(self.sent_to("2")[0].data["kind"], "summary")
+
+    def test_unregistered_tokens_are_removed(self):
+        self.provider.invalid_tokens.add("tablet-1")
+        self.dispatcher.notify("fam-1", DEVICE_OFFLINE, child_id="c1")
+        self.dispatcher.flush()
+        family = get_families_collection().find_one({"family_id": "fam-1"})
+        self.assertEqual(family["parents"][0]["push_tokens"], ["phone-1"])
+        self.assertEqual(family["parents"][1]["push_tokens"], ["phone-2"])
+
+        self.provider.sent.clear()
+        self.dispatcher.notify("fam-1", DEVICE_OFFLINE, child_id="c2")
+        self.dispatcher.flush()
+        self.assertCountEqual(
+            [m.token for m in self.provider.sent], ["phone-1", "phone-2"]
+        )
+
+
+class FlakyBackend(LocmemBackend):
+    """Locmem backend failing for the recipients in ``failures``"""
+
+    # recipient -> exception raised when sending to it
+    failures = {}
+
+    def send_messages(self, messages):
+        for message in messages:
+            for recipient in message.to:
+                if recipient in self.failures:
+                    raise self.failures[recipient]
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND="api.tests.FlakyBackend",
+    EMAIL_QUEUE={**settings.EMAIL_QUEUE, "MAX_ATTEMPTS": 3, "BACKOFF_BASE": 60},
+)
+class EmailQueueTests(TestCase):
+    def setUp(self):
+        FlakyBackend.failures = {}
+        self.smtp = mail.get_connection()
+
+    def queue(self, *recipients):
+        emails.queue_emails(
+            [
+                OutboundEmail(
+                    dedup_key=f"test:{recipient}",
+                    kind="test",
+                    to_email=recipient,
+                    subject="Hola",
+                    body=f"Para {recipient}",
+                )
+                for recipient in recipients
+            ]
+        )
+
+    def test_duplicate_dedup_keys_are_skipped(self):
+        self.queue("ana@example.com")
+        emails.queue_emails(
+            [
+                OutboundEmail(
+                    dedup_key="test:ana@example.com",
+                    kind="test",
+                    to_email="ana@example.com",
+                    subject="Otra vez",
+                    body="",
+                ),
+                OutboundEmail(
+                    dedup_key="test:bo@example.com",
+                    kind="test",
+                    to_email="bo@example.com",
+                    subject="Hola",
+                    body="",
+                ),
+            ]
+        )
+        self.assertEqual(OutboundEmail.objects.count(), 2)
+        self.assertEqual(
+            OutboundEmail.objects.get(to_email="ana@example.com").subject, "Hola"
+        )
+
+    def test_claims_are_exclusive(self):
+        self.queue("ana@example.com", "bo@example.com")
+        claimed = emails.claim("worker-a", 10)
+        self.assertEqual(len(claimed), 2)
+        self.assertTrue(all(e.status == emails.SENDING for e in claimed))
+        self.assertEqual(emails.claim("worker-b", 10), [])
+
+    def test_only_due_emails_are_claimed(self):
+        self.queue("ana@example.com")
+        OutboundEmail.objects.update(next_attempt_at=timezone.now() + timedelta(1))
+        self.assertEqual(emails.claim("worker-a", 10), [])
+
+    def test_deliver_sends_and_marks_sent(self):
+        self.queue("ana@example.com", "bo@example.com")
+        self.assertEqual(emails.deliver(emails.claim("w", 10), self.smtp), (2, 0))
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            ["ana@example.com", "bo@example.com"],
+        )
+        self.assertFalse(OutboundEmail.objects.exclude(status=emails.SENT).exists())
+
+    def test_transient_failure_retries_with_backoff(self):
+        FlakyBackend.failures = {
+            "ana@example.com": smtplib.SMTPServerDisconnected("gone")
+        }
+        self.queue("ana@example.com", "bo@example.com")
+        before = timezone.now()
+        self.assertEqual(emails.deliver(emails.claim("w", 10), self.smtp), (1, 0))
+        email = OutboundEmail.objects.get(to_email="ana@example.com")
+        self.assertEqual(email.status, emails.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.claimed_by, "")
+        self.assertIn("SMTPServerDisconnected", email.last_error)
+        # BACKOFF_BASE * 2^0, jittered down to half
+        self.assertGreaterEqual(email.next_attempt_at, before + timedelta(seconds=30))
+        self.assertLessEqual(
+            email.next_attempt_at, timezone.now() + timedelta(seconds=60)
+        )
+        self.assertEqual(emails.claim("w", 10), [])
+
+    def test_gives_up_after_max_attempts(self):
+        FlakyBackend.failures = {
+            "ana@example.com": smtplib.SMTPServerDisconnected("gone")
+        }
+        self.queue("ana@example.com")
+        OutboundEmail.objects.update(attempts=2)
+        with self.assertLogs("api.emails", "ERROR"):
+            self.assertEqual(emails.deliver(emails.claim("w", 10), self.smtp), (0, 1))
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (emails.FAILED, 3))
+
+    def test_refused_recipient_fails_at_once(self):
+        FlakyBackend.failures = {
+            "ana@example.com": smtplib.SMTPRecipientsRefused(
+                {"ana@example.com": (550, b"No such user")}
+            )
+        }
+        self.queue("ana@example.com")
+        with self.assertLogs("api.emails", "ERROR"):
+            self.assertEqual(emails.deliver(emails.claim("w", 10), self.smtp), (0, 1))
+        self.assertEqual(OutboundEmail.objects.get().status, emails.FAILED)
+
+    def test_stale_claims_are_released(self):
+        self.queue("ana@example.com")
+        emails.claim("crashed", 10)
+        timeout = settings.EMAIL_QUEUE["CLAIM_TIMEOUT"]
+        OutboundEmail.objects.update(
+            claimed_at=timezone.now() - timedelta(seconds=timeout + 1)
+        )
+        (email,) = emails.claim("worker-b", 10)
+        self.assertEqual(email.claimed_by, "worker-b")
+
+    def test_lost_claim_is_not_sent_twice(self):
+        self.queue("ana@example.com", "bo@example.com")
+        slow = emails.claim("slow", 10)
+        # The slow worker's claim on one email expired and was taken over
+        OutboundEmail.objects.filter(to_email="ana@example.com").update(
+            claimed_by="other"
+        )
+        with self.assertLogs("api.emails", "WARNING"):
+            self.assertEqual(emails.deliver(slow, self.smtp), (1, 0))
+        self.assertEqual([message.to for message in mail.outbox], [["bo@example.com"]])
+        email = OutboundEmail.objects.get(to_email="ana@example.com")
+        self.assertEqual((email.status, email.claimed_by), (emails.SENDING, "other"))
+
+    def test_sent_emails_are_marked_before_the_batch_ends(self):
+        self.queue("ana@example.com", "bo@example.com")
+        batch = emails.claim("w", 10)
+        statuses = []
+        original = FlakyBackend.send_messages
+
+        def send_messages(backend, messages):
+            statuses.append(
+                dict(OutboundEmail.objects.values_list("to_email", "status"))
+            )
+            return original(backend, messages)
+
+        with mock.patch.object(FlakyBackend, "send_messages", send_messages):
+            emails.deliver(batch, self.smtp)
+        # When the second message goes out, the first is already recorded
+        first, second = (email.to_email for email in batch)
+        self.assertEqual(statuses[1][first], emails.SENT)
+        self.assertEqual(statuses[1][second], emails.SENDING)
+
+    def test_worker_drains_the_queue(self):
+        self.queue("ana@example.com", "bo@example.com", "cy@example.com")
+        self.assertEqual(emails.EmailWorker(batch_size=2).drain(), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
+
+    @override_settings(EMAIL_TIMEOUT=200)
+    def test_claim_timeout_must_outlast_a_send(self):
+        with self.assertRaises(ImproperlyConfigured):
+            emails.EmailWorker()
+
+
+class PasswordSetupTests(TestCase):
+    password = "Str0ng-Passw0rd!"
+
+    def setUp(self):
+        self.client = APIClient()
+        self.parent = Parent.objects.create_user(
+            username="luis",
+            email="luis@example.com",
+            full_name="Luis Ramos",
+            password=None,
+        )
+
+    def set_password(self, token):
+        return self.client.post(
+            "/api/auth/set-password/",
+            {
+                "token": token,
+                "password": self.password,
+                "password_confirm": self.password,
+            },
+            format="json",
+        )
+
+    def test_welcome_email_link_sets_the_password(self):
+        body = emails.welcome_email(self.parent, []).body
+        link = next(line for line in body.splitlines() if "?token=" in line)
+        self.assertTrue(link.startswith(settings.PASSWORD_SETUP["URL"]))
+        token = parse_qs(urlsplit(link).query)["token"][0]
+        self.assertEqual(self.set_password(token).status_code, 200)
+        response = self.client.post(
+            "/api/auth/login/",
+            {"email": "luis@example.com", "password": self.password},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+
+    def test_no_link_for_accounts_with_a_password(self):
+        self.parent.set_password(self.password)
+        self.assertNotIn("?token=", emails.welcome_email(self.parent, []).body)
+
+    def test_token_is_single_use(self):
+        token = issue_password_token(self.parent)
+        self.assertEqual(self.set_password(token).status_code, 200)
+        self.assertEqual(self.set_password(token).status_code, 400)
+
+    def test_tampered_token_is_rejected(self):
+        token = issue_password_token(self.parent)
+        with self.assertRaisesMessage(TokenError, "Invalid token"):
+            read_password_token(token[:-2] + ("AA" if token[-2:] != "AA" else "BB"))
+
+    @override_settings(PASSWORD_SETUP={**settings.PASSWORD_SETUP, "TOKEN_TTL": -1})
+    def test_expired_token_is_rejected(self):
+        with self.assertRaisesMessage(TokenError, "Token expired"):
+            read_password_token(issue_password_token(self.parent))
+
+
+@override_settings(SIGNED_TOKENS={**settings.SIGNED_TOKENS, "ENABLED": True})
+class SignedTokenTests(TestCase):
+    def setUp(self):
+        self.parent = Parent.objects.create_user(
+            username="marta",
+            email="marta@example.com",
+            full_name="Marta Ruiz",
+            password="x",
+        )
+        self.addCleanup(revocation_list._syncer.stop)
+        self.client = APIClient()
+
+    def first_name(self, token):
+        return self.client.get(
+            "/api/auth/first-name/", HTTP_AUTHORIZATION=f"Bearer {token}"
+        )
+
+    def test_round_trip(self):
+        token, claims = issue_token(self.parent, ACCESS)
+        self.assertEqual(decode_token(token), claims)
+        response = self.first_name(token)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["first_name"], "Marta")
+
+    def test_tampered_token_is_rejected(self):
+        token, _ = issue_token(self.parent, ACCESS)
+        payload, _, signature = token.rpartition(":")
+        forged, _ = issue_token(
+            Parent.objects.create_user(username="otro", password="x"), ACCESS
+        )
+        with self.assertRaisesMessage(TokenError, "Invalid token"):
+            decode_token(forged.rpartition(":")[0] + ":" + signature)
+        with self.assertRaisesMessage(TokenError, "Invalid token"):
+            decode_token(payload + ":" + signature[::-1])
+        self.assertEqual(self.first_name(token[:-1]).status_code, 401)
+
+    def test_token_from_another_key_is_rejected(self):
+        token, _ = issue_token(self.parent, ACCESS)
+        with override_settings(
+            SIGNED_TOKENS={**settings.SIGNED_TOKENS, "SIGNING_KEY": "other-key"}
+        ):
+            with self.assertRaisesMessage(TokenError, "Invalid token"):
+                decode_token(token)
+
+    def test_refresh_token_is_not_an_access_token(self):
+        token, _ = issue_token(self.parent, REFRESH)
+        with self.assertRaisesMessage(TokenError, "Wrong token type"):
+            decode_token(token, ACCESS)
+        self.assertEqual(self.first_name(token).status_code, 401)
+
+    def test_expired_token_is_rejected(self):
+        with override_settings(
+            SIGNED_TOKENS={**settings.SIGNED_TOKENS, "ACCESS_TTL": 60}
+        ):
+            token, claims = issue_token(self.parent, ACCESS)
+        with mock.patch("api.tokens.time.time", return_value=claims["exp"] - 1):
+            decode_token(token)
+        with mock.patch("api.tokens.time.time", return_value=claims["exp"]):
+            with self.assertRaisesMessage(TokenError, "Token expired"):
+                decode_token(token)
+        with override_settings(
+            SIGNED_TOKENS={**settings.SIGNED_TOKENS, "ACCESS_TTL": -1}
+        ):
+            expired, _ = issue_token(self.parent, ACCESS)
+            response = self.first_name(expired)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data["detail"], "Token expired")
+
+    def test_revoked_token_is_rejected(self):
+        token, claims = issue_token(self.parent, ACCESS)
+        self.assertEqual(self.first_name(token).status_code, 200)
+        revoke(claims)
+        self.assertTrue(RevokedToken.objects.filter(jti=claims["jti"]).exists())
+        with self.assertRaisesMessage(TokenError, "Token revoked"):
+            decode_token(token)
+        response = self.first_name(token)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data["detail"], "Token revoked")
+
+    def test_sync_picks_up_revocations_from_other_processes(self):
+        token, claims = issue_token(self.parent, ACCESS)
+        decode_token(token)
+        # Another process revoked it; only the database knows
+        RevokedToken.objects.create(
+            jti=claims["jti"],
+            user_id=self.parent.pk,
+            token_type=ACCESS,
+            expires_at=timezone.now() + timedelta(minutes=15),
+        )
+        decode_token(token)
+        revocation_list.sync()
+        with self.assertRaisesMessage(TokenError, "Token revoked"):
+            decode_token(token)
+
+    def test_sync_prunes_expired_revocations(self):
+        _, claims = issue_token(self.parent, ACCESS)
+        revoke({**claims, "exp": int(time.time()) - 1})
+        revocation_list.sync()
+        self.assertFalse(revocation_list.is_revoked(claims["jti"]))
+        self.assertFalse(RevokedToken.objects.filter(jti=claims["jti"]).exists())
+
+    def test_malformed_token_id_counts_as_revoked(self):
+        self.assertTrue(revocation_list.is_revoked("not-hex"))
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+def device_schedule(bedtime="21:00", wake_time="07:00", device_id="tablet"):
+    return DeviceSchedule(
+        device_id=device_id,
+        family_id="FAM1",
+        child_id="CHILD1",
+        timezone="America/New_York",
+        bedtime=datetime.strptime(bedtime, "%H:%M").time(),
+        wake_time=datetime.strptime(wake_time, "%H:%M").time(),
+    )
+
+
+class BedtimeScheduleTests(SimpleTestCase):
+    """New York: clocks jump 02:00 -> 03:00 on 2026-03-08 and fall back
+    02:00 -> 01:00 on 2026-11-01"""
+
+    def test_bedtime_in_the_spring_gap_fires_an_hour_later(self):
+        schedule = device_schedule(bedtime="02:30")
+        # 02:30 EST never happens; fires at 03:30 EDT
+        self.assertEqual(
+            next_transition(schedule, utc(2026, 3, 8, 5, 0)),
+            (utc(2026, 3, 8, 7, 30), BEDTIME),
+        )
+        self.assertEqual(state_at(schedule, utc(2026, 3, 8, 7, 29)), AWAKE)
+        self.assertEqual(state_at(schedule, utc(2026, 3, 8, 7, 30)), BEDTIME)
+
+    def test_repeated_hour_fires_once(self):
+        schedule = device_schedule(bedtime="01:30")
+        # First 01:30 (EDT); the repeated 01:30 EST an hour later is skipped
+        self.assertEqual(
+            next_transition(schedule, utc(2026, 11, 1, 5, 0)),
+            (utc(2026, 11, 1, 5, 30), BEDTIME),
+        )
+        self.assertEqual(
+            next_transition(schedule, utc(2026, 11, 1, 5, 30)),
+            (utc(2026, 11, 1, 12, 0), AWAKE),
+        )
+        self.assertEqual(state_at(schedule, utc(2026, 11, 1, 6, 45)), BEDTIME)
+
+    def test_overnight_window_across_the_spring_jump(self):
+        schedule = device_schedule()
+        # 21:00 EST to 07:00 EDT is nine hours
+        self.assertEqual(state_at(schedule, utc(2026, 3, 8, 1, 59)), AWAKE)
+        self.assertEqual(state_at(schedule, utc(2026, 3, 8, 2, 0)), BEDTIME)
+        self.assertEqual(state_at(schedule, utc(2026, 3, 8, 10, 59)), BEDTIME)
+        self.assertEqual(state_at(schedule, utc(2026, 3, 8, 11, 0)), AWAKE)
+
+    def test_overnight_window_across_the_autumn_jump(self):
+        schedule = device_schedule()
+        # 21:00 EDT to 07:00 EST is eleven hours
+        self.assertEqual(
+            next_transition(schedule, utc(2026, 11, 1, 1, 0)),
+            (utc(2026, 11, 1, 12, 0), AWAKE),
+        )
+        self.assertEqual(state_at(schedule, utc(2026, 11, 1, 11, 59)), BEDTIME)
+
+
+class BedtimeSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+        self.scheduler = BedtimeScheduler(self.batches.append, batch_size=2)
+
+    def fired(self):
+        return [
+            (device.device_id, state, fired_at)
+            for batch in self.batches
+            for device, state, fired_at in batch
+        ]
+
+    def test_sync_dispatches_the_current_state_of_new_devices(self):
+        tablet, phone = device_schedule(), device_schedule(device_id="phone")
+        self.assertEqual(self.scheduler.sync([tablet, phone], utc(2026, 3, 9, 3)), 2)
+        self.assertEqual(
+            [(device_id, state) for device_id, state, _ in self.fired()],
+            [("tablet", BEDTIME), ("phone", BEDTIME)],
+        )
+        # Unchanged devices are left alone
+        self.assertEqual(self.scheduler.sync([tablet, phone], utc(2026, 3, 9, 4)), 0)
+        self.assertEqual(len(self.batches), 1)
+
+    def test_tick_fires_due_transitions_and_reschedules(self):
+        self.scheduler.sync([device_schedule()], utc(2026, 3, 9, 12))
+        self.batches.clear()
+        self.assertEqual(self.scheduler.tick(utc(2026, 3, 10, 0)), 0)
+        self.assertEqual(self.scheduler.next_due(), utc(2026, 3, 10, 1).timestamp())
+        # A late tick catches up on every transition it slept through
+        self.assertEqual(self.scheduler.tick(utc(2026, 3, 11, 12)), 4)
+        self.assertEqual(
+            self.fired(),
+            [
+                ("tablet", BEDTIME, utc(2026, 3, 10, 1)),
+                ("tablet", AWAKE, utc(2026, 3, 10, 11)),
+                ("tablet", BEDTIME, utc(2026, 3, 11, 1)),
+                ("tablet", AWAKE, utc(2026, 3, 11, 11)),
+            ],
+        )
+        self.assertEqual([len(batch) for batch in self.batches], [2, 2])
+        self.assertEqual(len(self.scheduler._heap), 1)
+
+    def test_changed_schedule_replaces_the_pending_entry(self):
+        self.scheduler.sync([device_schedule()], utc(2026, 3, 9, 12))
+        self.scheduler.sync([device_schedule(bedtime="20:00")], utc(2026, 3, 9, 12))
+        self.batches.clear()
+        self.assertEqual(self.scheduler.next_due(), utc(2026, 3, 10, 0).timestamp())
+        self.assertEqual(self.scheduler.tick(utc(2026, 3, 10, 1)), 1)
+        self.assertEqual(self.fired(), [("tablet", BEDTIME, utc(2026, 3, 10, 0))])
+
+    def test_removed_device_stops_firing(self):
+        self.scheduler.sync([device_schedule()], utc(2026, 3, 9, 12))
+        self.scheduler.sync([], utc(2026, 3, 9, 12))
+        self.assertEqual(len(self.scheduler), 0)
+        self.assertEqual(self.scheduler.tick(utc(2026, 3, 12)), 0)
+        self.assertIsNone(self.scheduler.next_due())
+
+    def test_stale_entries_are_compacted(self):
+        now = utc(2026, 3, 9, 12)
+        for minute in range(1100):
+            bedtime = f"{20 + minute // 60 % 2}:{minute % 60:02d}"
+            self.scheduler.sync([device_schedule(bedtime=bedtime)], now)
+        self.assertLessEqual(len(self.scheduler._heap), 2 + 1024 + 1)
+        self.assertEqual(self.scheduler.tick(utc(2026, 3, 10, 12)), 2)
+
+
+class RetrievalIndexTests(TestCase):
+    passages = [
+        {
+            "id": "sueno",
+            "title": "Rutina para dormir",
+            "text": "Acostarse a la misma hora ayuda a dormir mejor.",
+        },
+        {
+            "id": "pantallas",
+            "title": "Tiempo de pantalla",
+            "text": "Pactar límites de pantalla con los niños.",
+        },
+    ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name, "index")
+        self.corpus = Path(directory.name, "corpus.jsonl")
+        self.write_corpus(self.passages)
+        reset_index()
+        self.addCleanup(reset_index)
+
+    def write_corpus(self, passages):
+        self.corpus.write_text(
+            "".join(json.dumps(p, ensure_ascii=False) + "\n" for p in passages),
+            encoding="utf-8",
+        )
+
+    def search(self, index_dir, query):
+        return [p["id"] for _, p in RetrievalIndex(index_dir).search(query)]
+
+    def test_search_finds_matching_passages(self):
+        index_dir = publish_index(self.corpus, self.root)
+        self.assertEqual(self.search(index_dir, "¿A qué hora dormir?"), ["sueno"])
+        self.assertEqual(self.search(index_dir, "fútbol"), [])
+
+    def test_concurrent_builds_publish_one_complete_index(self):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            index_dirs = set(
+                pool.map(lambda _: publish_index(self.corpus, self.root), range(8))
+            )
+        (index_dir,) = index_dirs
+        self.assertEqual([path.name for path in self.root.iterdir()], [index_dir.name])
+        self.assertEqual(self.search(index_dir, "pantalla"), ["pantallas"])
+
+    def test_changed_corpus_is_rebuilt(self):
+        first = publish_index(self.corpus, self.root)
+        self.assertEqual(publish_index(self.corpus, self.root), first)
+        self.write_corpus(
+            self.passages
+            + [{"id": "tareas", "title": "Tareas", "text": "Ayudar con las tareas."}]
+        )
+        second = publish_index(self.corpus, self.root)
+        self.assertNotEqual(second, first)
+        self.assertEqual(self.search(second, "tareas"), ["tareas"])
+
+    def test_failed_load_is_retried_after_the_interval(self):
+        missing = self.corpus.with_name("missing.jsonl")
+        with override_settings(
+            RETRIEVAL_CORPUS=missing,
+            RETRIEVAL_INDEX_DIR=self.root,
+            RETRIEVAL_RETRY_INTERVAL=60,
+        ):
+            with self.assertLogs("utils.retrieval", "WARNING"):
+                self.assertIsNone(get_index())
+            self.corpus.rename(missing)
+            # Not retried within the interval, then loaded
+            self.assertIsNone(get_index())
+            later = time.monotonic() + 61
+            with mock.patch("utils.retrieval.time.monotonic", return_value=later):
+                self.assertIsNotNone(get_index())
+
+
+class PrefilterTests(SimpleTestCase):
+    def setUp(self):
+        self.prefilter = MessagePrefilter()
+
+    def assertIntents(self, expected, messages):
+        for message in messages:
+            with self.subTest(message=message):
+                self.assertEqual(self.prefilter.classify(message), expected)
+
+    def test_first_person_self_harm_gets_helpline_information(self):
+        self.assertIntents(
+            "self_harm",
+            ["Ya no puedo más, quiero suicidarme", "Hola, me quiero matar"],
+        )
+        intent, reply = self.prefilter.respond("Voy a quitarme la vida")
+        self.assertEqual(intent, "self_harm")
+        self.assertIn("línea de ayuda", reply)
+        self.assertNotIn("no puedo ayudar", reply)
+
+    def test_first_person_dangerous_requests_are_refused(self):
+        self.assertIntents(
+            "unsafe",
+            ["¿Dónde puedo comprar drogas?", "Dime cómo hago una bomba casera"],
+        )
+        _, reply = self.prefilter.respond("quiero comprar drogas")
+        self.assertIn("no puedo ayudar", reply)
+
+    def test_parents_asking_about_risks_reach_the_model(self):
+        self.assertIntents(
+            SENSITIVE,
+            [
+                "Mi hijo quiere comprar drogas, ¿qué hago?",
+                "Encontré que mi hija buscó dónde compro drogas",
+                "¿Cómo le hablo de las drogas a un adolescente?",
+                "Mi hijo dice que quiere suicidarse",
+                "Hola, ¿cómo prevenir las autolesiones?",
+            ],
+        )
+        self.assertEqual(
+            self.prefilter.respond("Me preocupa que mi hijo pruebe drogas"),
+            (SENSITIVE, None),
+        )
+
+    def test_everyday_questions_pass_through(self):
+        self.assertIntents(
+            None,
+            [
+                "¿Cuántas horas debe dormir un niño de 8 años?",
+                "Se activó la alarma del armario",
+                "Hola, ¿cómo limito el tiempo de pantalla?",
+            ],
+        )
+
+    def test_short_courtesies_are_answered_locally(self):
+        self.assertIntents("greeting", ["¡Hola!", "Buenos días"])
+        self.assertEqual(
+            self.prefilter.respond("Muchas gracias", first_name="Ana"),
+            ("thanks", "¡Con gusto, Ana! Aquí estoy si necesitas algo más."),
+        )
+
+
+class GatedModel:
+    """Model whose calls block until ``gate`` is set"""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.prompts = []
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+        self.gate.wait(5)
+        return FakeGenerativeModel().generate_content(prompt)
+
+
+class GeminiResilienceTests(SimpleTestCase):
+    def resilient(self, model, **kwargs):
+        resilient = ResilientModel(model, **kwargs)
+        self.addCleanup(resilient._executor.shutdown, wait=False, cancel_futures=True)
+        return resilient
+
+    def test_identical_prompts_share_one_call(self):
+        model = FakeGenerativeModel(latency=0.2)
+        resilient = self.resilient(model)
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            texts = list(
+                pool.map(lambda _: resilient.generate_content("hola").text, range(5))
+            )
+        self.assertEqual(model.calls, 1)
+        self.assertEqual(len(set(texts)), 1)
+
+    def test_upstream_errors_become_unavailable(self):
+        resilient = self.resilient(FakeGenerativeModel(fail_every=1))
+        with self.assertRaises(GeminiUnavailable) as caught:
+            resilient.generate_content("hola")
+        self.assertIsInstance(caught.exception.__cause__, RuntimeError)
+
+    def test_breaker_opens_after_consecutive_failures(self):
+        model = FakeGenerativeModel(fail_every=1)
+        resilient = self.resilient(
+            model, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        )
+        for prompt in ("a", "b"):
+            with self.assertRaises(GeminiUnavailable):
+                resilient.generate_content(prompt)
+        with self.assertRaises(CircuitOpen):
+            resilient.generate_content("c")
+        self.assertEqual(model.calls, 2)
+
+    def test_half_open_breaker_lets_one_probe_through(self):
+        now = [0.0]
+        breaker = CircuitBreaker(
+            failure_threshold=1, reset_timeout=30, clock=lambda: now[0]
+        )
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        now[0] = 31
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_deadline_cancels_queued_attempts(self):
+        model = GatedModel()
+        self.addCleanup(model.gate.set)
+        resilient = self.resilient(model, timeout=0.2, max_concurrency=1)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            calls = [pool.submit(resilient.generate_content, p) for p in "ab"]
+            for call in calls:
+                with self.assertRaises(DeadlineExceeded):
+                    call.result()
+        model.gate.set()
+        resilient._executor.shutdown(wait=True)
+        # The second prompt waited behind the first and never went upstream
+        self.assertEqual(model.prompts, ["a"])
+
+    def test_full_queue_is_rejected(self):
+        model = GatedModel()
+        self.addCleanup(model.gate.set)
+        resilient = self.resilient(model, timeout=1, max_concurrency=1, max_queue=0)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            running = pool.submit(resilient.generate_content, "a")
+            while not model.prompts:
+                time.sleep(0.01)
+            with self.assertRaises(Overloaded):
+                resilient.generate_content("b")
+            model.gate.set()
+            running.result()
+        self.assertEqual(resilient.breaker.failures, 0)
+
+    def test_slow_call_is_hedged(self):
+        calls = iter([1.0])
+        model = FakeGenerativeModel(latency=lambda: next(calls, 0))
+        resilient = self.resilient(model, hedge_percentile=50, hedge_min_samples=5)
+        resilient._latencies.extend([0.05] * 10)
+        before = GEMINI_EVENTS.value(event="hedged")
+        started = time.monotonic()
+        resilient.generate_content("hola")
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(GEMINI_EVENTS.value(event="hedged"), before + 1)
+        self.assertEqual(model.calls, 2)
+
+    def test_failed_hedged_pair_counts_as_one_failure(self):
+        model = FakeGenerativeModel(latency=0.1, fail_every=1)
+        resilient = self.resilient(model, hedge_percentile=50, hedge_min_samples=5)
+        resilient._latencies.extend([0.01] * 10)
+        with self.assertRaises(GeminiUnavailable):
+            resilient.generate_content("hola")
+        self.assertEqual(model.calls, 2)
+        self.assertEqual(resilient.breaker.failures, 1)
+
+
+class ReconcileFamiliesTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.families = get_families_collection()
+        self.parents = {}
+        # Upper-case sorts before lower-case in code point order, after it
+        # in a case-insensitive collation
+        for family_id in ("B-family", "a-family", "c-family"):
+            self.parents[family_id] = Parent.objects.create_user(
+                username=family_id,
+                email=f"{family_id}@example.com",
+                password="x",
+                family_id=family_id,
+            )
+
+    def test_disagreeing_orders_abort_the_merge(self):
+        case_insensitive = sorted(
+            self.parents.values(), key=lambda parent: parent.family_id.lower()
+        )
+        documents = [{"family_id": "B-family"}, {"family_id": "a-family"}]
+        with self.assertRaises(MergeOrderError):
+            list(merge_families(case_insensitive, [], documents))
+
+    def test_mixed_case_family_ids_are_matched(self):
+        for family_id in ("B-family", "a-family"):
+            self.families.insert_one(
+                family_document([self.parents[family_id]], family_id=family_id)
+            )
+        call_command("reconcile_families", stdout=io.StringIO())
+        self.assertEqual(
+            sorted(doc["family_id"] for doc in self.families.find({})),
+            ["B-family", "a-family", "c-family"],
+        )
@@ -0,0 +1,196 @@
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core import signing
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from utils.periodic import PeriodicTask
+
+ACCESS = "access"
+REFRESH = "refresh"
+
+_SALT = "api.tokens"
+_PASSWORD_SALT = "api.tokens.password"
+
+
+class TokenError(Exception):
+    """Token is malformed, tampered with, expired, revoked or of the wrong type"""
+
+
+def _config():
+    return getattr(settings, "SIGNED_TOKENS", {})
+
+
+def signed_tokens_enabled():
+    return bool(_config().get("ENABLED"))
+
+
+def issue_token(user, token_type):
+    """Return (token, claims) for a user; claims are enough to authenticate"""
+    config = _config()
+    ttl = config.get("ACCESS_TTL", 900) if token_type == ACCESS else config.get(
+        "REFRESH_TTL", 14 * 24 * 3600
+    )
+    now = int(time.time())
+    claims = {
+        "uid": user.id,
+        "fid": user.family_id,
+        "role": user.role,
+        "usr": user.username,
+        "name": user.full_name,
+        "typ": token_type,
+        "jti": uuid.uuid4().hex,
+        "iat": now,
+        "exp": now + ttl,
+    }
+    token = signing.dumps(claims, key=config.get("SIGNING_KEY"), salt=_SALT)
+    return token, claims
+
+
+def issue_token_pair(user):
+    access, access_claims = issue_token(user, ACCESS)
+    refresh, _ = issue_token(user, REFRESH)
+    return {
+        "access_token": access,
+        "refresh_token": refresh,
+        "token_type": "Bearer",
+        "expires_in": access_claims["exp"] - access_claims["iat"],
+    }
+
+
+def decode_token(token, token_type=ACCESS):
+    """Verify signature, type, expiry and revocation; return the claims"""
+    try:
+        claims = signing.loads(token, key=_config().get("SIGNING_KEY"), salt=_SALT)
+    except signing.BadSignature:
+        raise TokenError("Invalid token")
+    if claims.get("typ") != token_type:
+        raise TokenError("Wrong token type")
+    if claims.get("exp", 0) <= time.time():
+        raise TokenError("Token expired")
+    if revocation_list.is_revoked(claims["jti"]):
+        raise TokenError("Token revoked")
+    return claims
+
+
+def _password_fingerprint(user):
+    # Changes with the stored hash, so a token works only until it is used
+    return salted_hmac(_PASSWORD_SALT, user.password).hexdigest()[:20]
+
+
+def issue_password_token(user):
+    """Signed token letting a user choose a password, e.g. an imported parent"""
+    return signing.dumps(
+        {"uid": user.pk, "pwd": _password_fingerprint(user)}, salt=_PASSWORD_SALT
+    )
+
+
+def read_password_token(token):
+    """
+    Return the active parent a set-password token was issued to. Raises
+    TokenError if it is tampered with, older than PASSWORD_SETUP["TOKEN_TTL"]
+    or the password changed since it was issued.
+    """
+    from .models import Parent
+
+    max_age = getattr(settings, "PASSWORD_SETUP", {}).get("TOKEN_TTL", 7 * 24 * 3600)
+    try:
+        claims = signing.loads(token, salt=_PASSWORD_SALT, max_age=max_age)
+    except signing.SignatureExpired:
+        raise TokenError("Token expired")
+    except signing.BadSignature:
+        raise TokenError("Invalid token")
+    user = Parent.objects.filter(pk=claims.get("uid"), is_active=True).first()
+    if user is None or not constant_time_compare(
+        claims.get("pwd", ""), _password_fingerprint(user)
+    ):
+        raise TokenError("Token already used")
+    return user
+
+
+def revoke(claims):
+    """Revoke a decoded token everywhere (other processes within one sync)"""
+    from .models import RevokedToken
+
+    expires_at = datetime.fromtimestamp(claims["exp"], dt_timezone.utc)
+    RevokedToken.objects.get_or_create(
+        jti=claims["jti"],
+        defaults={
+            "user_id": claims["uid"],
+            "token_type": claims["typ"],
+            "expires_at": expires_at,
+        },
+    )
+    revocation_list.add(claims["jti"], claims["exp"])
+
+
+class RevocationList:
+    """
+    In-memory set of revoked token ids that haven't expired yet.
+
+    Ids are kept as 16-byte keys mapped to their expiry, so the set stays
+    small (only tokens revoked within the refresh TTL) and is pruned as
+    tokens expire. The first lookup loads it from RevokedToken; after that
+    a background task pulls only rows revoked since the last sync, so
+    is_revoked() never queries the database on the request path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = {}
+        self._synced_at = None
+        self._syncer = PeriodicTask(
+            "token-revocation-sync",
+            _config().get("REVOCATION_SYNC_INTERVAL", 30),
+            self.sync,
+        )
+
+    def add(self, jti, expires):
+        with self._lock:
+            self._revoked[bytes.fromhex(jti)] = expires
+
+    def is_revoked(self, jti):
+        if self._synced_at is None:
+            self.sync()
+            self._syncer.start()
+        try:
+            key = bytes.fromhex(jti)
+        except ValueError:
+            return True
+        return key in self._revoked
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def sync(self):
+        from django.utils import timezone
+
+        from .models import RevokedToken
+
+        now = timezone.now()
+        rows = RevokedToken.objects.filter(expires_at__gt=now)
+        if self._synced_at is not None:
+            # Overlap by a few seconds to cover rows committed late
+            overlap = timedelta(seconds=_config().get("SYNC_OVERLAP", 5))
+            rows = rows.filter(revoked_at__gte=self._synced_at - overlap)
+        fresh = {
+            bytes.fromhex(jti): expires_at.timestamp()
+            for jti, expires_at in rows.values_list("jti", "expires_at")
+        }
+        cutoff = now.timestamp()
+        with self._lock:
+            self._revoked = {
+                key: expires
+                for key, expires in self._revoked.items()
+                if expires > cutoff
+            }
+            self._revoked.update(fresh)
+            self._synced_at = now
+        RevokedToken.objects.filter(expires_at__lte=now).delete()
+
+
+revocation_list = RevocationList()
@@ -2,17 +2,29 @@ from django.urls import path
 
 from .views import LoginView  # Your existing views
 from .views import (AcceptChildCodeView,  # Add AcceptChildCodeView
-                    AcceptInvitationView, ChatbotView, CheckInvitationView,
-                    FirstNameView, GenerateChildCodeView, LogoutView,
-                    MyChildCodesView, MyInvitationsView,
-                    ParentRegistrationView, SendFamilyInvitationView,
-                    UserProfileView)
+                    AcceptInvitationView, ChatbotUsageView, ChatbotView,
+                    CheckInvitationView, ChildAppRuleDetailView,
+                    ChildAppRulesView, ChildMonitoringSettingsView,
+                    DeviceHeartbeatView, DevicePolicyCheckView,
+                    DevicePolicyView, FamilyExportView, FamilyImportView,
+                    FamilyLocationsView, FamilyPresenceView, FirstNameView,
+                    GenerateChildCodeView, GeofenceDetailView,
+                    GeofenceListView, ImportJobView, LocationIngestView,
+                    LogoutView, MetricsView, MyChildCodesView,
+                    MyInvitationsView, ParentRegistrationView,
+                    ProfileDownloadView, ProfileListView, ProfilingTokenView,
+                    PushTokenView, SendFamilyInvitationView, SetPasswordView,
+                    TokenRefreshView, UserProfileView, WeeklyDigestView)
 
 urlpatterns = [
     # Authentication endpoints
     path("auth/register/", ParentRegistrationView.as_view(), name="parent-register"),
     path("auth/login/", LoginView.as_view(), name="parent-login"),
     path("auth/logout/", LogoutView.as_view(), name="parent-logout"),
+    path("auth/token/refresh/", TokenRefreshView.as_view(), name="token-refresh"),
+    path(
+        "auth/set-password/", SetPasswordView.as_view(), name="set-password"
+    ),
     path("auth/profile/", UserProfileView.as_view(), name="user-profile"),
     # Family invitation endpoints
     path(
@@ -25,6 +37,7 @@ urlpatterns = [
     path("invitations/my/", MyInvitationsView.as_view(), name="my-invitations"),
     # Chatbot endpoint
     path("chatbot/", ChatbotView.as_view(), name="chatbot"),
+    path("chatbot/usage/", ChatbotUsageView.as_view(), name="chatbot-usage"),
     # User utilities
     path("auth/first-name/", FirstNameView.as_view(), name="first-name"),
     # Child registration endpoints
@@ -37,4 +50,60 @@ urlpatterns = [
         "children/accept-code/", AcceptChildCodeView.as_view(), name="accept-child-code"
     ),
     path("children/my-codes/", MyChildCodesView.as_view(), name="my-child-codes"),
+    path(
+        "children/<str:child_id>/monitoring/",
+        ChildMonitoringSettingsView.as_view(),
+        name="child-monitoring",
+    ),
+    path(
+        "children/<str:child_id>/app-rules/",
+        ChildAppRulesView.as_view(),
+        name="child-app-rules",
+    ),
+    path(
+        "children/<str:child_id>/app-rules/<str:rule_id>/",
+        ChildAppRuleDetailView.as_view(),
+        name="child-app-rule-detail",
+    ),
+    # Device policy endpoints
+    path("devices/policy/", DevicePolicyView.as_view(), name="device-policy"),
+    path(
+        "devices/policy/check/",
+        DevicePolicyCheckView.as_view(),
+        name="device-policy-check",
+    ),
+    # Presence endpoints
+    path(
+        "devices/heartbeat/", DeviceHeartbeatView.as_view(), name="device-heartbeat"
+    ),
+    path("devices/presence/", FamilyPresenceView.as_view(), name="family-presence"),
+    path("notifications/push-token/", PushTokenView.as_view(), name="push-token"),
+    # Location endpoints
+    path("locations/ingest/", LocationIngestView.as_view(), name="location-ingest"),
+    path("locations/family/", FamilyLocationsView.as_view(), name="family-locations"),
+    path("geofences/", GeofenceListView.as_view(), name="geofences"),
+    path(
+        "geofences/<str:fence_id>/",
+        GeofenceDetailView.as_view(),
+        name="geofence-detail",
+    ),
+    # Weekly digest
+    path("families/digest/", WeeklyDigestView.as_view(), name="weekly-digest"),
+    # Data export
+    path("families/export/", FamilyExportView.as_view(), name="family-export"),
+    # Bulk onboarding
+    path("families/import/", FamilyImportView.as_view(), name="family-import"),
+    path(
+        "families/import/<str:job_id>/", ImportJobView.as_view(), name="import-job"
+    ),
+    # Operational endpoints
+    path("metrics/", MetricsView.as_view(), name="metrics"),
+    # Request profiling (staff only)
+    path("profiling/", ProfileListView.as_view(), name="profile-list"),
+    path("profiling/token/", ProfilingTokenView.as_view(), name="profiling-token"),
+    path(
+        "profiling/<str:profile_id>/<str:kind>/",
+        ProfileDownloadView.as_view(),
+        name="profile-download",
+    ),
 ]
@@ -1,22 +1,59 @@
+import csv
+import io
 import logging
+from datetime import date
 
-import google.generativeai as genai
 from django.conf import settings
 from django.contrib.auth import login, logout
+from django.http import (FileResponse, Http404, HttpResponse,
+                         StreamingHttpResponse)
+from django.utils.cache import get_conditional_response
 from django.utils import timezone
 from django.utils.decorators import method_decorator
+from django.utils.http import quote_etag
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from utils import metrics
+from utils.gemini import GeminiUnavailable, get_model
+from utils.prefilter import SAFETY_CONTEXT, SENSITIVE, prefilter
+from utils.query_budget import query_budget
+from utils.retrieval import retrieve
+from utils.usage import USAGE_COLLECTION, estimate_tokens, usage_tracker
+
+from .app_rules import (delete_rule, get_policy, invalidate_policy, put_rule,
+                        set_default)
+from .authentication import DeviceAuthentication, IsLinkedDevice, TokenUser
+from .bedtime import DEVICE_STATES_COLLECTION
+from .caching import profile_cache
+from .devices import invalidate_device
+from .digests import get_digest
+from .exports import ExportCursorError, ndjson_export, zip_export
+from .families import get_families_collection
+from .hashing import HashingPoolSaturated
+from .imports import ImportFormatError, OnboardingImport, get_jobs_collection
+from .locations import add_geofence, ingest_pings, remove_geofence
 from .models import ChildRegistrationCode, FamilyInvitation, Parent
+from .notifications import (DEVICE_LINKED, GEOFENCE_ENTER, GEOFENCE_EXIT,
+                            INVITATION_ACCEPTED, dispatcher, notify,
+                            register_push_token, unregister_push_token)
+from .presence import family_presence, presence_tracker
+from .profiling import HEADER as PROFILE_HEADER
+from .profiling import issue_token, list_profiles, profile_file
 from .serializers import (  # Add GenerateChildCodeSerializer
-    AcceptChildCodeSerializer, AcceptInvitationSerializer, ChatbotSerializer,
-    CheckInvitationSerializer, GenerateChildCodeSerializer, LoginSerializer,
-    ParentRegistrationSerializer, SendFamilyInvitationSerializer)
+    AcceptChildCodeSerializer, AcceptInvitationSerializer, AppCheckSerializer,
+    AppPolicyDefaultSerializer, AppRuleSerializer, ChatbotSerializer,
+    CheckInvitationSerializer, GenerateChildCodeSerializer, GeofenceSerializer,
+    HeartbeatSerializer, LocationBatchSerializer, LoginSerializer, MonitoringSettingsSerializer,
+    ParentRegistrationSerializer, PushTokenSerializer,
+    SendFamilyInvitationSerializer, SetPasswordSerializer)
+from .tokens import (REFRESH, TokenError, decode_token, issue_token_pair, revoke,
+                     signed_tokens_enabled)
 
 logger = logging.getLogger(__name__)
 
@@ -27,21 +64,19 @@ class ParentRegistrationView(APIView):
 
     permission_classes = [AllowAny]
 
+    @query_budget(6)
     def post(self, request):
         serializer = ParentRegistrationSerializer(data=request.data)
-        print(request.data)
-        print(serializer.is_valid())
         if not serializer.is_valid():
             return Response(
                 {"success": False, "errors": serializer.errors},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        print(serializer.is_valid())
         try:
             parent = serializer.save()
             # Create auth token
             token, created = Token.objects.get_or_create(user=parent)
-            logger.info(f"New parent registered: {parent.username} ({parent.email})")
+            logger.info("New parent registered: %s (%s)", parent.username, parent.email)
             return Response(
                 {
                     "success": True,
@@ -65,7 +100,7 @@ class ParentRegistrationView(APIView):
                 status=status.HTTP_201_CREATED,
             )
         except Exception as e:
-            logger.error(f"Registration failed: {str(e)}")
+            logger.error("Registration failed: %s", e)
             return Response(
                 {"success": False, "error": f"Registration failed: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -78,48 +113,127 @@ class LoginView(APIView):
 
     permission_classes = [AllowAny]
 
+    @query_budget(6)
     def post(self, request):
-        serializer = LoginSerializer(data=request.data)
-        if not serializer.is_valid():
+        serializer = LoginSerializer(data=request.data, context={"request": request})
+        try:
+            is_valid = serializer.is_valid()
+        except HashingPoolSaturated:
+            logger.warning("Login rejected: password hashing pool saturated")
+            return Response(
+                {"success": False, "error": "Too many login attempts, try again"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "1"},
+            )
+        if not is_valid:
             return Response(
                 {"success": False, "errors": serializer.errors},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
         user = serializer.validated_data["user"]
-        # Create Django session
-        login(request, user)
+        stateless = signed_tokens_enabled()
+        if not stateless:
+            # Create Django session
+            login(request, user)
         # Get or create token
         token, created = Token.objects.get_or_create(user=user)
-        logger.info(f"User logged in: {user.username} ({user.email})")
+        logger.info("User logged in: %s (%s)", user.username, user.email)
+
+        data = {
+            "success": True,
+            "message": "Login successful",
+            "user": {
+                "id": user.id,
+                "username": user.username,
+                "email": user.email,
+                "full_name": user.full_name,
+                "family_id": user.family_id,
+                "role": user.role,
+                "is_verified": user.is_verified,
+            },
+            "token": token.key,
+        }
+        if stateless:
+            data.update(issue_token_pair(user))
+        return Response(data)
 
-        return Response(
-            {
-                "success": True,
-                "message": "Login successful",
-                "user": {
-                    "id": user.id,
-                    "username": user.username,
-                    "email": user.email,
-                    "full_name": user.full_name,
-                    "family_id": user.family_id,
-                    "role": user.role,
-                    "is_verified": user.is_verified,
-                },
-                "token": token.key,
-            }
-        )
+
+@method_decorator(csrf_exempt, name="dispatch")
+class TokenRefreshView(APIView):
+    """Exchange a refresh token for a new access/refresh token pair"""
+
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    # revoke() writes the revocation; the first call per process loads the list
+    @query_budget(5)
+    def post(self, request):
+        if not signed_tokens_enabled():
+            raise Http404
+        try:
+            claims = decode_token(request.data.get("refresh_token", ""), REFRESH)
+        except TokenError as e:
+            return Response(
+                {"success": False, "error": str(e)},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+
+        # Re-read the user so role/family changes and deactivation apply
+        user = Parent.objects.filter(pk=claims["uid"], is_active=True).first()
+        if user is None:
+            return Response(
+                {"success": False, "error": "User not found"},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+        # Refresh tokens are single use
+        revoke(claims)
+        return Response({"success": True, **issue_token_pair(user)})
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class SetPasswordView(APIView):
+    """Choose a password with the signed token from the welcome email"""
+
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    @query_budget(2)
+    def post(self, request):
+        serializer = SetPasswordSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        user = serializer.save()
+        logger.info("Password set for %s", user.username)
+        return Response({"success": True, "message": "Password set, you can log in"})
 
 
 @method_decorator(csrf_exempt, name="dispatch")
 class LogoutView(APIView):
     """Logout user and delete token"""
 
+    # Deletes the DRF token and revokes up to two signed tokens
+    @query_budget(8)
     def post(self, request):
         try:
             # Delete the user's token
             if hasattr(request.user, "auth_token"):
                 request.user.auth_token.delete()
+            # Revoke signed tokens: the access token used for this request
+            # and, if sent, its refresh token
+            if isinstance(request.auth, dict):
+                revoke(request.auth)
+            refresh_token = request.data.get("refresh_token")
+            if refresh_token and signed_tokens_enabled():
+                try:
+                    claims = decode_token(refresh_token, REFRESH)
+                    if claims["uid"] == request.user.id:
+                        revoke(claims)
+                except TokenError:
+                    pass
             # Django logout
             logout(request)
             return Response({"success": True, "message": "Logged out successfully"})
@@ -133,8 +247,14 @@ class LogoutView(APIView):
 class UserProfileView(APIView):
     """Get current user profile"""
 
+    permission_classes = [IsAuthenticated]
+
+    @query_budget(1)
+    @profile_cache("profile")
     def get(self, request):
         user = request.user
+        if isinstance(user, TokenUser):
+            user = user.get_parent()
         return Response(
             {
                 "success": True,
@@ -158,6 +278,7 @@ class SendFamilyInvitationView(APIView):
 
     permission_classes = [IsAuthenticated]
 
+    @query_budget(6)
     def post(self, request):
         serializer = SendFamilyInvitationSerializer(
             data=request.data, context={"request": request}
@@ -171,7 +292,9 @@ class SendFamilyInvitationView(APIView):
         try:
             invitation = serializer.save()
             logger.info(
-                f"Family invitation sent by {request.user.username} to {invitation.invited_email}"
+                "Family invitation sent by %s to %s",
+                request.user.username,
+                invitation.invited_email,
             )
             return Response(
                 {
@@ -188,12 +311,13 @@ class SendFamilyInvitationView(APIView):
                         f"Share this 6-digit invitation code with {invitation.invited_email}:",
                         f"Code: {invitation.invitation_code}",
                         "They can use this code to check and accept the invitation",
+                        f"The code is also being emailed to {invitation.invited_email}",
                     ],
                 },
                 status=status.HTTP_201_CREATED,
             )
         except Exception as e:
-            logger.error(f"Failed to send invitation: {str(e)}")
+            logger.error("Failed to send invitation: %s", e)
             return Response(
                 {"success": False, "error": f"Failed to send invitation: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -206,6 +330,7 @@ class CheckInvitationView(APIView):
 
     permission_classes = [AllowAny]
 
+    @query_budget(2)
     def post(self, request):
         serializer = CheckInvitationSerializer(data=request.data)
         if not serializer.is_valid():
@@ -240,6 +365,7 @@ class AcceptInvitationView(APIView):
 
     permission_classes = [AllowAny]
 
+    @query_budget(11)
     def post(self, request):
         serializer = AcceptInvitationSerializer(data=request.data)
         if not serializer.is_valid():
@@ -252,9 +378,17 @@ class AcceptInvitationView(APIView):
             parent = serializer.save()
             # Create auth token
             token, created = Token.objects.get_or_create(user=parent)
-            # Auto-login the new user
-            login(request, parent)
-            logger.info(f"Family invitation accepted by {parent.email}")
+            # Auto-login the new user (not authenticated through a backend)
+            login(request, parent, backend="api.backends.EmailBackend")
+            logger.info("Family invitation accepted by %s", parent.email)
+            dispatcher.invalidate_roster(parent.family_id)
+            notify(
+                parent.family_id,
+                INVITATION_ACCEPTED,
+                key=str(parent.id),
+                exclude=[parent.id],
+                name=parent.full_name,
+            )
 
             return Response(
                 {
@@ -274,7 +408,7 @@ class AcceptInvitationView(APIView):
                 status=status.HTTP_201_CREATED,
             )
         except Exception as e:
-            logger.error(f"Failed to accept invitation: {str(e)}")
+            logger.error("Failed to accept invitation: %s", e)
             return Response(
                 {"success": False, "error": f"Failed to accept invitation: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -286,10 +420,11 @@ class MyInvitationsView(APIView):
 
     permission_classes = [IsAuthenticated]
 
+    @query_budget(1)
     def get(self, request):
-        invitations = FamilyInvitation.objects.filter(invited_by=request.user).order_by(
-            "-created_at"
-        )
+        invitations = FamilyInvitation.objects.filter(
+            invited_by_id=request.user.id
+        ).order_by("-created_at")
         invitation_list = []
         for inv in invitations:
             invitation_list.append(
@@ -319,12 +454,7 @@ class ChatbotView(APIView):
 
     permission_classes = [IsAuthenticated]
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        # Configure Gemini API
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel("gemini-1.5-flash")
-
+    @query_budget(0)
     def post(self, request):
         serializer = ChatbotSerializer(data=request.data)
         if not serializer.is_valid():
@@ -333,27 +463,99 @@ class ChatbotView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        # Greetings, thanks, self-harm and blocked requests are answered locally
+        intent, reply = prefilter.respond(
+            serializer.validated_data["message"],
+            first_name=(request.user.full_name or "").split(" ")[0],
+        )
+        if reply is not None:
+            return Response(
+                {
+                    "success": True,
+                    "response": reply,
+                    "user_message": serializer.validated_data["message"],
+                    "timestamp": timezone.now(),
+                    "intent": intent,
+                },
+                status=status.HTTP_200_OK,
+            )
+
+        # In-memory quota check, no database round-trip (see utils.usage)
+        allowed, exceeded = usage_tracker.check(
+            request.user.id, request.user.family_id
+        )
+        if not allowed:
+            logger.info(
+                "Chatbot quota %s reached for user %s", exceeded, request.user.username
+            )
+            return Response(
+                {
+                    "success": False,
+                    "error": "Has alcanzado el límite diario del asistente. Vuelve a intentarlo mañana.",
+                    "quota": exceeded,
+                },
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+
         try:
             user_message = serializer.validated_data["message"]
 
-            # Add context about the user and family app
-            system_context = f"""
-            Eres un chatbot asistente familiar muy útil. El nombre del usuario es {request.user.full_name} 
-            y forma parte de un sistema de gestión familiar. Puedes ayudar con preguntas generales 
+            # Context about the family app. Nothing user-specific goes in the
+            # prompt: identical questions then share one upstream call
+            system_context = """
+            Eres un chatbot asistente familiar muy útil. El usuario forma parte
+            de un sistema de gestión familiar. Puedes ayudar con preguntas generales 
             sobre crianza de hijos, organización familiar, y brindar conversación amigable.
             Mantén tus respuestas útiles, apropiadas para toda la familia, y concisas.
             Responde siempre en español.
             """
+            if intent == SENSITIVE:
+                system_context += SAFETY_CONTEXT
+
+            # Ground the answer in the few most relevant curated passages
+            passages = retrieve(user_message)
+            if passages:
+                references = "\n".join(
+                    f"- {passage['title']}: {passage['text']}" for passage in passages
+                )
+                system_context += (
+                    "\nBasa tu respuesta en esta información de referencia "
+                    f"cuando sea relevante:\n{references}\n"
+                )
 
             # Combine context with user message
             full_prompt = f"{system_context}\n\nUser: {user_message}"
 
-            # Generate response from Gemini
-            response = self.model.generate_content(full_prompt)
+            # Generate response from Gemini (coalesced, deadline-bound and
+            # guarded by a circuit breaker, see utils.gemini)
+            try:
+                response = get_model().generate_content(full_prompt)
+            except GeminiUnavailable as e:
+                logger.warning(
+                    "Chatbot fallback for user %s: %s", request.user.username, e
+                )
+                return Response(
+                    {
+                        "success": True,
+                        "response": settings.GEMINI_FALLBACK_REPLY,
+                        "user_message": user_message,
+                        "timestamp": timezone.now(),
+                        "degraded": True,
+                    },
+                    status=status.HTTP_200_OK,
+                )
+
+            usage_tracker.record(
+                request.user.id,
+                request.user.family_id,
+                estimate_tokens(full_prompt, response),
+            )
 
             # Log the interaction
             logger.info(
-                f"Chatbot interaction by {request.user.username}: {user_message[:50]}..."
+                "Chatbot interaction by %s: %.50s...",
+                request.user.username,
+                user_message,
             )
 
             return Response(
@@ -367,7 +569,7 @@ class ChatbotView(APIView):
             )
 
         except Exception as e:
-            logger.error(f"Chatbot error for user {request.user.username}: {str(e)}")
+            logger.error("Chatbot error for user %s: %s", request.user.username, e)
             return Response(
                 {
                     "success": False,
@@ -378,11 +580,64 @@ class ChatbotView(APIView):
             )
 
 
+class ChatbotUsageView(APIView):
+    """Chatbot token and request usage for the current user and family"""
+
+    permission_classes = [IsAuthenticated]
+
+    @query_budget(0)
+    def get(self, request):
+        from utils.mongodb import mongodb_connection
+
+        user = request.user
+        quotas = settings.LLM_QUOTAS
+        try:
+            days = min(max(int(request.query_params.get("days", 7)), 1), 90)
+        except ValueError:
+            days = 7
+
+        def summary(scope, subject_id):
+            tokens, requests = usage_tracker.usage(scope, subject_id)
+            return {
+                "tokens": tokens,
+                "requests": requests,
+                "daily_token_quota": quotas.get(f"{scope}_daily_tokens"),
+                "daily_request_quota": quotas.get(f"{scope}_daily_requests"),
+            }
+
+        history = []
+        if user.family_id:
+            collection = mongodb_connection.get_collection(USAGE_COLLECTION)
+            cursor = (
+                collection.find(
+                    {"scope": "family", "subject_id": user.family_id},
+                    projection={"_id": 0, "day": 1, "tokens": 1, "requests": 1},
+                )
+                .sort("day", -1)
+                .limit(days)
+            )
+            history = list(cursor)
+
+        return Response(
+            {
+                "success": True,
+                "day": timezone.now().date().isoformat(),
+                "user": summary("user", user.id),
+                "family": summary("family", user.family_id)
+                if user.family_id
+                else None,
+                "family_history": history,
+            }
+        )
+
+
 class FirstNameView(APIView):
     """Extract just the first name from user's full name"""
 
     permission_classes = [IsAuthenticated]
 
+    @query_budget(0)
+    @profile_cache("first-name")
     def get(self, request):
         try:
             user = request.user
@@ -391,7 +646,7 @@ class FirstNameView(APIView):
             # Extract first name (first word before space)
             first_name = full_name.split()[0] if full_name.strip() else ""
 
-            logger.info(f"First name extracted for {user.username}: {first_name}")
+            logger.debug("First name extracted for %s: %s", user.username, first_name)
 
             return Response(
                 {
@@ -405,7 +660,7 @@ class FirstNameView(APIView):
 
         except Exception as e:
             logger.error(
-                f"Error extracting first name for user {request.user.username}: {str(e)}"
+                "Error extracting first name for user %s: %s", request.user.username, e
             )
             return Response(
                 {
@@ -423,6 +678,7 @@ class GenerateChildCodeView(APIView):
 
     permission_classes = [IsAuthenticated]
 
+    @query_budget(4)
     def post(self, request):
         serializer = GenerateChildCodeSerializer(
             data=request.data, context={"request": request}
@@ -438,8 +694,9 @@ class GenerateChildCodeView(APIView):
 
             # Log the action
             logger.info(
-                f"Child registration code generated by {request.user.username} "
-                f"for child {child_code.child_name}"
+                "Child registration code generated by %s for child %s",
+                request.user.username,
+                child_code.child_name,
             )
 
             return Response(
@@ -466,37 +723,38 @@ class GenerateChildCodeView(APIView):
             )
 
         except Exception as e:
-            logger.error(f"Failed to generate child registration code: {str(e)}")
+            logger.error("Failed to generate child registration code: %s", e)
             return Response(
                 {"success": False, "error": f"Failed to generate code: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
 
+def child_code_entry(code):
+    return {
+        "registration_code": code.registration_code,
+        "child_name": code.child_name,
+        "status": code.status,
+        "created_at": code.created_at,
+        "expires_at": code.expires_at,
+        "used_at": code.used_at,
+        "is_expired": code.is_expired,
+        "device_info": code.device_info,
+    }
+
+
 class MyChildCodesView(APIView):
     """Get child registration codes created by current user"""
 
     permission_classes = [IsAuthenticated]
 
+    @query_budget(1)
     def get(self, request):
         child_codes = ChildRegistrationCode.objects.filter(
-            created_by=request.user
+            created_by_id=request.user.id
         ).order_by("-created_at")
 
-        codes_list = []
-        for code in child_codes:
-            codes_list.append(
-                {
-                    "registration_code": code.registration_code,
-                    "child_name": code.child_name,
-                    "status": code.status,
-                    "created_at": code.created_at,
-                    "expires_at": code.expires_at,
-                    "used_at": code.used_at,
-                    "is_expired": code.is_expired,
-                    "device_info": code.device_info,
-                }
-            )
+        codes_list = [child_code_entry(code) for code in child_codes]
 
         return Response(
             {
@@ -516,6 +774,7 @@ class AcceptChildCodeView(APIView):
 
     permission_classes = [AllowAny]  # Device doesn't have parent authentication
 
+    @query_budget(2)
     def post(self, request):
         serializer = AcceptChildCodeSerializer(data=request.data)
         if not serializer.is_valid():
@@ -528,14 +787,27 @@ class AcceptChildCodeView(APIView):
             child_code = serializer.save()
 
             logger.info(
-                f"Device linked for child {child_code.child_name} "
-                f"using code {child_code.registration_code}"
+                "Device linked for child %s using code %s",
+                child_code.child_name,
+                child_code.registration_code,
+            )
+            device = child_code.device_info["actual_device"]
+            dispatcher.invalidate_roster(child_code.family_id)
+            notify(
+                child_code.family_id,
+                DEVICE_LINKED,
+                key=device["device_id"],
+                child=child_code.child_name,
+                device_name=device["device_name"],
             )
 
             return Response(
                 {
                     "success": True,
                     "message": f"Device successfully linked for {child_code.child_name}",
+                    # Shown once: the device sends it with every request as
+                    # "Authorization: Device <device_id>:<device_secret>"
+                    "device_secret": serializer.device_secret,
                     "device_registration": {
                         "child_name": child_code.child_name,
                         "family_id": child_code.family_id,
@@ -560,8 +832,607 @@ class AcceptChildCodeView(APIView):
             )
 
         except Exception as e:
-            logger.error(f"Failed to link device: {str(e)}")
+            logger.error("Failed to link device: %s", e)
             return Response(
                 {"success": False, "error": f"Failed to link device: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class LocationIngestView(APIView):
+    """Accept a batch of location pings from a linked child device"""
+
+    permission_classes = [IsLinkedDevice]
+    authentication_classes = [DeviceAuthentication]
+
+    @query_budget(0)
+    def post(self, request):
+        serializer = LocationBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        device = request.auth
+        if not device.enabled("location_tracking"):
+            return Response(
+                {"success": False, "error": "Location tracking is disabled"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        pings = serializer.validated_data["pings"]
+        stored, events = ingest_pings(device, pings)
+        for event in events:
+            notify(
+                device.family_id,
+                GEOFENCE_ENTER if event["event"] == "enter" else GEOFENCE_EXIT,
+                child_id=device.child_id,
+                key=f"{device.device_id}:{event['fence_id']}:"
+                f"{event['recorded_at'].isoformat()}",
+                fence_id=event["fence_id"],
+            )
+        return Response(
+            {
+                "success": True,
+                "received": len(pings),
+                "stored": stored,
+                "geofence_events": [
+                    {
+                        "fence_id": event["fence_id"],
+                        "event": event["event"],
+                        "recorded_at": event["recorded_at"],
+                    }
+                    for event in events
+                ],
+            }
+        )
+
+
+class DeviceHeartbeatView(APIView):
+    """Record that a linked child device is online"""
+
+    permission_classes = [IsLinkedDevice]
+    authentication_classes = [DeviceAuthentication]
+
+    @query_budget(0)
+    def post(self, request):
+        serializer = HeartbeatSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        data = serializer.validated_data
+        presence_tracker.heartbeat(
+            request.auth,
+            battery_level=data.get("battery_level"),
+            app_version=data.get("app_version"),
+            screen_on=data.get("screen_on"),
+        )
+        return Response(
+            {
+                "success": True,
+                "next_heartbeat_s": settings.PRESENCE["HEARTBEAT_INTERVAL"],
+            }
+        )
+
+
+class PushTokenView(APIView):
+    """Register (POST) or remove (DELETE) the user's push notification token"""
+
+    permission_classes = [IsAuthenticated]
+
+    @query_budget(0)
+    def post(self, request):
+        serializer = PushTokenSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        register_push_token(request.user, serializer.validated_data["token"])
+        return Response({"success": True}, status=status.HTTP_201_CREATED)
+
+    @query_budget(0)
+    def delete(self, request):
+        serializer = PushTokenSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        unregister_push_token(request.user, serializer.validated_data["token"])
+        return Response({"success": True})
+
+
+class FamilyPresenceView(APIView):
+    """Online/offline status of every device in the user's family"""
+
+    permission_classes = [IsAuthenticated]
+
+    @query_budget(0)
+    def get(self, request):
+        return Response(
+            {"success": True, "devices": family_presence(request.user.family_id)}
+        )
+
+
+class FamilyLocationsView(APIView):
+    """Last known location of every tracked device in the user's family"""
+
+    permission_classes = [IsAuthenticated]
+
+    @query_budget(0)
+    def get(self, request):
+        from utils.mongodb import mongodb_connection
+
+        collection = mongodb_connection.get_collection(DEVICE_STATES_COLLECTION)
+        devices = [
+            {
+                "device_id": state["_id"],
+                "child_id": state.get("child_id"),
+                "last_location": state["last_location"],
+                "inside_geofences": state.get("inside_geofences", []),
+            }
+            for state in collection.find(
+                {
+                    "family_id": request.user.family_id,
+                    "last_location": {"$exists": True},
+                },
+                projection={"child_id": 1, "last_location": 1, "inside_geofences": 1},
+            )
+        ]
+        return Response({"success": True, "devices": devices})
+
+
+class GeofenceListView(APIView):
+    """List or create the family's geofences (home, school...)"""
+
+    permission_classes = [IsAuthenticated]
+
+    @query_budget(0)
+    def get(self, request):
+        family = get_families_collection().find_one(
+            {"family_id": request.user.family_id},
+            projection={"_id": 0, "geofences": 1},
+        )
+        return Response(
+            {"success": True, "geofences": (family or {}).get("geofences", [])}
+        )
+
+    @query_budget(0)
+    def post(self, request):
+        serializer = GeofenceSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        data = serializer.validated_data
+        fence = add_geofence(
+            request.user.family_id,
+            data["name"],
+            data["type"],
+            data["lat"],
+            data["lng"],
+            data["radius_m"],
+        )
+        return Response(
+            {"success": True, "geofence": fence}, status=status.HTTP_201_CREATED
+        )
+
+
+class GeofenceDetailView(APIView):
+    """Delete one of the family's geofences"""
+
+    permission_classes = [IsAuthenticated]
+
+    @query_budget(0)
+    def delete(self, request, fence_id):
+        if not remove_geofence(request.user.family_id, fence_id):
+            return Response(
+                {"success": False, "error": "Geofence not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response({"success": True})
+
+
+class ChildMonitoringSettingsView(APIView):
+    """Update a child's monitoring flags (location tracking, bedtime mode...)"""
+
+    permission_classes = [IsAuthenticated]
+
+    @query_budget(0)
+    def patch(self, request, child_id):
+        serializer = MonitoringSettingsSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        collection = get_families_collection()
+        updates = {
+            f"children.$[child].monitoring_settings.{key}": value
+            for key, value in serializer.validated_data.items()
+        }
+        updates["updated_at"] = timezone.now()
+        result = collection.update_one(
+            {"family_id": request.user.family_id, "children.child_id": child_id},
+            {"$set": updates},
+            array_filters=[{"child.child_id": child_id}],
+        )
+        if not result.matched_count:
+            return Response(
+                {"success": False, "error": "Child not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        family = collection.find_one(
+            {"family_id": request.user.family_id},
+            projection={"children.child_id": 1, "children.devices.device_id": 1},
+        )
+        for child in family.get("children") or []:
+            if child.get("child_id") == child_id:
+                for device in child.get("devices") or []:
+                    invalidate_device(device.get("device_id"))
+        invalidate_policy(request.user.family_id, child_id)
+        return Response({"success": True, "updated": serializer.validated_data})
+
+
+def _child_app_rules(family_id, child_id):
+    """(rules, default action) of a child, or None if it isn't in the family"""
+    family = get_families_collection().find_one(
+        {"family_id": family_id},
+        projection={
+            "children.child_id": 1,
+            "children.app_rules": 1,
+            "children.app_policy_default": 1,
+        },
+    )
+    for child in (family or {}).get("children") or []:
+        if child.get("child_id") == child_id:
+            rules = child.get("app_rules") or []
+            return rules, child.get("app_policy_default", "allow")
+    return None
+
+
+class ChildAppRulesView(APIView):
+    """List, create/replace app rules of a child and set its default action"""
+
+    permission_classes = [IsAuthenticated]
+
+    @query_budget(0)
+    def get(self, request, child_id):
+        found = _child_app_rules(request.user.family_id, child_id)
+        if found is None:
+            return Response(
+                {"success": False, "error": "Child not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        rules, default = found
+        return Response({"success": True, "default": default, "rules": rules})
+
+    @query_budget(0)
+    def post(self, request, child_id):
+        serializer = AppRuleSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        data = serializer.validated_data
+        rule = put_rule(
+            request.user.family_id,
+            child_id,
+            data["app_id"],
+            data["action"],
+            data["windows"],
+        )
+        if rule is None:
+            return Response(
+                {"success": False, "error": "Child not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response({"success": True, "rule": rule}, status=status.HTTP_201_CREATED)
+
+    @query_budget(0)
+    def patch(self, request, child_id):
+        serializer = AppPolicyDefaultSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        default = serializer.validated_data["default"]
+        if not set_default(request.user.family_id, child_id, default):
+            return Response(
+                {"success": False, "error": "Child not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response({"success": True, "default": default})
+
+
+class ChildAppRuleDetailView(APIView):
+    """Delete one app rule of a child"""
+
+    permission_classes = [IsAuthenticated]
+
+    @query_budget(0)
+    def delete(self, request, child_id, rule_id):
+        if not delete_rule(request.user.family_id, child_id, rule_id):
+            return Response(
+                {"success": False, "error": "Rule not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response({"success": True})
+
+
+class DevicePolicyView(APIView):
+    """Compiled app policy snapshot for a device to evaluate locally"""
+
+    permission_classes = [IsLinkedDevice]
+    authentication_classes = [DeviceAuthentication]
+
+    @query_budget(0)
+    def get(self, request):
+        device = request.auth
+        policy = get_policy(device.family_id, device.child_id)
+        if policy is None:
+            return Response(
+                {"success": False, "error": "Device is not linked to a family"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        etag = quote_etag(policy.etag)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(
+                {"success": True, "version": policy.etag, "policy": policy.as_dict()}
+            )
+        response["ETag"] = etag
+        return response
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class DevicePolicyCheckView(APIView):
+    """Answer "may these apps run now?" for a device"""
+
+    permission_classes = [IsLinkedDevice]
+    authentication_classes = [DeviceAuthentication]
+
+    @query_budget(0)
+    def post(self, request):
+        serializer = AppCheckSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        data = serializer.validated_data
+        device = request.auth
+        policy = get_policy(device.family_id, device.child_id)
+        if policy is None:
+            return Response(
+                {"success": False, "error": "Device is not linked to a family"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        at = data.get("at") or timezone.now()
+        return Response(
+            {
+                "success": True,
+                "version": policy.etag,
+                "results": {
+                    app_id: policy.may_run(app_id, at) for app_id in data["app_ids"]
+                },
+            }
+        )
+
+
+class WeeklyDigestView(APIView):
+    """Precomputed weekly digest of the user's family (?week=YYYY-MM-DD)"""
+
+    permission_classes = [IsAuthenticated]
+
+    @query_budget(0)
+    def get(self, request):
+        week = request.query_params.get("week")
+        try:
+            week_start = date.fromisoformat(week) if week else None
+        except ValueError:
+            return Response(
+                {"success": False, "error": "week must be a YYYY-MM-DD date"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        digest = get_digest(request.user.family_id, week_start)
+        if digest is None:
+            return Response(
+                {"success": False, "error": "No digest available yet"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response({"success": True, "digest": digest})
+
+
+class FamilyExportView(APIView):
+    """
+    Stream a full export of the user's family.
+
+    ``?output=ndjson`` (default) streams records with periodic resume
+    cursors; pass the last one back as ``?cursor=`` to continue an
+    interrupted download. ``?output=zip`` streams a ZIP archive instead.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    @query_budget(0)
+    def get(self, request):
+        family_id = request.user.family_id
+        if not family_id:
+            return Response(
+                {"success": False, "error": "No family to export"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        output = request.query_params.get("output", "ndjson")
+        cursor = request.query_params.get("cursor")
+        if output not in ("ndjson", "zip"):
+            return Response(
+                {"success": False, "error": "output must be ndjson or zip"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if output == "zip":
+            if cursor:
+                return Response(
+                    {"success": False, "error": "Only ndjson exports can resume"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            response = StreamingHttpResponse(
+                zip_export(family_id), content_type="application/zip"
+            )
+        else:
+            try:
+                chunks = ndjson_export(family_id, cursor=cursor)
+            except ExportCursorError as exc:
+                return Response(
+                    {"success": False, "error": str(exc)},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            response = StreamingHttpResponse(
+                chunks, content_type="application/x-ndjson; charset=utf-8"
+            )
+
+        logger.info("Family export (%s) started by %s", output, request.user.username)
+        filename = f"family-{family_id}-export.{output}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        response["Cache-Control"] = "no-store"
+        return response
+
+
+class FamilyImportView(APIView):
+    """Bulk-onboard families from an uploaded CSV (staff only)"""
+
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    # Scales with the upload: a fixed handful of queries per batch
+    @query_budget(None, n_plus_one=False)
+    def post(self, request):
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response(
+                {"success": False, "error": "Upload the CSV as 'file'"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        importer = OnboardingImport(
+            source=upload.name, created_by=request.user.username
+        )
+        # Large uploads are spooled to disk; rows are read from it lazily
+        lines = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+        try:
+            summary = importer.run(lines)
+        except (ImportFormatError, UnicodeDecodeError, csv.Error) as exc:
+            return Response(
+                {"success": False, "job_id": importer.job_id, "error": str(exc)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        logger.info(
+            "Onboarding import %s by %s: %s rows, %s errors",
+            importer.job_id,
+            request.user.username,
+            summary["rows_done"],
+            summary["error_count"],
+        )
+        return Response({"success": True, **summary})
+
+
+class ImportJobView(APIView):
+    """Progress, counts and row errors of an onboarding import"""
+
+    permission_classes = [IsAdminUser]
+
+    @query_budget(0)
+    def get(self, request, job_id):
+        job = get_jobs_collection().find_one({"_id": job_id})
+        if job is None:
+            return Response(
+                {"success": False, "error": "Import job not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        job["job_id"] = job.pop("_id")
+        return Response({"success": True, "job": job})
+
+
+class ProfilingTokenView(APIView):
+    """Issue an X-Profile header value that profiles the requests sending it"""
+
+    permission_classes = [IsAdminUser]
+
+    @query_budget(0)
+    def post(self, request):
+        config = getattr(settings, "PROFILING", {})
+        if not config.get("ENABLED"):
+            return Response(
+                {"success": False, "error": "Profiling is disabled"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        memory = str(request.data.get("memory", "")).lower() in ("1", "true")
+        return Response(
+            {
+                "success": True,
+                "header": PROFILE_HEADER,
+                "token": issue_token(request.user, memory=memory),
+                "expires_in": config.get("TOKEN_MAX_AGE", 3600),
+            }
+        )
+
+
+class ProfileListView(APIView):
+    """Stored request profiles of this host, newest first"""
+
+    permission_classes = [IsAdminUser]
+
+    @query_budget(0)
+    def get(self, request):
+        return Response({"success": True, "profiles": list_profiles()})
+
+
+class ProfileDownloadView(APIView):
+    """Download one file (cpu, cpu_text, memory, memory_text) of a profile"""
+
+    permission_classes = [IsAdminUser]
+
+    @query_budget(0)
+    def get(self, request, profile_id, kind):
+        found = profile_file(profile_id, kind)
+        if found is None:
+            raise Http404("No such profile file")
+        path, content_type = found
+        return FileResponse(
+            open(path, "rb"),
+            as_attachment=True,
+            filename=path.name,
+            content_type=content_type,
+        )
+
+
+class MetricsView(APIView):
+    """Expose process metrics in Prometheus text format (local scrapers only)"""
+
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    @query_budget(0)
+    def get(self, request):
+        allowed_ips = getattr(settings, "METRICS_ALLOWED_IPS", ["127.0.0.1", "::1"])
+        if request.META.get("REMOTE_ADDR") not in allowed_ips:
+            raise Http404
+
+        return HttpResponse(
+            metrics.registry.render(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
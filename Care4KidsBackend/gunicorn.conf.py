@@ -0,0 +1,28 @@
+# gunicorn.conf.py
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+wsgi_app = "Care4Kids.wsgi:application"
+
+# Import Django, the URLconf and every view once in the master so forked
+# workers start with warm modules and only have to open their own sockets.
+# MongoDB and Gemini clients are created lazily, after the fork.
+preload_app = True
+
+
+def when_ready(server):
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns
+
+
+def post_fork(server, worker):
+    from django.db import connections
+
+    # Never share sockets inherited from the master
+    connections.close_all()
+    from utils.mongodb import mongodb_connection
+
+    mongodb_connection.close()
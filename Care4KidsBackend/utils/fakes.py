@@ -0,0 +1,503 @@
+# utils/fakes.py
+"""Local stand-ins for MongoDB and Gemini used by benchmarks and development"""
+import copy
+import itertools
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+_MISSING = object()
+
+
+def _get_path(document, path):
+    """Resolve a dotted path, fanning out over arrays like MongoDB does"""
+    values = [document]
+    for part in path.split("."):
+        next_values = []
+        for value in values:
+            if isinstance(value, list):
+                if part.isdigit() and int(part) < len(value):
+                    next_values.append(value[int(part)])
+                    continue
+                next_values.extend(
+                    item[part]
+                    for item in value
+                    if isinstance(item, dict) and part in item
+                )
+            elif isinstance(value, dict) and part in value:
+                next_values.append(value[part])
+        values = next_values
+    return values
+
+
+def _candidates(values):
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+
+def _compare(op, candidate, operand):
+    try:
+        if op == "$gt":
+            return candidate > operand
+        if op == "$gte":
+            return candidate >= operand
+        if op == "$lt":
+            return candidate < operand
+        if op == "$lte":
+            return candidate <= operand
+    except TypeError:
+        return False
+    raise NotImplementedError(f"Unsupported query operator {op}")
+
+
+def _match_condition(values, condition):
+    if isinstance(condition, dict) and condition and all(
+        key.startswith("$") for key in condition
+    ):
+        for op, operand in condition.items():
+            if op == "$exists":
+                if bool(values) != bool(operand):
+                    return False
+            elif op == "$in":
+                if not any(c in operand for c in _candidates(values)):
+                    return False
+            elif op == "$nin":
+                if any(c in operand for c in _candidates(values)):
+                    return False
+            elif op == "$ne":
+                if any(c == operand for c in _candidates(values)):
+                    return False
+            elif op == "$elemMatch":
+                if not any(
+                    isinstance(item, dict) and matches(item, operand)
+                    for value in values
+                    if isinstance(value, list)
+                    for item in value
+                ):
+                    return False
+            elif not any(_compare(op, c, operand) for c in _candidates(values)):
+                return False
+        return True
+    if condition is None:
+        return not values or any(c is None for c in _candidates(values))
+    return any(c == condition for c in _candidates(values))
+
+
+def matches(document, query):
+    """Evaluate the subset of the MongoDB query language used by the app"""
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(document, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(document, sub) for sub in condition):
+                return False
+        elif not _match_condition(_get_path(document, key), condition):
+            return False
+    return True
+
+
+def _set_path(document, path, value):
+    parts = path.split(".")
+    target = document
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            target = target[int(part)]
+        else:
+            target = target.setdefault(part, {})
+    if isinstance(target, list):
+        target[int(parts[-1])] = value
+    else:
+        target[parts[-1]] = value
+
+
+def _get_single(document, path, default=_MISSING):
+    target = document
+    for part in path.split("."):
+        if isinstance(target, list) and part.isdigit():
+            target = target[int(part)]
+        elif isinstance(target, dict) and part in target:
+            target = target[part]
+        else:
+            return default
+    return target
+
+
+def _element_filter(identifier, array_filters):
+    query = {}
+    for array_filter in array_filters or []:
+        for key, condition in array_filter.items():
+            name, _, rest = key.partition(".")
+            if name == identifier:
+                query[rest] = condition
+    return query
+
+
+def _expand_paths(document, path, array_filters):
+    """Resolve $[identifier] / $[] segments into concrete dotted paths"""
+    paths = [([], document)]
+    for part in path.split("."):
+        expanded = []
+        for prefix, target in paths:
+            if part.startswith("$[") and part.endswith("]"):
+                if not isinstance(target, list):
+                    continue
+                query = _element_filter(part[2:-1], array_filters)
+                for index, item in enumerate(target):
+                    if not query or (
+                        matches(item, {k: v for k, v in query.items() if k})
+                        and ("" not in query or _match_condition([item], query[""]))
+                    ):
+                        expanded.append((prefix + [str(index)], item))
+            else:
+                if isinstance(target, list) and part.isdigit():
+                    child = target[int(part)] if int(part) < len(target) else None
+                elif isinstance(target, dict):
+                    child = target.get(part)
+                else:
+                    child = None
+                expanded.append((prefix + [part], child))
+        paths = expanded
+    return [".".join(prefix) for prefix, _ in paths]
+
+
+def _apply_update(document, update, inserting=False, array_filters=None):
+    for op, fields in update.items():
+        for raw_path, value in fields.items():
+            if "$[" in raw_path:
+                paths = _expand_paths(document, raw_path, array_filters)
+                for path in paths:
+                    _apply_update(document, {op: {path: value}}, inserting)
+                continue
+            path = raw_path
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                _set_path(document, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                continue
+            elif op == "$unset":
+                parent, _, leaf = path.rpartition(".")
+                target = _get_single(document, parent) if parent else document
+                if isinstance(target, dict):
+                    target.pop(leaf, None)
+            elif op == "$inc":
+                _set_path(document, path, _get_single(document, path, 0) + value)
+            elif op == "$max":
+                current = _get_single(document, path, None)
+                if current is None or value > current:
+                    _set_path(document, path, value)
+            elif op in ("$push", "$addToSet"):
+                current = _get_single(document, path, None)
+                if current is None:
+                    current = []
+                    _set_path(document, path, current)
+                items = (
+                    value["$each"]
+                    if isinstance(value, dict) and "$each" in value
+                    else [value]
+                )
+                for item in items:
+                    if op == "$addToSet" and item in current:
+                        continue
+                    current.append(copy.deepcopy(item))
+            elif op == "$pull":
+                current = _get_single(document, path, None)
+                if isinstance(current, list):
+                    current[:] = [
+                        item
+                        for item in current
+                        if not (
+                            matches(item, value)
+                            if isinstance(value, dict) and isinstance(item, dict)
+                            else _match_condition([item], value)
+                            if isinstance(value, dict)
+                            else item == value
+                        )
+                    ]
+            else:
+                raise NotImplementedError(f"Unsupported update operator {op}")
+
+
+def _project(document, projection):
+    if not projection:
+        return copy.deepcopy(document)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include = {k for k, v in projection.items() if v and k != "_id"}
+    exclude = {k for k, v in projection.items() if not v and k != "_id"}
+    if include:
+        result = {}
+        for path in include:
+            _copy_path(document, result, path.split("."))
+    else:
+        result = copy.deepcopy(document)
+        for path in exclude:
+            _drop_path(result, path.split("."))
+    if projection.get("_id", 1) and "_id" in document:
+        result["_id"] = document["_id"]
+    else:
+        result.pop("_id", None)
+    return result
+
+
+def _drop_path(target, parts):
+    if isinstance(target, list):
+        for item in target:
+            _drop_path(item, parts)
+    elif isinstance(target, dict):
+        if len(parts) == 1:
+            target.pop(parts[0], None)
+        elif parts[0] in target:
+            _drop_path(target[parts[0]], parts[1:])
+
+
+def _copy_path(source, target, parts):
+    head, rest = parts[0], parts[1:]
+    if head not in source:
+        return
+    value = source[head]
+    if not rest:
+        target[head] = copy.deepcopy(value)
+    elif isinstance(value, list):
+        items = target.setdefault(head, [{} for _ in value])
+        for item, projected in zip(value, items):
+            if isinstance(item, dict):
+                _copy_path(item, projected, rest)
+    elif isinstance(value, dict):
+        _copy_path(value, target.setdefault(head, {}), rest)
+
+
+def _sort_key(value):
+    # MongoDB orders missing/null values before everything else
+    return (value is not None, value)
+
+
+class InMemoryCursor:
+    def __init__(self, documents):
+        self._documents = documents
+
+    def sort(self, key_or_list, direction=1):
+        keys = key_or_list
+        if not isinstance(keys, list):
+            keys = [(key_or_list, direction)]
+        for key, key_direction in reversed(keys):
+            self._documents.sort(
+                key=lambda doc: _sort_key(_get_single(doc, key, None)),
+                reverse=key_direction < 0,
+            )
+        return self
+
+    def limit(self, count):
+        if count:
+            self._documents = self._documents[:count]
+        return self
+
+    def skip(self, count):
+        self._documents = self._documents[count:]
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        return iter(self._documents)
+
+
+class InMemoryCollection:
+    """Thread-safe subset of pymongo's Collection API backed by a list"""
+
+    def __init__(self, name):
+        self.name = name
+        self._documents = []
+        self._lock = threading.Lock()
+
+    def insert_one(self, document):
+        document.setdefault("_id", uuid.uuid4().hex)
+        with self._lock:
+            self._documents.append(copy.deepcopy(document))
+        return SimpleNamespace(inserted_id=document["_id"], acknowledged=True)
+
+    def insert_many(self, documents, ordered=True):
+        ids = [self.insert_one(document).inserted_id for document in documents]
+        return SimpleNamespace(inserted_ids=ids, acknowledged=True)
+
+    def find(self, filter=None, projection=None, sort=None, limit=0, **kwargs):
+        with self._lock:
+            documents = [
+                _project(doc, projection)
+                for doc in self._documents
+                if matches(doc, filter)
+            ]
+        cursor = InMemoryCursor(documents)
+        if sort:
+            cursor.sort(sort)
+        return cursor.limit(limit)
+
+    def find_one(self, filter=None, projection=None, **kwargs):
+        return next(iter(self.find(filter, projection, limit=1, **kwargs)), None)
+
+    def count_documents(self, filter, **kwargs):
+        with self._lock:
+            return sum(1 for doc in self._documents if matches(doc, filter))
+
+    def _update(self, filter, update, upsert, many, array_filters=None):
+        matched = modified = 0
+        upserted_id = None
+        with self._lock:
+            for document in self._documents:
+                if matches(document, filter):
+                    _apply_update(document, update, array_filters=array_filters)
+                    matched += 1
+                    modified += 1
+                    if not many:
+                        break
+            if not matched and upsert:
+                document = {
+                    key: value
+                    for key, value in (filter or {}).items()
+                    if not key.startswith("$") and not isinstance(value, dict)
+                }
+                upserted_id = document.setdefault("_id", uuid.uuid4().hex)
+                _apply_update(document, update, inserting=True)
+                self._documents.append(document)
+        return SimpleNamespace(
+            matched_count=matched,
+            modified_count=modified,
+            upserted_id=upserted_id,
+            acknowledged=True,
+        )
+
+    def update_one(self, filter, update, upsert=False, array_filters=None, **kwargs):
+        return self._update(filter, update, upsert, False, array_filters)
+
+    def update_many(self, filter, update, upsert=False, array_filters=None, **kwargs):
+        return self._update(filter, update, upsert, True, array_filters)
+
+    def delete_many(self, filter):
+        with self._lock:
+            before = len(self._documents)
+            self._documents = [d for d in self._documents if not matches(d, filter)]
+            return SimpleNamespace(deleted_count=before - len(self._documents))
+
+    def delete_one(self, filter):
+        with self._lock:
+            for index, document in enumerate(self._documents):
+                if matches(document, filter):
+                    del self._documents[index]
+                    return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    def bulk_write(self, requests, ordered=True):
+        """Apply pymongo InsertOne/UpdateOne/UpdateMany/DeleteOne/DeleteMany ops"""
+        counts = dict(inserted_count=0, matched_count=0, modified_count=0)
+        counts.update(upserted_count=0, deleted_count=0)
+        for request in requests:
+            kind = type(request).__name__
+            if kind == "InsertOne":
+                self.insert_one(request._doc)
+                counts["inserted_count"] += 1
+            elif kind in ("UpdateOne", "UpdateMany", "ReplaceOne"):
+                update = request._doc
+                if kind == "ReplaceOne":
+                    update = {"$set": request._doc}
+                result = self._update(
+                    request._filter,
+                    update,
+                    request._upsert,
+                    kind == "UpdateMany",
+                    getattr(request, "_array_filters", None),
+                )
+                counts["matched_count"] += result.matched_count
+                counts["modified_count"] += result.modified_count
+                counts["upserted_count"] += result.upserted_id is not None
+            elif kind in ("DeleteOne", "DeleteMany"):
+                delete = self.delete_one if kind == "DeleteOne" else self.delete_many
+                counts["deleted_count"] += delete(request._filter).deleted_count
+            else:
+                raise NotImplementedError(f"Unsupported bulk operation {kind}")
+        return SimpleNamespace(acknowledged=True, **counts)
+
+    def create_index(self, keys, **kwargs):
+        if not isinstance(keys, list):
+            keys = [(keys, 1)]
+        return kwargs.get("name") or "_".join(f"{k}_{d}" for k, d in keys)
+
+
+class InMemoryDatabase:
+    def __init__(self, name):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = InMemoryCollection(name)
+            return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def command(self, name, *args, **kwargs):
+        return {"ok": 1.0}
+
+    def list_collection_names(self):
+        return list(self._collections)
+
+
+class InMemoryMongoClient:
+    """Drop-in for pymongo.MongoClient selected via MONGODB_SETTINGS["client_class"]"""
+
+    def __init__(self, *args, **kwargs):
+        self._databases = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = InMemoryDatabase(name)
+            return self._databases[name]
+
+    @property
+    def admin(self):
+        return self["admin"]
+
+    def close(self):
+        pass
+
+
+class FakeGenerativeModel:
+    """Stand-in for genai.GenerativeModel with configurable latency and failures"""
+
+    def __init__(self, model_name="fake", latency=0.0, text=None, fail_every=0):
+        self.model_name = model_name
+        self.latency = latency
+        self.text = text or "Respuesta de prueba del asistente familiar."
+        self.fail_every = fail_every
+        self.calls = 0
+        self._counter = itertools.count(1)
+
+    def generate_content(self, prompt, **kwargs):
+        call_number = next(self._counter)
+        self.calls = call_number
+        if self.latency:
+            time.sleep(self.latency() if callable(self.latency) else self.latency)
+        if self.fail_every and call_number % self.fail_every == 0:
+            raise RuntimeError("Injected fake model failure")
+        prompt_tokens = max(1, len(str(prompt)) // 4)
+        output_tokens = max(1, len(self.text) // 4)
+        return SimpleNamespace(
+            text=self.text,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=output_tokens,
+                total_token_count=prompt_tokens + output_tokens,
+            ),
+        )
@@ -0,0 +1,302 @@
+# utils/gemini.py
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+GEMINI_EVENTS = metrics.registry.counter(
+    "gemini_resilience_events_total",
+    "Coalesced, hedged, timed-out and short-circuited Gemini calls",
+    ["event"],
+)
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def timed_generate(model, prompt):
+    """Call generate_content and record its duration"""
+    started = time.perf_counter()
+    try:
+        response = model.generate_content(prompt)
+    except Exception:
+        metrics.GEMINI_REQUEST_DURATION.observe(
+            time.perf_counter() - started, outcome="error"
+        )
+        raise
+    metrics.GEMINI_REQUEST_DURATION.observe(
+        time.perf_counter() - started, outcome="success"
+    )
+    return response
+
+
+class TimedModel:
+    """Plain pass-through used when GEMINI_RESILIENCE is disabled"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def generate_content(self, prompt):
+        return timed_generate(self.model, prompt)
+
+
+class GeminiUnavailable(Exception):
+    """The model can't answer in time; callers should reply with a fallback"""
+
+
+class DeadlineExceeded(GeminiUnavailable):
+    pass
+
+
+class CircuitOpen(GeminiUnavailable):
+    pass
+
+
+class Overloaded(GeminiUnavailable):
+    """Too many calls are already queued for Gemini"""
+
+
+class CircuitBreaker:
+    """Open after consecutive failures, then let one probe through per reset_timeout"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def release_probe(self):
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(
+                        "Gemini circuit opened after %d failures", self.failures
+                    )
+                self.opened_at = self.clock()
+            self._probing = False
+
+
+class ResilientModel:
+    """
+    Wrap a model client (anything with generate_content) so that identical
+    in-flight prompts share one upstream call, every call has a deadline,
+    repeated failures open a circuit breaker, and optionally a second
+    attempt is hedged once the first is slower than a latency percentile.
+
+    At most ``max_concurrency`` attempts run and ``max_queue`` wait; beyond
+    that calls fail at once with Overloaded. Attempts still queued at their
+    deadline are cancelled, so abandoned calls never reach Gemini. Every
+    failure surfaces as GeminiUnavailable.
+    """
+
+    def __init__(
+        self,
+        model,
+        timeout=10.0,
+        max_concurrency=16,
+        max_queue=32,
+        breaker=None,
+        hedge_percentile=None,
+        hedge_min_samples=50,
+        latency_window=500,
+    ):
+        self.model = model
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies = deque(maxlen=latency_window)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # Bounds upstream concurrency; slow calls queue here instead of
+        # holding request workers past their deadline
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="gemini"
+        )
+        # One slot per running or queued attempt
+        self._slots = threading.BoundedSemaphore(max_concurrency + max_queue)
+
+    def generate_content(self, prompt):
+        key = hashlib.sha256(str(prompt).encode()).hexdigest()
+        with self._lock:
+            shared = self._inflight.get(key)
+            leader = shared is None
+            if leader:
+                shared = self._inflight[key] = Future()
+        if not leader:
+            GEMINI_EVENTS.inc(event="coalesced")
+            try:
+                return shared.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                raise DeadlineExceeded("Timed out waiting for a shared Gemini call")
+
+        try:
+            shared.set_result(self._lead(prompt))
+        except Exception as e:
+            shared.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return shared.result()
+
+    def _lead(self, prompt):
+        if not self.breaker.allow():
+            GEMINI_EVENTS.inc(event="circuit_open")
+            raise CircuitOpen("Gemini circuit breaker is open")
+
+        deadline = time.monotonic() + self.timeout
+        first = self._submit(prompt, deadline)
+        if first is None:
+            # Not an upstream failure: leave the breaker alone, but let the
+            # next caller probe if this one was the half-open probe
+            self.breaker.release_probe()
+            GEMINI_EVENTS.inc(event="overloaded")
+            raise Overloaded("Too many Gemini calls queued")
+        attempts = [first]
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None and hedge_delay < self.timeout:
+            done, _ = wait(attempts, timeout=hedge_delay)
+            if not done:
+                hedge = self._submit(prompt, deadline)
+                if hedge is not None:
+                    GEMINI_EVENTS.inc(event="hedged")
+                    attempts.append(hedge)
+
+        # First successful attempt wins; fail only once all attempts failed.
+        # The breaker sees one outcome per call, however many attempts it took
+        pending = set(attempts)
+        error = None
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = wait(
+                    pending, timeout=remaining, return_when=FIRST_COMPLETED
+                )
+                for attempt in done:
+                    if attempt.exception() is None:
+                        self.breaker.record_success()
+                        return attempt.result()
+                    error = attempt.exception()
+        finally:
+            for attempt in pending:
+                attempt.cancel()
+
+        self.breaker.record_failure()
+        if not pending:
+            raise GeminiUnavailable(f"Gemini call failed: {error}") from error
+        GEMINI_EVENTS.inc(event="deadline")
+        raise DeadlineExceeded(f"Gemini did not answer within {self.timeout}s")
+
+    def _submit(self, prompt, deadline):
+        """Queue an attempt, or return None if the queue is full"""
+        if not self._slots.acquire(blocking=False):
+            return None
+        attempt = self._executor.submit(self._call, prompt, deadline)
+        attempt.add_done_callback(lambda _: self._slots.release())
+        return attempt
+
+    def _call(self, prompt, deadline):
+        if time.monotonic() >= deadline:
+            # Waited in the queue past the caller's deadline
+            raise DeadlineExceeded("Gemini call expired in the queue")
+        started = time.perf_counter()
+        response = timed_generate(self.model, prompt)
+        self._latencies.append(time.perf_counter() - started)
+        return response
+
+    def _hedge_delay(self):
+        if self.hedge_percentile is None:
+            return None
+        samples = sorted(self._latencies)
+        if len(samples) < self.hedge_min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))
+        return samples[index]
+
+
+def build_gemini_model(model_name):
+    """Default GEMINI_MODEL_FACTORY: a configured genai.GenerativeModel"""
+    # The SDK pulls in grpc and protobuf; importing it here keeps it off the
+    # startup path of processes that never call the chatbot
+    import google.generativeai as genai
+
+    if not settings.GEMINI_API_KEY:
+        raise ImproperlyConfigured("GEMINI_API_KEY environment variable is not set")
+    genai.configure(api_key=settings.GEMINI_API_KEY)
+    return genai.GenerativeModel(model_name)
+
+
+def wrap_model(model):
+    """Apply settings.GEMINI_RESILIENCE to a raw model client"""
+    config = dict(getattr(settings, "GEMINI_RESILIENCE", {}))
+    if not config.pop("enabled", True):
+        return TimedModel(model)
+    breaker = CircuitBreaker(
+        failure_threshold=config.pop("failure_threshold", 5),
+        reset_timeout=config.pop("reset_timeout", 30.0),
+    )
+    return ResilientModel(model, breaker=breaker, **config)
+
+
+def get_model():
+    """Return the process-wide model client, building it on first use"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                factory = import_string(settings.GEMINI_MODEL_FACTORY)
+                _model = wrap_model(factory(settings.GEMINI_MODEL_NAME))
+    return _model
+
+
+def reset_model(model=None):
+    """Replace the cached client, or drop it so get_model() rebuilds it from settings"""
+    global _model
+    with _model_lock:
+        _model = wrap_model(model) if model is not None else None
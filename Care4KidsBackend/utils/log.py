@@ -0,0 +1,108 @@
+# utils/log.py
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from utils import metrics
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+LOG_RECORDS_DROPPED = metrics.registry.counter(
+    "log_records_dropped_total",
+    "Log records discarded because the logging queue was busy or full",
+    ["reason"],
+)
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "request_id"}
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request ID before they leave the thread"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any `extra` fields"""
+
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            payload["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Hand records to a background writer through a bounded queue.
+
+    Callers never block: once the queue is past ``sample_above`` (a fraction
+    of ``maxsize``) only ``sample_rate`` of records below WARNING are kept,
+    and records that still don't fit are dropped and counted. Messages are
+    formatted on the writer thread, so ``%``-style args should be values
+    that are safe to render later.
+    """
+
+    def __init__(self, maxsize=10000, sample_above=0.8, sample_rate=0.1):
+        self.maxsize = maxsize
+        self.high_watermark = int(maxsize * sample_above)
+        self.sample_rate = sample_rate
+        self.target = logging.StreamHandler()
+        super().__init__(queue.Queue(maxsize))
+        self._start_listener()
+        atexit.register(self._stop_listener)
+        # The writer thread doesn't survive fork (e.g. gunicorn preload_app)
+        os.register_at_fork(after_in_child=self._restart_in_child)
+
+    def _start_listener(self):
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def _stop_listener(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def _restart_in_child(self):
+        self.queue = queue.Queue(self.maxsize)
+        self._start_listener()
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the writer thread, not the caller's
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Skip QueueHandler's eager formatting; the target formats lazily
+        return record
+
+    def enqueue(self, record):
+        if (
+            record.levelno < logging.WARNING
+            and self.queue.qsize() >= self.high_watermark
+            and random.random() >= self.sample_rate
+        ):
+            LOG_RECORDS_DROPPED.inc(reason="sampled")
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(reason="queue_full")
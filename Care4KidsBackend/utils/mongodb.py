@@ -1,53 +1,97 @@
 # utils/mongodb.py
 import logging
+import threading
 
 from django.conf import settings
-from pymongo import MongoClient
+from django.utils.module_loading import import_string
+from pymongo import MongoClient, monitoring
+
+from utils import metrics
 
 logger = logging.getLogger(__name__)
 
 
+class CommandMetricsListener(monitoring.CommandListener):
+    """Feed MongoDB command counts and durations into the metrics registry"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        metrics.MONGO_COMMANDS.inc(command=event.command_name, outcome="success")
+        metrics.MONGO_COMMAND_DURATION.observe(
+            event.duration_micros / 1_000_000, command=event.command_name
+        )
+
+    def failed(self, event):
+        metrics.MONGO_COMMANDS.inc(command=event.command_name, outcome="failure")
+        metrics.MONGO_COMMAND_DURATION.observe(
+            event.duration_micros / 1_000_000, command=event.command_name
+        )
+
+
 class MongoDBConnection:
+    """Process-wide MongoDB handle that connects on first use, not at import"""
+
     _instance = None
     _client = None
     _database = None
+    _lock = threading.Lock()
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __init__(self):
-        if self._client is None:
-            self.connect()
-
-    def connect(self):
+    def connect(self, ping=True):
         try:
             # Simple connection since no auth is required
             mongodb_settings = settings.MONGODB_SETTINGS
             connection_string = f"mongodb://{mongodb_settings['host']}:{mongodb_settings['port']}/{mongodb_settings['database']}"
 
-            self._client = MongoClient(connection_string)
-            self._database = self._client[mongodb_settings["database"]]
+            event_listeners = []
+            if getattr(settings, "METRICS_ENABLED", True):
+                event_listeners.append(CommandMetricsListener())
+
+            # Allows swapping in a local stand-in (e.g. utils.fakes.InMemoryMongoClient)
+            client_class = MongoClient
+            if mongodb_settings.get("client_class"):
+                client_class = import_string(mongodb_settings["client_class"])
 
-            # Test connection
-            self._client.admin.command("ping")
-            logger.info(f"Successfully connected to MongoDB test database")
+            client = client_class(connection_string, event_listeners=event_listeners)
+            database = client[mongodb_settings["database"]]
+
+            if ping:
+                client.admin.command("ping")
+            self._client, self._database = client, database
+            logger.info("Connected to MongoDB database %s", mongodb_settings["database"])
 
         except Exception as e:
-            logger.error(f"Failed to connect to MongoDB: {e}")
+            logger.error("Failed to connect to MongoDB: %s", e)
             raise
 
+    def _ensure_connected(self):
+        if self._database is None:
+            with self._lock:
+                if self._database is None:
+                    # MongoClient connects in the background; the first real
+                    # command surfaces any connection error
+                    self.connect(ping=False)
+
     def get_database(self):
+        self._ensure_connected()
         return self._database
 
     def get_collection(self, collection_name):
-        return self._database[collection_name]
+        return self.get_database()[collection_name]
 
     def close(self):
+        """Close the client; the next get_database() reconnects (e.g. after fork)"""
         if self._client:
             self._client.close()
+        self._client = None
+        self._database = None
 
 
-# Create singleton instance
+# Create singleton instance (no network I/O happens until first use)
 mongodb_connection = MongoDBConnection()
@@ -0,0 +1,63 @@
+# utils/periodic.py
+import atexit
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """
+    Run ``func`` every ``interval`` seconds on a daemon thread.
+
+    The thread starts on the first start() call (not at import, so it is
+    created in each forked worker rather than in a preloading master) and
+    ``func`` runs once more at interpreter exit to flush buffered state.
+    """
+
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name=self.name, daemon=True
+                )
+                self._thread.start()
+
+    def stop(self, run_final=True):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join(timeout=self.interval + 5)
+        self._thread = None
+        if run_final:
+            self.run_once()
+
+    def run_once(self):
+        try:
+            self.func()
+        except Exception:
+            logger.exception("Periodic task %s failed", self.name)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def _reset_after_fork(self):
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
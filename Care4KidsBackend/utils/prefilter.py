@@ -0,0 +1,249 @@
+# utils/prefilter.py
+import re
+import unicodedata
+from collections import deque
+
+from utils import metrics
+
+PREFILTER_RESULTS = metrics.registry.counter(
+    "chatbot_prefilter_total",
+    "Chatbot messages by local pre-filter outcome",
+    ["intent"],
+)
+
+# intent -> (phrases, kind):
+#   "support" - first-person self-harm: answered with helpline information
+#       whatever else the message says
+#   "block" - first-person requests for dangerous help: refused, unless the
+#       message is about someone else ("context", e.g. a parent asking what
+#       to do), then sent to the model with SAFETY_CONTEXT
+#   "sensitive" - risky topics: sent to the model with SAFETY_CONTEXT
+#   "canned" - only answer messages that say nothing else
+PATTERNS = {
+    "self_harm": (
+        [
+            "suicidarme",
+            "quitarme la vida",
+            "hacerme dano",
+            "me quiero matar",
+            "me voy a matar",
+            "quiero morirme",
+            "no quiero vivir",
+        ],
+        "support",
+    ),
+    "unsafe": (
+        [
+            "como hago una bomba",
+            "quiero hacer una bomba",
+            "como fabrico un arma",
+            "quiero fabricar un arma",
+            "quiero comprar drogas",
+            "donde compro drogas",
+            "donde puedo comprar drogas",
+        ],
+        "block",
+    ),
+    "sensitive": (
+        [
+            "drogas",
+            "bomba",
+            "arma",
+            "armas",
+            "suicidio",
+            "suicidarse",
+            "quitarse la vida",
+            "hacerse dano",
+            "autolesion",
+            "autolesiones",
+        ],
+        "sensitive",
+    ),
+    "concern": (
+        [
+            "mi hijo",
+            "mi hija",
+            "mis hijos",
+            "mis hijas",
+            "que hago",
+            "que debo hacer",
+            "como le hablo",
+            "como prevenir",
+            "como evito",
+            "me preocupa",
+            "estoy preocupado",
+            "estoy preocupada",
+        ],
+        "context",
+    ),
+    "greeting": (
+        ["hola", "buenos dias", "buenas tardes", "buenas noches", "hey", "saludos"],
+        "canned",
+    ),
+    "thanks": (
+        ["gracias", "muchas gracias", "mil gracias", "te lo agradezco"],
+        "canned",
+    ),
+    "farewell": (
+        ["adios", "hasta luego", "nos vemos", "chao", "hasta manana"],
+        "canned",
+    ),
+    "acknowledgement": (
+        ["ok", "vale", "perfecto", "genial", "entendido", "de acuerdo", "muy bien"],
+        "canned",
+    ),
+}
+
+# A risky topic the model may answer, as guidance for a worried parent
+SENSITIVE = "sensitive"
+
+SAFETY_CONTEXT = """
+El mensaje trata un tema delicado (drogas, armas o autolesiones). Responde
+como orientación para una madre o un padre preocupado: no des instrucciones
+peligrosas, propone pasos prácticos para hablar con el menor y protegerlo,
+y recomienda buscar ayuda profesional o llamar a emergencias si hay peligro
+inmediato.
+"""
+
+RESPONSES = {
+    "self_harm": (
+        "Siento mucho que estés pasando por esto y gracias por contarlo. No "
+        "tienes que afrontarlo solo: si tú o alguien de tu familia piensa en "
+        "hacerse daño, habla ahora con una línea de ayuda en crisis (por "
+        "ejemplo, el 024 en España, la Línea de la Vida 800 911 2000 en México "
+        "o el 988 en Estados Unidos). Si hay peligro inmediato, llama al número "
+        "de emergencias de tu país."
+    ),
+    "unsafe": (
+        "Lo siento, no puedo ayudar con eso. Si tú o alguien de tu familia "
+        "está en peligro, llama al número de emergencias de tu país o a una "
+        "línea de ayuda en crisis."
+    ),
+    "greeting": "¡Hola, {first_name}! ¿En qué puedo ayudarte hoy con tu familia?",
+    "thanks": "¡Con gusto, {first_name}! Aquí estoy si necesitas algo más.",
+    "farewell": "¡Hasta pronto, {first_name}! Que tengas un gran día en familia.",
+    "acknowledgement": "Perfecto. Si tienes otra pregunta, aquí estoy.",
+}
+
+
+def normalize(text):
+    """Lowercase, strip accents and collapse non-word characters to spaces"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.findall(r"\w+", text))
+
+
+class PhraseMatcher:
+    """
+    Aho-Corasick automaton over normalized phrases.
+
+    Scans a message once, in time linear in its length regardless of the
+    number of phrases, and reports (start, end, intent) for every phrase
+    occurrence that falls on word boundaries.
+    """
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for intent, (phrases, _) in patterns.items():
+            for phrase in phrases:
+                self._add(normalize(phrase), intent)
+        self._build()
+
+    def _add(self, phrase, intent):
+        state = 0
+        for ch in phrase:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((len(phrase), intent))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(ch, 0)
+                if self._fail[next_state] == next_state:
+                    self._fail[next_state] = 0
+                self._output[next_state] = (
+                    self._output[next_state] + self._output[self._fail[next_state]]
+                )
+
+    def find(self, text):
+        state = 0
+        for index, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for length, intent in self._output[state]:
+                start, end = index - length + 1, index + 1
+                if (start == 0 or text[start - 1] == " ") and (
+                    end == len(text) or text[end] == " "
+                ):
+                    yield start, end, intent
+
+
+class MessagePrefilter:
+    """Answer self-harm, blocked and trivial chatbot messages without Gemini"""
+
+    def __init__(self, patterns=PATTERNS, responses=RESPONSES, max_leftover_words=1):
+        self.kinds = {intent: kind for intent, (_, kind) in patterns.items()}
+        self.responses = responses
+        self.max_leftover_words = max_leftover_words
+        self.matcher = PhraseMatcher(patterns)
+
+    def classify(self, message):
+        """
+        Return the matched intent: one with a local answer, SENSITIVE for a
+        message the model answers with SAFETY_CONTEXT, or None
+        """
+        text = normalize(message)
+        covered = [False] * len(text)
+        canned = None
+        flagged = {}
+        for start, end, intent in self.matcher.find(text):
+            kind = self.kinds[intent]
+            if kind != "canned":
+                flagged.setdefault(kind, intent)
+                continue
+            canned = canned or intent
+            covered[start:end] = [True] * (end - start)
+        if "support" in flagged:
+            return flagged["support"]
+        if "block" in flagged and "context" not in flagged:
+            return flagged["block"]
+        if "block" in flagged or "sensitive" in flagged:
+            return SENSITIVE
+        if canned is None:
+            return None
+        leftover = "".join(" " if hit else ch for ch, hit in zip(text, covered))
+        if len(leftover.split()) > self.max_leftover_words:
+            return None
+        return canned
+
+    def respond(self, message, first_name=""):
+        """
+        Return (intent, reply). The reply is None for messages the model
+        answers: intent None, or SENSITIVE (add SAFETY_CONTEXT to the prompt).
+        """
+        intent = self.classify(message)
+        PREFILTER_RESULTS.inc(intent=intent or "passthrough")
+        if intent is None or intent == SENSITIVE:
+            return intent, None
+        reply = self.responses[intent].format(first_name=first_name)
+        # "¡Hola, !" -> "¡Hola!" when the user has no name on file
+        return intent, reply.replace(", !", "!")
+
+
+prefilter = MessagePrefilter()
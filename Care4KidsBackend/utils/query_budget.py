@@ -0,0 +1,164 @@
+import functools
+import logging
+import traceback
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Transaction control is not counted: BEGIN in autocommit becomes SAVEPOINT
+# plus RELEASE inside an outer atomic block (tests), and may repeat freely
+_TRANSACTION_PREFIXES = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")
+
+OFF = "off"
+LOG = "log"
+RAISE = "raise"
+
+QUERY_BUDGET_VIOLATIONS = metrics.registry.counter(
+    "query_budget_violations_total",
+    "View calls over their SQL query budget or repeating a query (N+1)",
+    ["view", "kind"],
+)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view or block issued more SQL than declared, or repeated a query"""
+
+
+def _config():
+    return getattr(settings, "QUERY_BUDGETS", {})
+
+
+def _caller():
+    """file:line of the innermost project frame outside Django and this module"""
+    base = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if (
+            frame.filename.startswith(base)
+            and frame.filename != __file__
+            and "site-packages" not in frame.filename
+        ):
+            return f"{frame.filename[len(base) + 1 :]}:{frame.lineno}"
+    return "?"
+
+
+class QueryRecorder:
+    """
+    Record the SQL issued on every database connection of this thread
+    while used as a context manager.
+
+    Django passes the SQL with placeholders and the parameters apart, so
+    a query template repeated with different parameters (the N+1 shape)
+    is simply a repeated string. Where it first repeats is captured, which
+    costs one stack walk per repeated template. Transaction control
+    statements are not recorded.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.repeated_at = {}
+        self._counts = Counter()
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.lstrip().upper().startswith(_TRANSACTION_PREFIXES):
+            self.queries.append(sql)
+            self._counts[sql] += 1
+            if self._counts[sql] == 2:
+                self.repeated_at[sql] = _caller()
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, threshold):
+        """(sql, count, location) of templates run at least ``threshold`` times"""
+        return [
+            (sql, count, self.repeated_at.get(sql, "?"))
+            for sql, count in self._counts.most_common()
+            if count >= threshold
+        ]
+
+    def problems(self, max_queries, threshold=None, n_plus_one=True):
+        """(kind, message) pairs for a budget overrun and suspected N+1s"""
+        threshold = threshold or _config().get("N_PLUS_ONE_THRESHOLD", 3)
+        found = []
+        if max_queries is not None and len(self) > max_queries:
+            listing = "\n".join(f"  {sql}" for sql in self.queries)
+            found.append(
+                (
+                    "budget",
+                    f"{len(self)} queries, budget is {max_queries}:\n{listing}",
+                )
+            )
+        for sql, count, location in self.repeated(threshold) if n_plus_one else ():
+            found.append(("n_plus_one", f"N+1 suspected at {location}: {count}x {sql}"))
+        return found
+
+
+def query_budget(max_queries, n_plus_one=True):
+    """
+    Declare the most SQL queries a view handler may issue (None: no limit)
+    and whether repeating a query counts as an N+1.
+
+    Authentication runs before the handler and is not counted, nor are
+    queries made while a streaming response is consumed. Depending on
+    QUERY_BUDGETS["MODE"], overruns and repeated queries are ignored
+    ("off"), logged and counted in metrics ("log") or raised as
+    QueryBudgetExceeded ("raise", for development and tests).
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            mode = _config().get("MODE", OFF)
+            if mode == OFF:
+                return handler(view, request, *args, **kwargs)
+            with QueryRecorder() as recorder:
+                response = handler(view, request, *args, **kwargs)
+            problems = recorder.problems(max_queries, n_plus_one=n_plus_one)
+            if problems:
+                name = f"{type(view).__name__}.{handler.__name__}"
+                for kind, message in problems:
+                    QUERY_BUDGET_VIOLATIONS.inc(view=name, kind=kind)
+                    logger.warning("%s: %s", name, message)
+                if mode == RAISE:
+                    raise QueryBudgetExceeded(
+                        f"{name}: " + "\n".join(message for _, message in problems)
+                    )
+            return response
+
+        wrapper.query_budget = max_queries
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def assert_max_queries(max_queries, n_plus_one_threshold=None):
+    """
+    Test helper: fail if the block issues more than ``max_queries`` SQL
+    queries or repeats one ``n_plus_one_threshold`` times.
+
+        with assert_max_queries(3):
+            client.post("/api/invitations/check/", {...})
+    """
+    with QueryRecorder() as recorder:
+        yield recorder
+    problems = recorder.problems(max_queries, n_plus_one_threshold)
+    if problems:
+        raise QueryBudgetExceeded("\n".join(message for _, message in problems))
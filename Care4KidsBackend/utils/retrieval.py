@@ -0,0 +1,198 @@
+# utils/retrieval.py
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+
+from utils.prefilter import normalize
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = frozenset(
+    """
+    a al algo como con cual cuando de del desde donde el ella ellas ellos en
+    entre era es esa ese eso esta este esto estos fue ha hay la las le les lo
+    los mas me mi mis muy nada ni no nos o para pero por que se sea si sin sobre
+    su sus te tu tus un una uno unos y ya yo
+    hijo hija hijos hijas nino nina ninos ninas quiere hacer puedo
+    """.split()
+)
+
+
+def tokenize(text):
+    """Normalized, stopword-free terms with a light plural/gender strip"""
+    terms = []
+    for word in normalize(text).split():
+        if word in STOPWORDS or len(word) < 2:
+            continue
+        # hijos/hija/hijo -> hij, adolescentes/adolescente -> adolescent
+        if len(word) > 3 and word.endswith("s"):
+            word = word[:-1]
+        if len(word) > 4 and word[-1] in "aeo":
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def build_index(passages, output_dir, k1=1.2, b=0.75):
+    """
+    Write a BM25 inverted index for ``passages`` (dicts with id/title/text).
+
+    Postings are stored term-major as three flat arrays (offsets, passage
+    ids, precomputed BM25 weights) so a query only sums a few slices.
+    """
+    import numpy as np
+
+    documents = [tokenize(f"{p['title']} {p['text']}") for p in passages]
+    avg_length = sum(len(d) for d in documents) / max(len(documents), 1)
+    postings = {}
+    for doc_id, terms in enumerate(documents):
+        length_norm = k1 * (1 - b + b * len(terms) / avg_length)
+        for term, tf in Counter(terms).items():
+            postings.setdefault(term, []).append(
+                (doc_id, tf * (k1 + 1) / (tf + length_norm))
+            )
+
+    vocabulary = {term: term_id for term_id, term in enumerate(sorted(postings))}
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    doc_ids, weights = [], []
+    for term, term_id in vocabulary.items():
+        entries = postings[term]
+        df = len(entries)
+        idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+        doc_ids.extend(doc_id for doc_id, _ in entries)
+        weights.extend(idf * weight for _, weight in entries)
+        offsets[term_id + 1] = len(doc_ids)
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    np.save(output_dir / "offsets.npy", offsets)
+    np.save(output_dir / "doc_ids.npy", np.asarray(doc_ids, dtype=np.int32))
+    np.save(output_dir / "weights.npy", np.asarray(weights, dtype=np.float32))
+    with open(output_dir / "vocabulary.json", "w", encoding="utf-8") as fh:
+        json.dump(vocabulary, fh, ensure_ascii=False)
+    with open(output_dir / "passages.json", "w", encoding="utf-8") as fh:
+        json.dump(passages, fh, ensure_ascii=False)
+    return len(passages), len(vocabulary)
+
+
+def publish_index(corpus_path, index_root):
+    """
+    Build the index of a corpus into ``index_root/<corpus hash>`` unless it
+    is already there, and return that directory.
+
+    The index is written to a temporary directory and renamed into place,
+    so readers only ever see a complete index, and concurrent builders (one
+    per worker) leave the first finished copy in place. A changed corpus
+    hashes to a new directory and is rebuilt.
+    """
+    data = Path(corpus_path).read_bytes()
+    index_root = Path(index_root)
+    target = index_root / hashlib.sha256(data).hexdigest()[:16]
+    if target.is_dir():
+        return target
+    index_root.mkdir(parents=True, exist_ok=True)
+    building = Path(tempfile.mkdtemp(prefix=".build-", dir=index_root))
+    try:
+        lines = data.decode("utf-8").splitlines()
+        passages = [json.loads(line) for line in lines if line.strip()]
+        build_index(passages, building)
+        try:
+            os.rename(building, target)
+        except OSError:
+            if not target.is_dir():
+                raise
+            # Another worker published the same corpus first
+    finally:
+        shutil.rmtree(building, ignore_errors=True)
+    return target
+
+
+class RetrievalIndex:
+    """BM25 index whose postings are memory-mapped from build_index() output"""
+
+    def __init__(self, index_dir):
+        import numpy as np
+
+        self._np = np
+        index_dir = Path(index_dir)
+        self.offsets = np.load(index_dir / "offsets.npy", mmap_mode="r")
+        self.doc_ids = np.load(index_dir / "doc_ids.npy", mmap_mode="r")
+        self.weights = np.load(index_dir / "weights.npy", mmap_mode="r")
+        with open(index_dir / "vocabulary.json", encoding="utf-8") as fh:
+            self.vocabulary = json.load(fh)
+        with open(index_dir / "passages.json", encoding="utf-8") as fh:
+            self.passages = json.load(fh)
+
+    def search(self, query, k=3, min_score=0.5, min_ratio=0.5):
+        """Return up to ``k`` (score, passage) pairs, best first"""
+        np = self._np
+        terms = tokenize(query)
+        term_ids = {self.vocabulary[t] for t in terms if t in self.vocabulary}
+        if not term_ids or not self.passages:
+            return []
+        scores = np.zeros(len(self.passages), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # A term lists each passage once, so fancy-index += is safe
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        # Drop weak matches, both absolutely and relative to the best one
+        cutoff = max(min_score, float(scores[top[0]]) * min_ratio)
+        return [(float(scores[i]), self.passages[i]) for i in top if scores[i] >= cutoff]
+
+
+_index = None
+_index_lock = threading.Lock()
+_retry_at = 0.0
+
+
+def get_index():
+    """
+    Load (building from RETRIEVAL_CORPUS if needed) the shared index, or
+    None. After a failure, loading is retried every RETRIEVAL_RETRY_INTERVAL
+    seconds instead of on every request.
+    """
+    global _index, _retry_at
+    if _index is None and time.monotonic() >= _retry_at:
+        with _index_lock:
+            if _index is None and time.monotonic() >= _retry_at:
+                try:
+                    _index = RetrievalIndex(
+                        publish_index(
+                            settings.RETRIEVAL_CORPUS, settings.RETRIEVAL_INDEX_DIR
+                        )
+                    )
+                except Exception as e:
+                    _retry_at = time.monotonic() + getattr(
+                        settings, "RETRIEVAL_RETRY_INTERVAL", 60
+                    )
+                    logger.warning("Retrieval index unavailable: %s", e)
+    return _index
+
+
+def reset_index():
+    """Drop the loaded index so the next get_index() loads it again"""
+    global _index, _retry_at
+    with _index_lock:
+        _index, _retry_at = None, 0.0
+
+
+def retrieve(query, k=None):
+    """Top-k curated passages for a query; [] if the index is unavailable"""
+    index = get_index()
+    if index is None:
+        return []
+    results = index.search(query, k or settings.RETRIEVAL_TOP_K)
+    return [passage for _, passage in results]
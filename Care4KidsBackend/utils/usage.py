@@ -0,0 +1,167 @@
+# utils/usage.py
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+
+from utils.periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+USAGE_COLLECTION = "llm_usage"
+
+
+def estimate_tokens(prompt, response):
+    """Token counts reported by Gemini, or a ~4 chars/token estimate"""
+    usage = getattr(response, "usage_metadata", None)
+    total = getattr(usage, "total_token_count", None)
+    if total:
+        return int(total)
+    return (len(prompt) + len(getattr(response, "text", "") or "")) // 4
+
+
+def _today():
+    return timezone.now().date().isoformat()
+
+
+def _usage_id(day, scope, subject_id):
+    return f"{day}:{scope}:{subject_id}"
+
+
+class UsageTracker:
+    """
+    Per-user and per-family daily LLM token/request counters.
+
+    Increments stay in memory and are flushed to MongoDB as one batch of
+    upserts every LLM_USAGE_FLUSH_INTERVAL seconds; the same flush reads
+    back the day's totals (all processes) for the subjects seen here, so
+    check() never touches the database. A subject's usage from other
+    processes is therefore visible after at most one flush interval.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # usage id -> [tokens, requests]
+        self._pending = defaultdict(lambda: [0, 0])
+        self._flushing = {}
+        self._totals = {}
+        # Usage ids whose totals are read back on each flush
+        self._watched = set()
+        self._flush_lock = threading.Lock()
+        self._flusher = PeriodicTask(
+            "llm-usage-flush",
+            getattr(settings, "LLM_USAGE_FLUSH_INTERVAL", 10),
+            self.flush,
+        )
+
+    def _current(self, usage_id):
+        tokens, requests = self._totals.get(usage_id, (0, 0))
+        for source in (self._flushing, self._pending):
+            if usage_id in source:
+                tokens += source[usage_id][0]
+                requests += source[usage_id][1]
+        return tokens, requests
+
+    def usage(self, scope, subject_id, day=None):
+        with self._lock:
+            return self._current(_usage_id(day or _today(), scope, subject_id))
+
+    def check(self, user_id, family_id):
+        """Return (allowed, reason) against LLM_QUOTAS using in-memory state"""
+        quotas = getattr(settings, "LLM_QUOTAS", {})
+        day = _today()
+        subjects = [("user", user_id)]
+        if family_id:
+            subjects.append(("family", family_id))
+        with self._lock:
+            for scope, subject_id in subjects:
+                usage_id = _usage_id(day, scope, subject_id)
+                self._watched.add(usage_id)
+                tokens, requests = self._current(usage_id)
+                token_quota = quotas.get(f"{scope}_daily_tokens")
+                request_quota = quotas.get(f"{scope}_daily_requests")
+                if token_quota and tokens >= token_quota:
+                    return False, f"{scope}_daily_tokens"
+                if request_quota and requests >= request_quota:
+                    return False, f"{scope}_daily_requests"
+        self._flusher.start()
+        return True, None
+
+    def record(self, user_id, family_id, tokens):
+        day = _today()
+        with self._lock:
+            for scope, subject_id in (("user", user_id), ("family", family_id)):
+                if subject_id:
+                    usage_id = _usage_id(day, scope, subject_id)
+                    self._watched.add(usage_id)
+                    counters = self._pending[usage_id]
+                    counters[0] += tokens
+                    counters[1] += 1
+        self._flusher.start()
+
+    def flush(self):
+        """Write pending increments in one bulk upsert and refresh totals"""
+        from pymongo import UpdateOne
+
+        from utils.mongodb import mongodb_connection
+
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending and not self._watched:
+                    return
+                self._flushing = dict(self._pending)
+                self._pending = defaultdict(lambda: [0, 0])
+
+            collection = mongodb_connection.get_collection(USAGE_COLLECTION)
+            now = timezone.now()
+            operations = []
+            for usage_id, (tokens, requests) in self._flushing.items():
+                day, scope, subject_id = usage_id.split(":", 2)
+                operations.append(
+                    UpdateOne(
+                        {"_id": usage_id},
+                        {
+                            "$inc": {"tokens": tokens, "requests": requests},
+                            "$set": {"updated_at": now},
+                            "$setOnInsert": {
+                                "day": day,
+                                "scope": scope,
+                                "subject_id": subject_id,
+                            },
+                        },
+                        upsert=True,
+                    )
+                )
+            try:
+                if operations:
+                    collection.bulk_write(operations, ordered=False)
+            except Exception:
+                # Put the batch back so it's retried with the next flush
+                with self._lock:
+                    for usage_id, (tokens, requests) in self._flushing.items():
+                        self._pending[usage_id][0] += tokens
+                        self._pending[usage_id][1] += requests
+                    self._flushing = {}
+                raise
+
+            # Refresh today's totals for every subject this process has seen
+            day = _today()
+            with self._lock:
+                self._watched = {u for u in self._watched if u.startswith(day)}
+                watched = list(self._watched)
+            totals = {}
+            for document in collection.find(
+                {"_id": {"$in": watched}}, projection={"tokens": 1, "requests": 1}
+            ):
+                totals[document["_id"]] = (
+                    document.get("tokens", 0),
+                    document.get("requests", 0),
+                )
+            with self._lock:
+                self._totals = totals
+                self._flushing = {}
+
+
+usage_tracker = UsageTracker()